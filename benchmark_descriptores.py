@@ -0,0 +1,119 @@
+# benchmark_descriptores.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Compara configuraciones de descriptores apilados (tarea2-extractor.py --apilar --paso)
+# en los datasets de evaluarTarea2.py: cantidad de descriptores de Q y R, tiempo de
+# búsqueda y F1-IOU calculado igual que en evaluarTarea2.py.
+# Cada configuración se escribe apilar:paso_Q:paso_R[:contexto], por ejemplo 4:1:2:concatenar.
+# Uso:
+#   python benchmark_descriptores.py a b [--configuraciones 1:1:1 4:1:2 ...] [--indice flann]
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+from util import Descriptores
+from evaluarTarea2 import Evaluacion
+
+CONFIGURACIONES_POR_OMISION = ["1:1:1", "1:1:2", "4:1:2", "4:2:4", "8:2:4", "4:1:2:estadisticas"]
+
+
+def leer_configuracion(texto):
+    partes = texto.split(":")
+    contexto = partes[3] if len(partes) > 3 else "concatenar"
+    return {'nombre': texto, 'apilar': int(partes[0]), 'paso_Q': int(partes[1]), 'paso_R': int(partes[2]),
+            'contexto': contexto}
+
+
+def ejecutar(comando):
+    t0 = time.time()
+    resultado = subprocess.run(comando, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if resultado.returncode != 0:
+        raise Exception("ERROR en comando: " + " ".join(comando))
+    return time.time() - t0
+
+
+def calcular_f1_iou(archivo_gt, archivo_detecciones):
+    # mismas métricas que evaluarTarea2.py, sin imprimir cada detección
+    ev = Evaluacion()
+    ev.leer_archivo_gt(archivo_gt)
+    ev.leer_archivo_detecciones(archivo_detecciones)
+    ev.evaluar_cada_deteccion()
+    ev.calcular_metricas()
+    return ev.resultado_global.f1_iou
+
+
+def medir_configuracion(configuracion, carpeta_dataset, carpeta_trabajo, nombre_indice):
+    if os.path.exists(carpeta_trabajo):
+        shutil.rmtree(carpeta_trabajo)
+    os.makedirs(carpeta_trabajo)
+    dir_Q = os.path.join(carpeta_trabajo, "descriptores_radio")
+    dir_R = os.path.join(carpeta_trabajo, "descriptores_canciones")
+    archivo_similares = os.path.join(carpeta_trabajo, "similares.bin")
+    archivo_detecciones = os.path.join(carpeta_trabajo, "detecciones.txt")
+    opciones = ["--apilar", str(configuracion['apilar']), "--contexto", configuracion['contexto']]
+
+    segundos_extraccion = ejecutar([sys.executable, "tarea2-extractor.py", os.path.join(carpeta_dataset, "radio"),
+                                    dir_Q, "--paso", str(configuracion['paso_Q'])] + opciones)
+    segundos_extraccion += ejecutar([sys.executable, "tarea2-extractor.py",
+                                     os.path.join(carpeta_dataset, "canciones"), dir_R,
+                                     "--paso", str(configuracion['paso_R'])] + opciones)
+    segundos_busqueda = ejecutar([sys.executable, "tarea2-busqueda.py", dir_Q, dir_R, archivo_similares,
+                                  "--indice", nombre_indice])
+    segundos_deteccion = ejecutar([sys.executable, "tarea2-deteccion.py", archivo_similares, archivo_detecciones])
+
+    return {
+        'configuracion': configuracion['nombre'],
+        'descriptores_Q': len(Descriptores(dir_Q)),
+        'descriptores_R': len(Descriptores(dir_R)),
+        'dim': Descriptores(dir_R).dim,
+        'extraccion_s': segundos_extraccion,
+        'busqueda_s': segundos_busqueda,
+        'deteccion_s': segundos_deteccion,
+        'f1_iou': calcular_f1_iou(os.path.join(carpeta_dataset, "gt.txt"), archivo_detecciones),
+    }
+
+
+def benchmark_descriptores(letras_datasets, configuraciones, nombre_indice="flann",
+                           carpeta_trabajo="benchmark_descriptores"):
+    resultados = []
+    for letra in letras_datasets:
+        nombre_dataset = "dataset_" + letra
+        carpeta_dataset = os.path.join("datasets", nombre_dataset)
+        for configuracion in configuraciones:
+            print("Midiendo {} en {}...".format(configuracion['nombre'], nombre_dataset))
+            resultado = medir_configuracion(configuracion, carpeta_dataset,
+                                            os.path.join(carpeta_trabajo, nombre_dataset), nombre_indice)
+            resultado['dataset'] = nombre_dataset
+            resultados.append(resultado)
+    shutil.rmtree(carpeta_trabajo, ignore_errors=True)
+
+    print()
+    print("{:10s} {:22s} {:>5s} {:>10s} {:>10s} {:>12s} {:>12s} {:>8s}".format(
+        "dataset", "apilar:pasoQ:pasoR", "dim", "filas Q", "filas R", "extraer(s)", "buscar(s)", "F1-IOU"))
+    for r in resultados:
+        print("{:10s} {:22s} {:5d} {:10d} {:10d} {:12.1f} {:12.2f} {:8.3f}".format(
+            r['dataset'], r['configuracion'], r['dim'], r['descriptores_Q'], r['descriptores_R'],
+            r['extraccion_s'], r['busqueda_s'], r['f1_iou']))
+    return resultados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python benchmark_descriptores.py [letras_datasets] [--configuraciones ...]")
+    parser.add_argument("datasets", nargs="*", default=["a", "b", "c", "d"])
+    parser.add_argument("--configuraciones", nargs="+", default=CONFIGURACIONES_POR_OMISION,
+                        help="apilar:paso_Q:paso_R[:contexto], contexto es concatenar o estadisticas")
+    parser.add_argument("--indice", default="flann", help="índice de vecinos que usa tarea2-busqueda.py")
+    parser.add_argument("--json", default=None, help="archivo donde guardar los resultados")
+    args = parser.parse_args()
+
+    resultados = benchmark_descriptores(args.datasets, [leer_configuracion(c) for c in args.configuraciones],
+                                        args.indice)
+    if args.json is not None:
+        with open(args.json, 'w') as handle:
+            json.dump(resultados, handle, indent=2)
@@ -0,0 +1,146 @@
+# benchmark_indices.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Compara los índices de indices.py sobre descriptores ya extraídos:
+# tiempo de construcción, consultas por segundo, tamaño en memoria y recall@k
+# con respecto a la búsqueda exacta. También se informa la aceleración y la pérdida
+# de recall de cada índice con respecto a un índice de referencia (por omisión flann),
+# útil para ver qué se pierde con los índices comprimidos (faiss-pq, faiss-ivfpq).
+# Uso:
+#   python benchmark_indices.py [carpeta_descriptores_Q] [carpeta_descriptores_R] [--indices flann annoy ...]
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+from util import Descriptores
+from indices import crear_indice, NOMBRES_INDICES, IndiceExacto
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def memoria_proceso():
+    # memoria residente del proceso en bytes (0 si psutil no está instalado)
+    if psutil is None:
+        return 0
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def tamano_indice(indice, matriz):
+    # tamaño del índice serializado, o de la matriz si el índice no se guarda
+    if not indice.persistente:
+        return matriz.nbytes
+    with tempfile.TemporaryDirectory() as carpeta:
+        archivo = os.path.join(carpeta, "indice.idx")
+        indice.guardar(archivo)
+        return os.path.getsize(archivo)
+
+
+def calcular_recall(indices, indices_exactos):
+    # fracción de los k vecinos exactos que el índice también retornó
+    k = indices_exactos.shape[1]
+    aciertos = 0
+    for fila, fila_exacta in zip(indices, indices_exactos):
+        aciertos += len(np.intersect1d(fila, fila_exacta))
+    return aciertos / (k * len(indices_exactos))
+
+
+def medir_indice(nombre, matriz_R, consultas, k, cores, indices_exactos, tamano_bloque):
+    indice = crear_indice(nombre, cores=cores)
+    memoria_antes = memoria_proceso()
+    t0 = time.time()
+    indice.construir(matriz_R)
+    segundos_construccion = time.time() - t0
+    memoria_rss = memoria_proceso() - memoria_antes
+
+    t0 = time.time()
+    indices = np.empty((len(consultas), k), dtype=np.int64)
+    for inicio in range(0, len(consultas), tamano_bloque):
+        bloque = consultas[inicio:inicio + tamano_bloque]
+        indices[inicio:inicio + len(bloque)], _ = indice.buscar(bloque, k)
+    segundos_busqueda = time.time() - t0
+
+    return {
+        'indice': nombre,
+        'construccion_s': segundos_construccion,
+        'consultas_por_s': len(consultas) / max(segundos_busqueda, 1e-9),
+        'tamano_mb': tamano_indice(indice, matriz_R) / 2 ** 20,
+        'bytes_por_frame': tamano_indice(indice, matriz_R) / len(matriz_R),
+        'rss_mb': memoria_rss / 2 ** 20,
+        'recall': calcular_recall(indices, indices_exactos),
+    }
+
+
+def benchmark_indices(carpeta_descriptores_Q, carpeta_descriptores_R, nombres_indices, k, num_consultas, cores,
+                      tamano_bloque=65536, referencia="flann"):
+    descriptores_Q = Descriptores(carpeta_descriptores_Q)
+    descriptores_R = Descriptores(carpeta_descriptores_R)
+    matriz_R = np.asarray(descriptores_R.matriz)
+    print("R: {} descriptores, Q: {} descriptores".format(len(descriptores_R), len(descriptores_Q)))
+
+    # muestra fija de consultas para que todos los índices reciban las mismas
+    filas = np.arange(len(descriptores_Q))
+    if num_consultas < len(filas):
+        filas = np.sort(np.random.default_rng(0).choice(filas, num_consultas, replace=False))
+    consultas = np.ascontiguousarray(descriptores_Q.matriz[filas], dtype=np.float32)
+    print("Calculando vecinos exactos para {} consultas...".format(len(consultas)))
+    exacto = IndiceExacto()
+    exacto.construir(matriz_R)
+    indices_exactos, _ = exacto.buscar(consultas, k)
+
+    resultados = []
+    for nombre in nombres_indices:
+        print("Midiendo {}...".format(nombre))
+        resultados.append(medir_indice(nombre, matriz_R, consultas, k, cores, indices_exactos, tamano_bloque))
+
+    if referencia not in nombres_indices:
+        referencia = nombres_indices[0]
+    base = resultados[nombres_indices.index(referencia)]
+    for r in resultados:
+        r['aceleracion'] = r['consultas_por_s'] / base['consultas_por_s']
+        r['perdida_recall'] = base['recall'] - r['recall']
+
+    print()
+    print("{:12s} {:>12s} {:>14s} {:>10s} {:>11s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+        "indice", "construir(s)", "consultas/s", "tamano(MB)", "bytes/frame", "rss(MB)", "recall@" + str(k),
+        "acelerac.", "perd.rec."))
+    for r in resultados:
+        print("{:12s} {:12.2f} {:14.0f} {:10.1f} {:11.1f} {:10.1f} {:10.3f} {:9.2f}x {:10.3f}".format(
+            r['indice'], r['construccion_s'], r['consultas_por_s'], r['tamano_mb'], r['bytes_por_frame'],
+            r['rss_mb'], r['recall'], r['aceleracion'], r['perdida_recall']))
+    print("(aceleración y pérdida de recall con respecto a {})".format(referencia))
+    return resultados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python benchmark_indices.py [carpeta_descriptores_Q] [carpeta_descriptores_R] [--indices ...]")
+    parser.add_argument("carpeta_descriptores_Q")
+    parser.add_argument("carpeta_descriptores_R")
+    parser.add_argument("--indices", nargs="+", default=NOMBRES_INDICES, choices=NOMBRES_INDICES)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--consultas", type=int, default=10000,
+                        help="cantidad de descriptores de Q usados como consultas")
+    parser.add_argument("--cores", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--referencia", default="flann",
+                        help="índice con el que se comparan la velocidad y el recall de los demás")
+    parser.add_argument("--json", default=None, help="archivo donde guardar los resultados")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.carpeta_descriptores_Q) or not os.path.isdir(args.carpeta_descriptores_R):
+        print("ERROR: no existen las carpetas de descriptores")
+        sys.exit(1)
+
+    resultados = benchmark_indices(args.carpeta_descriptores_Q, args.carpeta_descriptores_R, args.indices,
+                                   args.k, args.consultas, args.cores, referencia=args.referencia)
+    if args.json is not None:
+        with open(args.json, 'w') as handle:
+            json.dump(resultados, handle, indent=2)
@@ -0,0 +1,103 @@
+# benchmark_mfcc.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Compara el cálculo de MFCC de mfcc.py (solo numpy) con el anterior basado en librosa:
+# tiempo de un proceso nuevo hasta tener los MFCC de un audio corto (importaciones y
+# compilación de numba incluidas), tiempo por archivo ya con todo cargado, y la
+# diferencia máxima entre ambos descriptores.
+# Uso:
+#   python benchmark_mfcc.py [carpeta_audios] [--archivos N]
+
+import sys
+import time
+import argparse
+import subprocess
+import numpy as np
+import util
+import mfcc
+
+SAMPLE_RATE = 7000
+N_FFT = 2048
+HOP_LENGTH = 256
+N_MFCC = 20
+
+
+def calcular_mfcc_librosa(samples, sample_rate, n_fft, hop_length, n_mfcc):
+    # implementación anterior de tarea2-extractor.py, como referencia
+    import librosa
+    samples = librosa.util.normalize(samples)
+    mfcc_librosa = librosa.feature.mfcc(y=samples, sr=sample_rate, n_mfcc=n_mfcc, n_fft=n_fft,
+                                        hop_length=hop_length).T
+    tiempos_inicio = librosa.frames_to_time(np.arange(len(mfcc_librosa)), sr=sample_rate, hop_length=hop_length,
+                                            n_fft=n_fft)
+    return mfcc.normalizar_frames(mfcc_librosa), tiempos_inicio
+
+
+# programa que se ejecuta en un proceso nuevo para medir el tiempo de partida
+PROGRAMA_PARTIDA = """
+import numpy as np
+samples = np.random.default_rng(0).standard_normal({muestras}).astype(np.float32)
+{importacion}
+calcular(samples, {sample_rate}, {n_fft}, {hop_length}, {n_mfcc})
+"""
+
+IMPORTACIONES = {
+    'librosa': "from benchmark_mfcc import calcular_mfcc_librosa as calcular",
+    'numpy': "from mfcc import calcular_mfcc as calcular",
+}
+
+
+def medir_partida(motor, repeticiones=3):
+    # mejor tiempo de varias ejecuciones de un proceso nuevo
+    programa = PROGRAMA_PARTIDA.format(muestras=SAMPLE_RATE, importacion=IMPORTACIONES[motor],
+                                       sample_rate=SAMPLE_RATE, n_fft=N_FFT, hop_length=HOP_LENGTH, n_mfcc=N_MFCC)
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.time()
+        subprocess.run([sys.executable, "-c", programa], check=True)
+        tiempos.append(time.time() - t0)
+    return min(tiempos)
+
+
+def benchmark_mfcc(carpeta_audios, num_archivos):
+    print("Tiempo de partida (proceso nuevo, 1 s de audio):")
+    partida = {motor: medir_partida(motor) for motor in IMPORTACIONES}
+    for motor, segundos in partida.items():
+        print("  {:8s} {:6.2f} s".format(motor, segundos))
+
+    archivos = util.listar_archivos_con_extension(carpeta_audios, ".m4a")[:num_archivos]
+    audios = [util.decodificar_audio(carpeta_audios + "/" + archivo, SAMPLE_RATE) for archivo in archivos]
+    # primera llamada fuera de la medición, para no contar la compilación de librosa
+    calcular_mfcc_librosa(audios[0][:SAMPLE_RATE], SAMPLE_RATE, N_FFT, HOP_LENGTH, N_MFCC)
+
+    segundos_librosa = 0
+    segundos_numpy = 0
+    diferencia_maxima = 0
+    segundos_audio = 0
+    for samples in audios:
+        t0 = time.time()
+        descriptores_librosa, tiempos_librosa = calcular_mfcc_librosa(samples, SAMPLE_RATE, N_FFT, HOP_LENGTH, N_MFCC)
+        segundos_librosa += time.time() - t0
+        t0 = time.time()
+        descriptores_numpy, tiempos_numpy = mfcc.calcular_mfcc(samples, SAMPLE_RATE, N_FFT, HOP_LENGTH, N_MFCC)
+        segundos_numpy += time.time() - t0
+        if not np.array_equal(tiempos_librosa, tiempos_numpy):
+            raise Exception("los tiempos de inicio no coinciden")
+        diferencia_maxima = max(diferencia_maxima, float(np.abs(descriptores_librosa - descriptores_numpy).max()))
+        segundos_audio += len(samples) / SAMPLE_RATE
+
+    print("Por archivo ({} archivos, {:.0f} s de audio):".format(len(audios), segundos_audio))
+    print("  librosa  {:6.3f} s por archivo".format(segundos_librosa / len(audios)))
+    print("  numpy    {:6.3f} s por archivo".format(segundos_numpy / len(audios)))
+    print("Diferencia máxima entre descriptores: {:.2e}".format(diferencia_maxima))
+    return partida, segundos_librosa, segundos_numpy, diferencia_maxima
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python benchmark_mfcc.py [carpeta_audios] [--archivos N]")
+    parser.add_argument("carpeta_audios")
+    parser.add_argument("--archivos", type=int, default=20, help="cantidad de archivos a medir")
+    args = parser.parse_args()
+    benchmark_mfcc(args.carpeta_audios, args.archivos)
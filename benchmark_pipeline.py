@@ -0,0 +1,206 @@
+# benchmark_pipeline.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Mide la tarea completa (extracción de Q y R, búsqueda y detección) sobre datasets sintéticos
+# de generar_dataset.py, variando las horas de radio de Q y la cantidad de canciones de R.
+# Para cada combinación informa el tiempo total, CPU y memoria de cada etapa (como
+# evaluarTarea2.py), el rendimiento de cada una y el F1-IOU. Con --proyectar se ajusta un
+# modelo lineal por etapa a las mediciones y se estima el costo para otros tamaños.
+# Uso:
+#   python benchmark_pipeline.py [carpeta_catalogo] [--horas-q 0.1 0.5] [--canciones-r 10 50] [--proyectar 24:5000]
+
+import os
+import sys
+import json
+import math
+import shutil
+import argparse
+import numpy as np
+from util import Descriptores, leer_ventanas_similares
+from evaluarTarea2 import Evaluacion, ejecutar_medido
+from generar_dataset import generar_dataset
+from indices import NOMBRES_INDICES
+
+ETAPAS = ["extractor_Q", "extractor_R", "busqueda", "deteccion"]
+
+
+def medir(comando):
+    code, medicion = ejecutar_medido(comando)
+    if code != 0:
+        raise Exception("ERROR en comando: " + " ".join(comando))
+    return medicion
+
+
+def calcular_f1_iou(archivo_gt, archivo_detecciones):
+    # mismas métricas que evaluarTarea2.py, sin imprimir cada detección
+    ev = Evaluacion()
+    ev.leer_archivo_gt(archivo_gt)
+    ev.leer_archivo_detecciones(archivo_detecciones)
+    ev.evaluar_cada_deteccion()
+    ev.calcular_metricas()
+    return ev.resultado_global.f1_iou
+
+
+def segundos_de_audio(descriptores):
+    # duración que cubren los descriptores MFCC (no se puede saber con huellas)
+    parametros = descriptores.parametros or {}
+    if 'n_mfcc' not in parametros:
+        return None
+    return len(descriptores) * parametros.get('paso', 1) * parametros['hop_length'] / parametros['sample_rate']
+
+
+def preparar_dataset(carpeta_catalogo, carpeta_dataset, horas_Q, canciones_R, minutos_por_radio, semilla):
+    # se reutiliza si ya se generó con los mismos parámetros en una ejecución anterior
+    if os.path.isfile(os.path.join(carpeta_dataset, "gt.txt")):
+        return
+    radios = max(1, math.ceil(horas_Q * 60 / minutos_por_radio))
+    generar_dataset(carpeta_catalogo, carpeta_dataset, radios=radios, minutos=horas_Q * 60 / radios,
+                    canciones=canciones_R, semilla=semilla)
+
+
+def medir_combinacion(carpeta_dataset, carpeta_trabajo, nombre_indice, opciones_extractor):
+    if os.path.exists(carpeta_trabajo):
+        shutil.rmtree(carpeta_trabajo)
+    os.makedirs(carpeta_trabajo)
+    dir_Q = os.path.join(carpeta_trabajo, "descriptores_radio")
+    dir_R = os.path.join(carpeta_trabajo, "descriptores_canciones")
+    archivo_similares = os.path.join(carpeta_trabajo, "similares.bin")
+    archivo_detecciones = os.path.join(carpeta_trabajo, "detecciones.txt")
+
+    etapas = {
+        'extractor_Q': medir([sys.executable, "tarea2-extractor.py", os.path.join(carpeta_dataset, "radio"), dir_Q]
+                             + opciones_extractor),
+        'extractor_R': medir([sys.executable, "tarea2-extractor.py", os.path.join(carpeta_dataset, "canciones"),
+                              dir_R] + opciones_extractor),
+        'busqueda': medir([sys.executable, "tarea2-busqueda.py", dir_Q, dir_R, archivo_similares,
+                           "--indice", nombre_indice]),
+        'deteccion': medir([sys.executable, "tarea2-deteccion.py", archivo_similares, archivo_detecciones]),
+    }
+    descriptores_Q = Descriptores(dir_Q)
+    descriptores_R = Descriptores(dir_R)
+    segundos_Q = segundos_de_audio(descriptores_Q)
+    segundos_R = segundos_de_audio(descriptores_R)
+    num_ventanas = len(leer_ventanas_similares(archivo_similares))
+    return {
+        'etapas': etapas,
+        'descriptores_Q': len(descriptores_Q),
+        'descriptores_R': len(descriptores_R),
+        'horas_R': None if segundos_R is None else segundos_R / 3600,
+        'ventanas_similares': num_ventanas,
+        # rendimiento de cada etapa
+        'extraccion_Q_x_tiempo_real': None if segundos_Q is None else segundos_Q / etapas['extractor_Q']['wall_s'],
+        'extraccion_R_x_tiempo_real': None if segundos_R is None else segundos_R / etapas['extractor_R']['wall_s'],
+        'busqueda_descriptores_por_s': len(descriptores_Q) / etapas['busqueda']['wall_s'],
+        'deteccion_ventanas_por_s': num_ventanas / etapas['deteccion']['wall_s'],
+        'f1_iou': calcular_f1_iou(os.path.join(carpeta_dataset, "gt.txt"), archivo_detecciones),
+    }
+
+
+def variables_modelo(etapa, horas_Q, canciones_R):
+    # costo fijo + términos que dependen del tamaño de lo que procesa cada etapa;
+    # la búsqueda depende de ambos (consultas de Q sobre un índice que crece con R)
+    if etapa == "extractor_Q":
+        return [1.0, horas_Q]
+    if etapa == "extractor_R":
+        return [1.0, canciones_R]
+    if etapa == "busqueda":
+        return [1.0, canciones_R, horas_Q, horas_Q * canciones_R]
+    return [1.0, horas_Q, horas_Q * canciones_R]
+
+
+def proyectar(resultados, tamanos):
+    """
+    Ajusta por mínimos cuadrados un modelo lineal del tiempo total de cada etapa y lo evalúa
+    en cada (horas_Q, canciones_R) de tamanos. Es una extrapolación: con pocas mediciones o
+    tamaños muy lejanos a los medidos solo da un orden de magnitud.
+    """
+    proyecciones = []
+    for horas_Q, canciones_R in tamanos:
+        proyeccion = {'horas_Q': horas_Q, 'canciones_R': canciones_R}
+        for etapa in ETAPAS:
+            X = np.array([variables_modelo(etapa, r['horas_Q'], r['canciones_R']) for r in resultados])
+            y = np.array([r['etapas'][etapa]['wall_s'] for r in resultados])
+            coeficientes = np.linalg.lstsq(X, y, rcond=None)[0]
+            proyeccion[etapa + "_s"] = max(0.0, float(np.dot(variables_modelo(etapa, horas_Q, canciones_R),
+                                                            coeficientes)))
+        proyeccion['total_s'] = sum(proyeccion[etapa + "_s"] for etapa in ETAPAS)
+        proyecciones.append(proyeccion)
+    return proyecciones
+
+
+def formatear(valor, formato):
+    return "-" if valor is None else formato.format(valor)
+
+
+def benchmark_pipeline(carpeta_catalogo, lista_horas_Q, lista_canciones_R, nombre_indice="flann",
+                       opciones_extractor=(), minutos_por_radio=30.0, semilla=0,
+                       carpeta_trabajo="benchmark_pipeline", conservar=False):
+    resultados = []
+    for canciones_R in lista_canciones_R:
+        for horas_Q in lista_horas_Q:
+            nombre = "q{}h_r{}".format(horas_Q, canciones_R)
+            carpeta_dataset = os.path.join(carpeta_trabajo, "datasets", nombre)
+            print("Generando {}...".format(nombre))
+            preparar_dataset(carpeta_catalogo, carpeta_dataset, horas_Q, canciones_R, minutos_por_radio, semilla)
+            print("Midiendo {}...".format(nombre))
+            resultado = medir_combinacion(carpeta_dataset, os.path.join(carpeta_trabajo, "ejecucion"), nombre_indice,
+                                          list(opciones_extractor))
+            resultado.update({'nombre': nombre, 'horas_Q': horas_Q, 'canciones_R': canciones_R})
+            resultados.append(resultado)
+    shutil.rmtree(os.path.join(carpeta_trabajo, "ejecucion"), ignore_errors=True)
+    if not conservar:
+        shutil.rmtree(carpeta_trabajo, ignore_errors=True)
+
+    print()
+    print("{:16s} {:>8s} {:>9s} {:>9s} {:>9s} {:>9s} {:>12s} {:>12s} {:>8s}".format(
+        "Q:R", "horas R", "extrQ(s)", "extrR(s)", "buscar(s)", "detect(s)", "extrQ x real", "desc Q/s", "F1-IOU"))
+    for r in resultados:
+        e = r['etapas']
+        print("{:16s} {:>8s} {:9.1f} {:9.1f} {:9.1f} {:9.1f} {:>12s} {:12.0f} {:8.3f}".format(
+            r['nombre'], formatear(r['horas_R'], "{:.2f}"), e['extractor_Q']['wall_s'], e['extractor_R']['wall_s'],
+            e['busqueda']['wall_s'], e['deteccion']['wall_s'], formatear(r['extraccion_Q_x_tiempo_real'], "{:.0f}"),
+            r['busqueda_descriptores_por_s'], r['f1_iou']))
+    return resultados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python benchmark_pipeline.py [carpeta_catalogo] [--horas-q ...] [--canciones-r ...]")
+    parser.add_argument("carpeta_catalogo", help="carpeta con canciones .m4a para generar los datasets")
+    parser.add_argument("--horas-q", type=float, nargs="+", default=[0.1, 0.25, 0.5],
+                        help="horas de radio de cada dataset")
+    parser.add_argument("--canciones-r", type=int, nargs="+", default=[10, 50],
+                        help="canciones de R de cada dataset (si son más que el catálogo se crean derivadas)")
+    parser.add_argument("--minutos-por-radio", type=float, default=30.0)
+    parser.add_argument("--indice", default="flann", choices=NOMBRES_INDICES,
+                        help="índice de vecinos que usa tarea2-busqueda.py")
+    parser.add_argument("--huellas", action="store_true", help="extraer huellas en vez de MFCC")
+    parser.add_argument("--proyectar", nargs="+", default=[],
+                        help="tamaños horas_Q:canciones_R para estimar el costo, por ejemplo 24:5000")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--carpeta-trabajo", default="benchmark_pipeline")
+    parser.add_argument("--conservar", action="store_true",
+                        help="no borrar los datasets generados, para reutilizarlos en otra ejecución")
+    parser.add_argument("--json", default=None, help="archivo donde guardar los resultados")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.carpeta_catalogo):
+        print("ERROR: no existe {}".format(args.carpeta_catalogo))
+        sys.exit(1)
+    opciones = ["--huellas"] if args.huellas else []
+    resultados = benchmark_pipeline(args.carpeta_catalogo, args.horas_q, args.canciones_r, args.indice, opciones,
+                                    args.minutos_por_radio, args.semilla, args.carpeta_trabajo, args.conservar)
+    proyecciones = []
+    if len(args.proyectar) > 0:
+        tamanos = [(float(t.split(":")[0]), int(t.split(":")[1])) for t in args.proyectar]
+        proyecciones = proyectar(resultados, tamanos)
+        print()
+        print("Proyección (modelo lineal por etapa ajustado a {} mediciones):".format(len(resultados)))
+        for p in proyecciones:
+            print("  {:g} h de Q, {} canciones de R: {}  total={:.0f} s".format(
+                p['horas_Q'], p['canciones_R'], "  ".join("{}={:.0f} s".format(etapa, p[etapa + "_s"])
+                                                        for etapa in ETAPAS), p['total_s']))
+    if args.json is not None:
+        with open(args.json, 'w') as handle:
+            json.dump({'resultados': resultados, 'proyecciones': proyecciones}, handle, indent=2)
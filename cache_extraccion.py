@@ -0,0 +1,200 @@
+# cache_extraccion.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Cache persistente del audio decodificado y de los descriptores de cada archivo, compartido
+# entre ejecuciones y entre datasets. Las entradas se identifican por el hash del contenido del
+# archivo de audio (no por su nombre ni su carpeta) y los parámetros de extracción, así un mismo
+# audio copiado en otra carpeta o en otro dataset se reutiliza, y uno modificado no.
+# Cada entrada es un archivo en la carpeta del cache:
+#   <clave>.audio.f32  -> muestras float32 mono decodificadas con un sample_rate
+#   <clave>.desc.npz   -> descriptores e inicios calculados con unos parámetros
+# El tamaño total se limita a max_mb: cuando se pasa se borran las entradas usadas hace más tiempo
+# (LRU, según la fecha de modificación, que se actualiza en cada uso). Para no recorrer la carpeta en
+# cada escritura, cada proceso lleva una estimación del tamaño (lo que midió el último recorrido más
+# lo que escribió después) y solo la recorre cuando la estimación pasa max_mb, o cada
+# ESCRITURAS_POR_REVISION escrituras para enterarse de lo que escriben otros procesos. Varios procesos pueden
+# usar el mismo cache: cada entrada se escribe en un temporal que se renombra al terminar.
+# Solo se cuentan y se borran los archivos con nombres de entradas (o de sus temporales), así
+# la carpeta puede tener otros archivos sin que el cache los toque.
+# Se activa con --cache carpeta en tarea2-extractor.py y pipeline.py, o con la variable de
+# ambiente TAREA2_CACHE (y TAREA2_CACHE_MB para el tamaño máximo).
+
+import os
+import re
+import time
+import json
+import hashlib
+import numpy as np
+
+VARIABLE_CACHE = "TAREA2_CACHE"
+VARIABLE_CACHE_MB = "TAREA2_CACHE_MB"
+MAX_MB_POR_OMISION = 4096
+# cambiar si cambia el cálculo de los descriptores, para no usar entradas antiguas
+VERSION = 1
+# nombres de las entradas y de sus temporales (<entrada>.<pid>.tmp)
+PATRON_ENTRADA = re.compile(r"^[0-9a-f]{40}\.(audio\.f32|desc\.npz)$")
+PATRON_TEMPORAL = re.compile(r"^[0-9a-f]{40}\.(audio\.f32|desc\.npz)\.[0-9]+\.tmp$")
+# un temporal más antiguo que esto quedó de un proceso que murió a mitad de la escritura
+SEGUNDOS_TEMPORAL_ABANDONADO = 3600
+ESCRITURAS_POR_REVISION = 64
+# al pasarse del máximo se desaloja hasta esta fracción, para no recorrer la carpeta en cada escritura
+FRACCION_TRAS_DESALOJAR = 0.9
+
+# tamaño estimado de cada carpeta de cache en este proceso: carpeta -> [bytes, escrituras sin revisar].
+# No se guarda en CacheExtraccion porque el cache se envía a los workers con cada tarea
+tamanos_estimados = {}
+
+
+def hash_contenido(ruta, bytes_por_bloque=1 << 20):
+    h = hashlib.sha1()
+    with open(ruta, 'rb') as handle:
+        for bloque in iter(lambda: handle.read(bytes_por_bloque), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+class CacheExtraccion:
+    """
+    Cache en disco de audio decodificado y descriptores. Solo guarda la carpeta y el tamaño
+    máximo, así se puede enviar a los procesos del pool de extracción.
+    """
+
+    def __init__(self, carpeta, max_mb=MAX_MB_POR_OMISION):
+        self.carpeta = carpeta
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(carpeta, exist_ok=True)
+
+    def clave(self, hash_audio, parametros):
+        datos = json.dumps({'version': VERSION, 'audio': hash_audio, 'parametros': parametros}, sort_keys=True)
+        return hashlib.sha1(datos.encode("utf-8")).hexdigest()
+
+    def ruta(self, clave, extension):
+        return os.path.join(self.carpeta, clave + extension)
+
+    def abrir(self, ruta):
+        # marca la entrada como recién usada; None si no existe (o se acaba de desalojar)
+        try:
+            os.utime(ruta)
+        except OSError:
+            return None
+        return ruta
+
+    def leer_audio(self, hash_audio, parametros_audio):
+        ruta = self.abrir(self.ruta(self.clave(hash_audio, parametros_audio), ".audio.f32"))
+        if ruta is None:
+            return None
+        try:
+            return np.fromfile(ruta, dtype=np.float32)
+        except OSError:
+            return None
+
+    def guardar_audio(self, hash_audio, parametros_audio, samples):
+        samples = np.ascontiguousarray(samples, dtype=np.float32)
+        self.guardar(self.ruta(self.clave(hash_audio, parametros_audio), ".audio.f32"), samples.nbytes,
+                     lambda handle: samples.tofile(handle))
+
+    def leer_descriptores(self, hash_audio, parametros):
+        ruta = self.abrir(self.ruta(self.clave(hash_audio, parametros), ".desc.npz"))
+        if ruta is None:
+            return None
+        try:
+            with np.load(ruta) as datos:
+                return datos['descriptores'], datos['inicios']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def guardar_descriptores(self, hash_audio, parametros, descriptores, inicios):
+        self.guardar(self.ruta(self.clave(hash_audio, parametros), ".desc.npz"), descriptores.nbytes + inicios.nbytes,
+                     lambda handle: np.savez(handle, descriptores=descriptores, inicios=inicios))
+
+    def guardar(self, ruta, largo, escribir):
+        # una entrada más grande que todo el cache no se guarda (se desalojaría de inmediato)
+        if largo > self.max_bytes:
+            return
+        temporal = "{}.{}.tmp".format(ruta, os.getpid())
+        try:
+            with open(temporal, 'wb') as handle:
+                escribir(handle)
+            os.replace(temporal, ruta)
+        except BaseException:
+            self.borrar(temporal)
+            raise
+        estimado = tamanos_estimados.get(self.carpeta)
+        if estimado is None:
+            self.desalojar()
+            return
+        estimado[0] += largo
+        estimado[1] += 1
+        if estimado[0] > self.max_bytes or estimado[1] >= ESCRITURAS_POR_REVISION:
+            self.desalojar()
+
+    def borrar(self, ruta):
+        try:
+            os.remove(ruta)
+        except OSError:
+            # otro proceso ya la borró
+            pass
+
+    def archivos(self, patron):
+        # (fecha de último uso, tamaño, ruta) de los archivos de la carpeta con nombre según patron
+        resultado = []
+        for nombre in os.listdir(self.carpeta):
+            if not patron.match(nombre):
+                continue
+            ruta = os.path.join(self.carpeta, nombre)
+            try:
+                estado = os.stat(ruta)
+            except OSError:
+                continue
+            resultado.append((estado.st_mtime_ns, estado.st_size, ruta))
+        return resultado
+
+    def entradas(self):
+        # entradas completas
+        return self.archivos(PATRON_ENTRADA)
+
+    def temporales(self):
+        # temporales en escritura; los abandonados se borran
+        limite = time.time_ns() - SEGUNDOS_TEMPORAL_ABANDONADO * 10 ** 9
+        resultado = []
+        for fecha, largo, ruta in self.archivos(PATRON_TEMPORAL):
+            if fecha < limite:
+                self.borrar(ruta)
+            else:
+                resultado.append((fecha, largo, ruta))
+        return resultado
+
+    def desalojar(self):
+        # recorre la carpeta y deja el cache bajo max_bytes; los temporales en escritura ocupan
+        # espacio, pero no se pueden desalojar
+        entradas = self.entradas()
+        total = sum(largo for _, largo, _ in entradas + self.temporales())
+        limite = self.max_bytes if total <= self.max_bytes else self.max_bytes * FRACCION_TRAS_DESALOJAR
+        for _, largo, ruta in sorted(entradas):
+            if total <= limite:
+                break
+            self.borrar(ruta)
+            total -= largo
+        tamanos_estimados[self.carpeta] = [total, 0]
+
+    def tamano_mb(self):
+        return sum(largo for _, largo, _ in self.entradas() + self.temporales()) / (1024 * 1024)
+
+
+def abrir_cache(carpeta=None, max_mb=None):
+    """
+    Cache de la carpeta indicada o de la variable de ambiente TAREA2_CACHE; None si no
+    hay ninguna, y entonces la extracción no usa cache.
+    """
+    if carpeta is None:
+        carpeta = os.environ.get(VARIABLE_CACHE)
+    if not carpeta:
+        return None
+    if max_mb is None:
+        max_mb = float(os.environ.get(VARIABLE_CACHE_MB, MAX_MB_POR_OMISION))
+    cache = CacheExtraccion(carpeta, max_mb)
+    # un máximo menor que el de ejecuciones anteriores se aplica aunque todo se lea del cache
+    cache.desalojar()
+    return cache
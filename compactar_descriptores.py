@@ -0,0 +1,31 @@
+# compactar_descriptores.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Reescribe un almacén de descriptores actualizado de forma incremental: elimina las
+# filas de archivos desactivados y junta todos los segmentos en uno.
+# tarea2-extractor.py --incremental lo lanza en segundo plano cuando hay muchos
+# segmentos o muchas filas inactivas; también se puede ejecutar a mano.
+
+import sys
+import util
+
+
+def compactar(carpeta_descriptores):
+    # el mismo bloqueo que toma tarea2-extractor.py mientras agrega archivos
+    if not util.tomar_bloqueo(carpeta_descriptores):
+        print("ya se está compactando o actualizando {}".format(carpeta_descriptores))
+        return
+    try:
+        util.compactar_descriptores(carpeta_descriptores)
+        print("almacén {} compactado".format(carpeta_descriptores))
+    finally:
+        util.soltar_bloqueo(carpeta_descriptores)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Uso: python compactar_descriptores.py [carpeta_descriptores]")
+        sys.exit(1)
+    compactar(sys.argv[1])
@@ -4,10 +4,14 @@
 
 import sys
 import os
+import json
+import bisect
 import numpy
 import shutil
 import time
 import subprocess
+import threading
+import concurrent.futures
 
 
 class Deteccion:
@@ -129,9 +133,37 @@ class Metricas:
         self.recall_por_tipo = dict()
 
 
+class IndiceGT:
+    # detecciones del gt agrupadas por (radio, cancion) y ordenadas por inicio,
+    # para revisar solo las que pueden intersectar a una deteccion
+    def __init__(self, detecciones_gt):
+        grupos = dict()
+        for det_gt in detecciones_gt:
+            grupos.setdefault((det_gt.radio, det_gt.cancion), []).append(det_gt)
+        self.grupos = dict()
+        for llave, lista in grupos.items():
+            lista.sort(key=lambda x: (x.desde, x.id_deteccion))
+            desdes = [det_gt.desde for det_gt in lista]
+            largo_max = max(det_gt.largo for det_gt in lista)
+            self.grupos[llave] = (desdes, lista, largo_max)
+
+    def candidatas(self, deteccion):
+        grupo = self.grupos.get((deteccion.radio, deteccion.cancion))
+        if grupo is None:
+            return []
+        desdes, lista, largo_max = grupo
+        # una gt intersecta si empieza antes del fin de la deteccion y termina despues de su inicio;
+        # como ninguna dura mas que largo_max, empieza despues de desde - largo_max
+        # (el margen solo agrega candidatas, interseccion decide)
+        inicio = bisect.bisect_left(desdes, deteccion.desde - largo_max - 1e-6)
+        fin = bisect.bisect_right(desdes, deteccion.desde + deteccion.largo)
+        return lista[inicio:fin]
+
+
 class Evaluacion:
     def __init__(self):
         self.detecciones_gt = list()
+        self.indice_gt = None
         self.total_gt_por_tipo = dict()
         self.detecciones = list()
         self.resultado_por_deteccion = list()
@@ -142,6 +174,7 @@ class Evaluacion:
         leer_archivo_detecciones(self.detecciones_gt, file_gt, True)
         for gt in self.detecciones_gt:
             self.total_gt_por_tipo[gt.tipo] = self.total_gt_por_tipo.get(gt.tipo, 0) + 1
+        self.indice_gt = IndiceGT(self.detecciones_gt)
 
     def leer_archivo_detecciones(self, file_detecciones):
         # cargar las detecciones
@@ -183,10 +216,14 @@ class Evaluacion:
     def buscar_deteccion_en_gt(self, deteccion):
         gt_encontrada = None
         iou = 0
+        if self.indice_gt is None:
+            self.indice_gt = IndiceGT(self.detecciones_gt)
         # busca en gt la deteccion que tiene mayor interseccion
-        for det_gt in self.detecciones_gt:
+        # (en un empate gana la primera del archivo gt)
+        for det_gt in self.indice_gt.candidatas(deteccion):
             interseccion = deteccion.interseccion(det_gt)
-            if interseccion > iou:
+            if interseccion > iou or (interseccion == iou and gt_encontrada is not None
+                                      and det_gt.id_deteccion < gt_encontrada.id_deteccion):
                 gt_encontrada = det_gt
                 iou = interseccion
         return gt_encontrada, iou
@@ -198,12 +235,45 @@ class Evaluacion:
             if res.es_correcta:
                 set_confianzas.add(res.deteccion.confianza)
         set_confianzas.add(0)
-        # calcular las metricas para cada confianza y seleccionar el mejor
-        for confianza in sorted(list(set_confianzas), reverse=True):
+        umbrales = sorted(list(set_confianzas), reverse=True)
+        # un solo recorrido de las detecciones ordenadas por confianza: al bajar el umbral
+        # solo se suman las detecciones nuevas
+        resultados = [res for res in self.resultado_por_deteccion if not res.es_duplicada_otra_fuente]
+        resultados.sort(key=lambda x: x.deteccion.confianza, reverse=True)
+        aproximados = []
+        met = Metricas(0)
+        met.total_gt = len(self.detecciones_gt)
+        suma_iou = 0
+        correctas_por_tipo = dict()
+        siguiente = 0
+        for confianza in umbrales:
+            while siguiente < len(resultados) and resultados[siguiente].deteccion.confianza >= confianza:
+                suma_iou = self.sumar_resultado(met, resultados[siguiente], suma_iou, correctas_por_tipo)
+                siguiente += 1
+            self.completar_metricas(met, suma_iou, correctas_por_tipo)
+            aproximados.append((confianza, met.f1_iou))
+        # la suma de IoU del recorrido va en otro orden y puede diferir en el ultimo decimal;
+        # los umbrales que quedan cerca del mejor se recalculan igual que antes para elegir
+        # exactamente el mismo (el de mayor umbral entre los empatados)
+        mejor_aproximado = max(f1_iou for confianza, f1_iou in aproximados)
+        for confianza, f1_iou in aproximados:
+            if f1_iou < mejor_aproximado - 1e-9:
+                continue
             met = self.evaluar_con_threshold(confianza)
             if self.resultado_global is None or met.f1_iou > self.resultado_global.f1_iou:
                 self.resultado_global = met
 
+    @staticmethod
+    def sumar_resultado(met, res, suma_iou, correctas_por_tipo):
+        met.total_detecciones += 1
+        if res.es_correcta:
+            met.correctas += 1
+            suma_iou += res.iou
+            correctas_por_tipo[res.gt.tipo] = correctas_por_tipo.get(res.gt.tipo, 0) + 1
+        if res.es_incorrecta or res.es_duplicada_misma_fuente:
+            met.incorrectas += 1
+        return suma_iou
+
     def evaluar_con_threshold(self, threshold):
         met = Metricas(threshold)
         met.total_gt = len(self.detecciones_gt)
@@ -213,13 +283,11 @@ class Evaluacion:
             # ignorar detecciones con confianza bajo el umbral
             if res.deteccion.confianza < threshold or res.es_duplicada_otra_fuente:
                 continue
-            met.total_detecciones += 1
-            if res.es_correcta:
-                met.correctas += 1
-                suma_iou += res.iou
-                correctas_por_tipo[res.gt.tipo] = correctas_por_tipo.get(res.gt.tipo, 0) + 1
-            if res.es_incorrecta or res.es_duplicada_misma_fuente:
-                met.incorrectas += 1
+            suma_iou = self.sumar_resultado(met, res, suma_iou, correctas_por_tipo)
+        self.completar_metricas(met, suma_iou, correctas_por_tipo)
+        return met
+
+    def completar_metricas(self, met, suma_iou, correctas_por_tipo):
         if met.correctas > 0:
             # recall mide lo detectado con respecto al total de detecciones
             met.recall = met.correctas / met.total_gt
@@ -236,7 +304,6 @@ class Evaluacion:
             correctas = correctas_por_tipo.get(tipo, 0)
             met.correctas_por_tipo[tipo] = correctas
             met.recall_por_tipo[tipo] = correctas / total
-        return met
 
     def imprimir_resultado_por_deteccion(self):
         if len(self.resultado_por_deteccion) == 0:
@@ -290,69 +357,153 @@ def evaluar_resultado_en_dataset(filename_gt, filename_resultados):
     return ev.resultado_global.f1_iou
 
 
+class ErrorEvaluacion(Exception):
+    # error que termina la evaluación; con --jobs se lanza en el thread del dataset y no
+    # con sys.exit, para que la evaluación se detenga apenas falle un dataset
+    pass
+
+
 def validar_tiempo_maximo(t0):
     segundos = time.time() - t0
     # el enunciado dice que no puede demorar mas de 15 minutos
     if segundos > 900:
-        print("La tarea no puede demorar más de 15 minutos!!")
-        sys.exit(1)
+        raise ErrorEvaluacion("La tarea no puede demorar más de 15 minutos!!")
+
+
+# variables de ambiente que limitan los threads de numpy/BLAS en cada programa
+VARIABLES_HILOS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+# programas en ejecución, para terminarlos si falla otro dataset evaluado en paralelo
+procesos_en_curso = set()
+lock_procesos = threading.Lock()
+
+
+def terminar_procesos_en_curso():
+    with lock_procesos:
+        for proceso in procesos_en_curso:
+            proceso.terminate()
 
 
-def ejecutar(comando):
+def ejecutar_medido(comando, entorno=None, archivo_log=None):
+    # ejecuta un programa y retorna su código de salida junto con su tiempo total, tiempo de CPU y
+    # memoria máxima (la CPU y la memoria incluyen los procesos hijos que el programa espera, como FFmpeg o el pool)
+    t0 = time.time()
+    salida = open(archivo_log, 'a') if archivo_log is not None else None
+    proceso = subprocess.Popen(comando, env=entorno, stdout=salida, stderr=subprocess.STDOUT if salida else None)
+    with lock_procesos:
+        procesos_en_curso.add(proceso)
+    cpu_s = max_rss_mb = None
+    if hasattr(os, "wait4"):
+        _, estado, uso = os.wait4(proceso.pid, 0)
+        # con returncode asignado, terminate() ya no envía señales a ese pid
+        with lock_procesos:
+            proceso.returncode = code = os.waitstatus_to_exitcode(estado)
+            procesos_en_curso.discard(proceso)
+        cpu_s = uso.ru_utime + uso.ru_stime
+        # ru_maxrss está en KB en Linux y en bytes en macOS
+        max_rss_mb = uso.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    else:
+        code = proceso.wait()
+        with lock_procesos:
+            procesos_en_curso.discard(proceso)
+    if salida is not None:
+        salida.close()
+    return code, {'wall_s': time.time() - t0, 'cpu_s': cpu_s, 'max_rss_mb': max_rss_mb}
+
+
+def ejecutar(comando, entorno=None, archivo_log=None):
     t0 = time.time()
     print()
     print("Ejecutando:")
     print("[{}] ".format(time.strftime("%d-%m-%Y %H:%M:%S")) + " ".join(comando))
-    code = subprocess.call(comando)
+    code, medicion = ejecutar_medido(comando, entorno, archivo_log)
     print()
     if code != 0:
-        print("EL PROGRAMA RETORNA ERROR!")
-        sys.exit(1)
+        raise ErrorEvaluacion("EL PROGRAMA RETORNA ERROR! ({})".format(" ".join(comando)))
     validar_tiempo_maximo(t0)
+    return medicion
 
 
-def ejecutar_tarea(nombre, carpeta_radio, carpeta_canciones, dir_evaluacion):
+def ejecutar_tarea(nombre, carpeta_radio, carpeta_canciones, dir_evaluacion, opciones_extractor=(), rapido=False,
+                   hilos=None, etapas=None, paso_R=None):
+    # etapas (opcional) recibe las mediciones de cada programa ejecutado; paso_R (opcional) es el
+    # --paso de la extracción de R, que puede ser mayor que el de Q
     datos_temporales = dir_evaluacion + "/" + nombre
     dir_descriptores_canciones = datos_temporales + "/descriptores_canciones/"
     dir_descriptores_radio = datos_temporales + "/descriptores_radio/"
     file_similares = datos_temporales + "/similares.{}.bin".format(nombre)
     file_detecciones = datos_temporales + "/resultados.{}.txt".format(nombre)
+    if etapas is None:
+        etapas = dict()
+    entorno = None
+    archivo_log = None
+    opciones_cores = []
+    if hilos is not None:
+        # evaluación en paralelo: cada dataset usa a lo más hilos threads y escribe su salida en un log
+        os.makedirs(datos_temporales, exist_ok=True)
+        entorno = dict(os.environ)
+        for variable in VARIABLES_HILOS:
+            entorno[variable] = str(hilos)
+        archivo_log = datos_temporales + "/log.txt"
+        opciones_cores = ["--cores={}".format(hilos)]
+    if rapido:
+        # las cuatro etapas en un solo proceso, sin escribir descriptores ni ventanas similares
+        os.makedirs(datos_temporales, exist_ok=True)
+        comando = [sys.executable, "pipeline.py", carpeta_radio, carpeta_canciones, file_detecciones] + \
+            list(opciones_extractor) + opciones_cores
+        if paso_R is not None:
+            comando += ["--paso-r={}".format(paso_R)]
+        etapas['pipeline'] = ejecutar(comando, entorno, archivo_log)
+        return file_detecciones
     # comando para calcular descriptores Q
-    comando = [sys.executable, "tarea2-extractor.py", carpeta_radio, dir_descriptores_radio]
-    ejecutar(comando)
+    comando = [sys.executable, "tarea2-extractor.py", carpeta_radio, dir_descriptores_radio] + list(opciones_extractor)
+    etapas['extractor_Q'] = ejecutar(comando, entorno, archivo_log)
     # comando para calcular descriptores R
-    comando = [sys.executable, "tarea2-extractor.py", carpeta_canciones, dir_descriptores_canciones]
-    ejecutar(comando)
+    comando = [sys.executable, "tarea2-extractor.py", carpeta_canciones, dir_descriptores_canciones] + list(opciones_extractor)
+    if paso_R is not None:
+        # va después de las opciones comunes, así reemplaza un --paso de Q
+        comando += ["--paso={}".format(paso_R)]
+    etapas['extractor_R'] = ejecutar(comando, entorno, archivo_log)
     # comando para buscar
     comando = [sys.executable, "tarea2-busqueda.py", dir_descriptores_radio, dir_descriptores_canciones,
-               file_similares]
-    ejecutar(comando)
+               file_similares] + opciones_cores
+    etapas['busqueda'] = ejecutar(comando, entorno, archivo_log)
     # comando para detectar
     comando = [sys.executable, "tarea2-deteccion.py", file_similares, file_detecciones]
-    ejecutar(comando)
+    etapas['deteccion'] = ejecutar(comando, entorno, archivo_log)
     return file_detecciones
 
 
-def evaluar_en_dataset(nombre, dir_evaluacion):
+def rutas_dataset(nombre):
     dataset_basedir = "datasets/" + nombre
     if not os.path.isdir(dataset_basedir):
-        print("no existe {}".format(dataset_basedir))
-        sys.exit(1)
+        raise ErrorEvaluacion("no existe {}".format(dataset_basedir))
     carpeta_radio = dataset_basedir + "/radio/"
     carpeta_canciones = dataset_basedir + "/canciones/"
     archivo_gt = dataset_basedir + "/gt.txt"
     if not os.path.isdir(carpeta_radio):
-        print("error leyendo {}. No existe {}".format(nombre, carpeta_radio))
-        sys.exit(1)
+        raise ErrorEvaluacion("error leyendo {}. No existe {}".format(nombre, carpeta_radio))
     if not os.path.isdir(carpeta_canciones):
-        print("error leyendo {}. No existe {}".format(nombre, carpeta_canciones))
-        sys.exit(1)
+        raise ErrorEvaluacion("error leyendo {}. No existe {}".format(nombre, carpeta_canciones))
     if not os.path.isfile(archivo_gt):
-        print("error leyendo {}. No existe {}".format(nombre, archivo_gt))
-        sys.exit(1)
+        raise ErrorEvaluacion("error leyendo {}. No existe {}".format(nombre, archivo_gt))
+    return carpeta_radio, carpeta_canciones, archivo_gt
+
+
+def ejecutar_en_dataset(nombre, dir_evaluacion, opciones_extractor=(), rapido=False, hilos=None, paso_R=None):
+    # ejecuta la tarea sobre un dataset y retorna el archivo de detecciones, el gt y las mediciones
+    carpeta_radio, carpeta_canciones, archivo_gt = rutas_dataset(nombre)
+    etapas = dict()
     t0 = time.time()
-    archivo_detecciones = ejecutar_tarea(nombre, carpeta_radio, carpeta_canciones, dir_evaluacion)
+    archivo_detecciones = ejecutar_tarea(nombre, carpeta_radio, carpeta_canciones, dir_evaluacion, opciones_extractor,
+                                         rapido, hilos, etapas, paso_R)
     validar_tiempo_maximo(t0)
+    return archivo_detecciones, archivo_gt, etapas, time.time() - t0
+
+
+def evaluar_en_dataset(nombre, dir_evaluacion, opciones_extractor=(), rapido=False, paso_R=None):
+    archivo_detecciones, archivo_gt, _, _ = ejecutar_en_dataset(nombre, dir_evaluacion, opciones_extractor, rapido,
+                                                                paso_R=paso_R)
     metricas = evaluar_resultado_en_dataset(archivo_gt, archivo_detecciones)
     return metricas
 
@@ -376,7 +527,11 @@ def calcular_nota(f1_promedio):
     return nota, bonus
 
 
-def evaluar_tarea2(letras_datasets):
+def formatear_medicion(valor, formato):
+    return "-" if valor is None else formato.format(valor)
+
+
+def evaluar_tarea2(letras_datasets, opciones_extractor=(), rapido=False, jobs=1, archivo_reporte=None, paso_R=None):
     print("CC5213 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA")
     print("Evaluación Tarea 2 - 2024")
     # datos para la evaluacion
@@ -384,19 +539,64 @@ def evaluar_tarea2(letras_datasets):
     if os.path.exists(dir_evaluacion):
         print("borrando datos previos en {}...".format(dir_evaluacion))
         shutil.rmtree(dir_evaluacion)
+    t_total = time.time()
+    nombres = ["dataset_" + letra for letra in letras_datasets]
+    ejecuciones = {}
+    if jobs > 1:
+        # los datasets se ejecutan a la vez, cada uno en su carpeta y con los cores repartidos;
+        # la salida de cada programa queda en evaluacion_tarea2/dataset_x/log.txt
+        hilos = max(1, os.cpu_count() // jobs)
+        print("Ejecutando {} datasets con {} jobs ({} threads por job)...".format(len(nombres), jobs, hilos))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            futuros = {pool.submit(ejecutar_en_dataset, nombre, dir_evaluacion, opciones_extractor, rapido,
+                                   hilos, paso_R): nombre for nombre in nombres}
+            for futuro in concurrent.futures.as_completed(futuros):
+                nombre = futuros[futuro]
+                try:
+                    ejecuciones[nombre] = futuro.result()
+                except Exception as e:
+                    # no se espera a los demás datasets: se cancelan los pendientes y se terminan
+                    # los programas en curso (sus threads terminan con error al no poder seguir)
+                    for otro in futuros:
+                        otro.cancel()
+                    terminar_procesos_en_curso()
+                    raise ErrorEvaluacion("falló {} (ver {}/{}/log.txt): {}".format(nombre, dir_evaluacion,
+                                                                                     nombre, e))
+    else:
+        hilos = None
     # evaluar sobre los datasets
     resultados = {}
-    for letra in letras_datasets:
-        dataset_nombre = "dataset_" + letra
+    reporte = {'jobs': jobs, 'threads_por_job': hilos, 'rapido': rapido, 'opciones': list(opciones_extractor),
+               'paso_R': paso_R,
+               'datasets': {}}
+    for nombre in nombres:
         print()
-        print("------- EVALUACION EN: {} -------".format(dataset_nombre))
-        t0 = time.time()
-        resultado_f1 = evaluar_en_dataset(dataset_nombre, dir_evaluacion)
-        segundos = time.time() - t0
+        print("------- EVALUACION EN: {} -------".format(nombre))
+        if nombre not in ejecuciones:
+            ejecuciones[nombre] = ejecutar_en_dataset(nombre, dir_evaluacion, opciones_extractor, rapido,
+                                                      paso_R=paso_R)
+        archivo_detecciones, archivo_gt, etapas, segundos = ejecuciones[nombre]
+        resultado_f1 = evaluar_resultado_en_dataset(archivo_gt, archivo_detecciones)
         print("  tiempo: {:.1f} segundos".format(segundos))
-        resultados[dataset_nombre] = (resultado_f1, segundos)
+        resultados[nombre] = (resultado_f1, segundos)
+        reporte['datasets'][nombre] = {'f1_iou': resultado_f1, 'wall_s': segundos, 'etapas': etapas}
+    reporte['wall_s'] = time.time() - t_total
     print()
     print("--------------------------------------------")
+    print("Tiempo y memoria por etapa:")
+    print("    {:12s} {:12s} {:>9s} {:>9s} {:>9s}".format("dataset", "etapa", "total(s)", "CPU(s)", "RSS(MB)"))
+    for nombre in nombres:
+        for etapa, medicion in reporte['datasets'][nombre]['etapas'].items():
+            print("    {:12s} {:12s} {:>9s} {:>9s} {:>9s}".format(nombre, etapa,
+                                                              formatear_medicion(medicion['wall_s'], "{:.1f}"),
+                                                              formatear_medicion(medicion['cpu_s'], "{:.1f}"),
+                                                              formatear_medicion(medicion['max_rss_mb'], "{:.0f}")))
+    if archivo_reporte is None:
+        archivo_reporte = dir_evaluacion + "/reporte.json"
+    with open(archivo_reporte, 'w') as handle:
+        json.dump(reporte, handle, indent=2)
+    print("    (reporte en {})".format(archivo_reporte))
+    print()
     print("Resumen:")
     f1s = []
     for nombre in resultados:
@@ -412,9 +612,45 @@ def evaluar_tarea2(letras_datasets):
         print("    ==> Bonus = {:.1f}".format(bonus))
 
 
-# parametros de entrada
-datasets = ["a", "b", "c", "d"]
-if len(sys.argv) > 1:
-    datasets = sys.argv[1:]
-
-evaluar_tarea2(datasets)
+if __name__ == "__main__":
+    # parametros de entrada
+    # los que empiezan con -- se entregan a tarea2-extractor.py (por ejemplo --huellas o --apilar=4),
+    # salvo las opciones de la evaluación: --rapido ejecuta todo con pipeline.py en un solo proceso,
+    # --jobs N (o --jobs=N) evalúa N datasets a la vez, --reporte archivo.json (o --reporte=archivo.json)
+    # indica dónde guardar las mediciones y --paso-r P (o --paso-r=P) extrae R con otro --paso que Q
+    datasets = ["a", "b", "c", "d"]
+    argumentos = []
+    opciones_extractor = []
+    rapido = False
+    jobs = 1
+    archivo_reporte = None
+    paso_R = None
+    pendientes = list(sys.argv[1:])
+    while len(pendientes) > 0:
+        arg = pendientes.pop(0)
+        opcion, _, valor = arg.partition("=")
+        if opcion in ["--jobs", "--reporte", "--paso-r"] and valor == "":
+            if len(pendientes) == 0:
+                print("falta el valor de {}".format(opcion))
+                sys.exit(1)
+            valor = pendientes.pop(0)
+        if arg == "--rapido":
+            rapido = True
+        elif opcion == "--jobs":
+            jobs = int(valor)
+        elif opcion == "--reporte":
+            archivo_reporte = valor
+        elif opcion == "--paso-r":
+            paso_R = int(valor)
+        elif arg.startswith("--"):
+            opciones_extractor.append(arg)
+        else:
+            argumentos.append(arg)
+    if len(argumentos) > 0:
+        datasets = argumentos
+
+    try:
+        evaluar_tarea2(datasets, opciones_extractor, rapido, jobs, archivo_reporte, paso_R)
+    except ErrorEvaluacion as e:
+        print(e)
+        sys.exit(1)
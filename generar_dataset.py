@@ -0,0 +1,263 @@
+# generar_dataset.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Genera un dataset sintético con la misma estructura de datasets/dataset_x:
+#   radio/     -> radios de largo configurable, con trozos de canciones del catálogo
+#                 insertados entre ruido, voz sintética y otras canciones que no están en R
+#   canciones/ -> las canciones de R
+#   gt.txt     -> cada inserción en el formato de evaluarTarea2.py (tipo, radio, desde, largo, canción)
+# Cada trozo insertado lleva una transformación (ORIGINAL, VOLUMEN, EQ, RUIDO o REMUESTREO),
+# que queda como tipo en gt.txt. Si se piden más canciones que las del catálogo, se crean
+# canciones derivadas cambiando la velocidad y la ecualización de las del catálogo.
+# Las radios se escriben por partes a FFmpeg, así el largo no depende de la memoria.
+# Uso:
+#   python generar_dataset.py [carpeta_catalogo] [carpeta_dataset] [--radios N] [--minutos M] [--canciones N]
+
+import os
+import sys
+import shutil
+import argparse
+import functools
+import subprocess
+from fractions import Fraction
+import numpy as np
+from scipy.signal import resample_poly
+import util
+
+TRANSFORMACIONES = ["ORIGINAL", "VOLUMEN", "EQ", "RUIDO", "REMUESTREO"]
+RELLENOS = ["ruido", "voz", "cancion"]
+
+
+def escritor_m4a(archivo, sample_rate):
+    # FFmpeg lee PCM float32 mono por la entrada estándar y escribe AAC en .m4a
+    comando = [util.FFMPEG, "-hide_banner", "-loglevel", "error", "-y", "-f", "f32le", "-ar", str(sample_rate),
+               "-ac", "1", "-i", "-", "-c:a", "aac", "-b:a", "64k", archivo]
+    return subprocess.Popen(comando, stdin=subprocess.PIPE)
+
+
+def cerrar_escritor(proceso):
+    proceso.stdin.close()
+    if proceso.wait() != 0:
+        raise Exception("ERROR en FFmpeg al escribir {}".format(proceso.args[-1]))
+
+
+def escribir_m4a(archivo, samples, sample_rate):
+    proceso = escritor_m4a(archivo, sample_rate)
+    proceso.stdin.write(np.asarray(samples, dtype=np.float32).tobytes())
+    cerrar_escritor(proceso)
+
+
+def remuestrear(samples, sample_rate_origen, sample_rate_destino):
+    razon = Fraction(sample_rate_destino, sample_rate_origen).limit_denominator(1000)
+    return resample_poly(samples, razon.numerator, razon.denominator).astype(np.float32)
+
+
+def ecualizar(samples, sample_rate, rng, max_db=9.0, puntos=6):
+    # ganancia suave al azar sobre el eje de frecuencias logarítmico, aplicada en el espectro
+    espectro = np.fft.rfft(samples)
+    frecuencias = np.fft.rfftfreq(len(samples), 1.0 / sample_rate)
+    control = np.geomspace(50.0, sample_rate / 2.0, puntos)
+    ganancias_db = rng.uniform(-max_db, max_db, puntos)
+    curva_db = np.interp(np.log(np.maximum(frecuencias, 1.0)), np.log(control), ganancias_db)
+    return np.fft.irfft(espectro * 10.0 ** (curva_db / 20.0), n=len(samples)).astype(np.float32)
+
+
+def ruido_rosa(num_muestras, rng):
+    # ruido blanco con pendiente de -3 dB por octava
+    espectro = np.fft.rfft(rng.standard_normal(num_muestras))
+    espectro /= np.sqrt(np.maximum(np.arange(len(espectro)), 1))
+    ruido = np.fft.irfft(espectro, n=num_muestras)
+    return (ruido / (np.abs(ruido).max() + 1e-9)).astype(np.float32)
+
+
+def voz_sintetica(num_muestras, sample_rate, rng):
+    """
+    Aproximación de voz hablada: un pulso glotal con tono que varía lentamente, filtrado por
+    tres formantes que cambian con cada sílaba (unas 4 por segundo), con pausas entre frases.
+    """
+    t = np.arange(num_muestras) / sample_rate
+    tono = 120.0 * rng.uniform(0.8, 1.8) * (1.0 + 0.1 * np.sin(2 * np.pi * 0.5 * t + rng.uniform(0, 6)))
+    fase = 2 * np.pi * np.cumsum(tono) / sample_rate
+    fuente = sum(np.sin(armonico * fase) / armonico for armonico in range(1, 25)
+                 if armonico * tono.max() < sample_rate / 2)
+    silabas = max(1, int(len(t) / sample_rate * 4))
+    limites = np.linspace(0, num_muestras, silabas + 1).astype(int)
+    voz = np.zeros(num_muestras, dtype=np.float32)
+    for inicio, fin in zip(limites[:-1], limites[1:]):
+        if rng.random() < 0.15:
+            continue  # pausa
+        trozo = fuente[inicio:fin]
+        espectro = np.fft.rfft(trozo)
+        frecuencias = np.fft.rfftfreq(len(trozo), 1.0 / sample_rate)
+        envolvente = np.zeros(len(frecuencias))
+        for formante, ancho in zip(rng.uniform([300, 900, 2200], [900, 2300, 3200]), [80, 120, 160]):
+            envolvente += np.exp(-0.5 * ((frecuencias - formante) / ancho) ** 2)
+        voz[inicio:fin] = np.fft.irfft(espectro * envolvente, n=len(trozo)) * np.hanning(len(trozo))
+    return voz / (np.abs(voz).max() + 1e-9)
+
+
+def aplicar_transformacion(samples, sample_rate, tipo, rng):
+    if tipo == "ORIGINAL":
+        return samples
+    if tipo == "VOLUMEN":
+        return np.clip(samples * 10.0 ** (rng.uniform(-12.0, 6.0) / 20.0), -1.0, 1.0).astype(np.float32)
+    if tipo == "EQ":
+        return ecualizar(samples, sample_rate, rng)
+    if tipo == "RUIDO":
+        snr_db = rng.uniform(5.0, 20.0)
+        potencia = np.mean(samples ** 2) + 1e-12
+        ruido = rng.standard_normal(len(samples)) * np.sqrt(potencia / 10.0 ** (snr_db / 10.0))
+        return (samples + ruido).astype(np.float32)
+    if tipo == "REMUESTREO":
+        # se pierde el ancho de banda como en una transmisión de baja calidad y se vuelve al sample rate original
+        sample_rate_bajo = int(rng.choice([6000, 8000, 11025]))
+        devuelta = remuestrear(remuestrear(samples, sample_rate, sample_rate_bajo), sample_rate_bajo, sample_rate)
+        return np.pad(devuelta, (0, max(0, len(samples) - len(devuelta))))[:len(samples)]
+    raise Exception("transformación desconocida: {}".format(tipo))
+
+
+def suavizar_bordes(samples, sample_rate, segundos=0.05):
+    n = min(int(sample_rate * segundos), len(samples) // 2)
+    if n > 0:
+        rampa = np.linspace(0.0, 1.0, n, dtype=np.float32)
+        samples[:n] *= rampa
+        samples[-n:] *= rampa[::-1]
+    return samples
+
+
+class Catalogo:
+    """
+    Canciones de R y de relleno. Las canciones del catálogo se decodifican a pedido (con un
+    cache acotado); las derivadas se calculan desde su canción de origen con su velocidad y EQ.
+    """
+
+    def __init__(self, carpeta_catalogo, num_canciones_R, sample_rate, rng, max_en_memoria=32):
+        self.carpeta = carpeta_catalogo
+        self.sample_rate = sample_rate
+        archivos = util.listar_archivos_con_extension(carpeta_catalogo, ".m4a")
+        if len(archivos) == 0:
+            raise Exception("no hay archivos .m4a en {}".format(carpeta_catalogo))
+        archivos = [archivos[i] for i in rng.permutation(len(archivos))]
+        if num_canciones_R is None:
+            num_canciones_R = len(archivos)
+        # las que no quedan en R se usan como relleno ("otras canciones")
+        self.canciones_R = [(nombre, nombre, None) for nombre in archivos[:num_canciones_R]]
+        self.relleno = archivos[num_canciones_R:]
+        for i in range(num_canciones_R - len(self.canciones_R)):
+            origen = archivos[i % len(archivos)]
+            velocidad = rng.choice([-1, 1]) * rng.uniform(0.05, 0.15) + 1.0
+            self.canciones_R.append(("sintetica {:05d}.m4a".format(i), origen, (velocidad, int(rng.integers(1 << 31)))))
+        self.decodificar = functools.lru_cache(maxsize=max_en_memoria)(self.decodificar)
+
+    def decodificar(self, nombre, origen, derivacion):
+        samples = util.decodificar_audio(os.path.join(self.carpeta, origen), self.sample_rate)
+        if derivacion is not None:
+            velocidad, semilla = derivacion
+            samples = remuestrear(samples, int(self.sample_rate * velocidad), self.sample_rate)
+            samples = ecualizar(samples, self.sample_rate, np.random.default_rng(semilla))
+        return samples
+
+    def cancion_R(self, i):
+        return self.canciones_R[i][0], self.decodificar(*self.canciones_R[i])
+
+    def cancion_relleno(self, i):
+        return self.decodificar(self.relleno[i], self.relleno[i], None)
+
+    def escribir_canciones_R(self, carpeta_canciones):
+        os.makedirs(carpeta_canciones)
+        for nombre, origen, derivacion in self.canciones_R:
+            if derivacion is None:
+                shutil.copyfile(os.path.join(self.carpeta, origen), os.path.join(carpeta_canciones, nombre))
+            else:
+                escribir_m4a(os.path.join(carpeta_canciones, nombre), self.decodificar(nombre, origen, derivacion),
+                             self.sample_rate)
+
+
+def generar_relleno(catalogo, segundos, sample_rate, rng):
+    num_muestras = int(segundos * sample_rate)
+    tipos = RELLENOS if len(catalogo.relleno) > 0 else RELLENOS[:2]
+    tipo = tipos[rng.integers(len(tipos))]
+    if tipo == "ruido":
+        return 0.3 * ruido_rosa(num_muestras, rng)
+    if tipo == "voz":
+        return 0.6 * voz_sintetica(num_muestras, sample_rate, rng)
+    samples = catalogo.cancion_relleno(int(rng.integers(len(catalogo.relleno))))
+    inicio = int(rng.integers(max(1, len(samples) - num_muestras)))
+    trozo = samples[inicio:inicio + num_muestras]
+    return np.pad(trozo, (0, num_muestras - len(trozo)))
+
+
+def generar_radio(archivo_radio, catalogo, minutos, sample_rate, rng, transformaciones, fragmento, relleno):
+    """
+    Escribe una radio de minutos de largo alternando relleno y trozos de canciones de R.
+    Retorna las filas de gt.txt de la radio.
+    """
+    nombre_radio = os.path.basename(archivo_radio)
+    proceso = escritor_m4a(archivo_radio, sample_rate)
+    total = int(minutos * 60 * sample_rate)
+    posicion = 0
+    filas_gt = []
+    while posicion < total:
+        trozo = generar_relleno(catalogo, rng.uniform(*relleno), sample_rate, rng)[:total - posicion]
+        proceso.stdin.write(suavizar_bordes(trozo.astype(np.float32), sample_rate).tobytes())
+        posicion += len(trozo)
+        if posicion >= total:
+            break
+        nombre, samples = catalogo.cancion_R(int(rng.integers(len(catalogo.canciones_R))))
+        largo = min(int(rng.uniform(*fragmento) * sample_rate), len(samples), total - posicion)
+        if largo < sample_rate * fragmento[0] / 2:
+            continue
+        inicio = int(rng.integers(len(samples) - largo + 1))
+        tipo = transformaciones[rng.integers(len(transformaciones))]
+        trozo = aplicar_transformacion(samples[inicio:inicio + largo].copy(), sample_rate, tipo, rng)
+        proceso.stdin.write(suavizar_bordes(trozo, sample_rate).tobytes())
+        filas_gt.append([tipo, nombre_radio, "{:.3f}".format(posicion / sample_rate),
+                         "{:.3f}".format(largo / sample_rate), nombre])
+        posicion += largo
+    cerrar_escritor(proceso)
+    return filas_gt
+
+
+def generar_dataset(carpeta_catalogo, carpeta_dataset, radios=2, minutos=10.0, canciones=None, sample_rate=16000,
+                    semilla=0, transformaciones=TRANSFORMACIONES, fragmento=(10.0, 40.0), relleno=(5.0, 30.0)):
+    if os.path.exists(carpeta_dataset):
+        raise Exception("ya existe {}".format(carpeta_dataset))
+    rng = np.random.default_rng(semilla)
+    catalogo = Catalogo(carpeta_catalogo, canciones, sample_rate, rng)
+    print("Escribiendo {} canciones de R...".format(len(catalogo.canciones_R)))
+    catalogo.escribir_canciones_R(os.path.join(carpeta_dataset, "canciones"))
+    os.makedirs(os.path.join(carpeta_dataset, "radio"))
+    filas_gt = []
+    for i in range(radios):
+        print("Escribiendo radio-{}.m4a ({} minutos)...".format(i, minutos))
+        filas_gt.extend(generar_radio(os.path.join(carpeta_dataset, "radio", "radio-{}.m4a".format(i)), catalogo,
+                                      minutos, sample_rate, rng, list(transformaciones), fragmento, relleno))
+    util.escribir_lista_de_columnas_en_archivo(filas_gt, os.path.join(carpeta_dataset, "gt.txt"))
+    print("{} inserciones en {}".format(len(filas_gt), os.path.join(carpeta_dataset, "gt.txt")))
+    return filas_gt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python generar_dataset.py [carpeta_catalogo] [carpeta_dataset] [--radios N] [--minutos M] [--canciones N]")
+    parser.add_argument("carpeta_catalogo", help="carpeta con canciones .m4a")
+    parser.add_argument("carpeta_dataset", help="carpeta a crear (por ejemplo datasets/dataset_s)")
+    parser.add_argument("--radios", type=int, default=2, help="cantidad de radios")
+    parser.add_argument("--minutos", type=float, default=10.0, help="largo de cada radio")
+    parser.add_argument("--canciones", type=int, default=None,
+                        help="canciones de R (por omisión todo el catálogo; si son más se crean derivadas)")
+    parser.add_argument("--transformaciones", nargs="+", default=TRANSFORMACIONES, choices=TRANSFORMACIONES)
+    parser.add_argument("--fragmento", type=float, nargs=2, default=[10.0, 40.0],
+                        help="largo mínimo y máximo (segundos) de cada trozo de canción")
+    parser.add_argument("--relleno", type=float, nargs=2, default=[5.0, 30.0],
+                        help="largo mínimo y máximo (segundos) del relleno entre canciones")
+    parser.add_argument("--sample-rate", type=int, default=16000, help="sample rate con que se generan las radios")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.carpeta_catalogo):
+        print("ERROR: no existe {}".format(args.carpeta_catalogo))
+        sys.exit(1)
+    generar_dataset(args.carpeta_catalogo, args.carpeta_dataset, args.radios, args.minutos, args.canciones,
+                    args.sample_rate, args.semilla, args.transformaciones, tuple(args.fragmento), tuple(args.relleno))
@@ -0,0 +1,168 @@
+# huellas.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Huellas de audio por pares de picos del espectrograma (estilo Shazam / Wang 2003).
+# Se buscan los máximos locales del espectrograma y cada pico (ancla) se combina con
+# los siguientes picos de una zona objetivo. Cada par (frecuencia ancla, frecuencia
+# objetivo, distancia en frames) se empaqueta en un hash uint32, con el tiempo del ancla
+# como inicio. La búsqueda no necesita vecinos aproximados: una ventana de Q coincide
+# con todas las de R que tienen el mismo hash, y la votación por desfase de
+# tarea2-deteccion.py descarta las coincidencias casuales.
+
+import numpy as np
+from mfcc import espectrograma_potencia, potencia_a_db, tiempos_de_frames
+from util import medir, contar
+
+# bits de cada campo del hash: frecuencia ancla | frecuencia objetivo | distancia en frames
+BITS_FRECUENCIA = 9
+BITS_DISTANCIA = 6
+
+
+def detectar_picos(espectro_db, vecindad_frecuencia, vecindad_tiempo, picos_por_segundo, frames_por_segundo,
+                   rango_db=60.0):
+    """
+    Máximos locales del espectrograma en dB (frecuencia, frame) que están a menos de
+    rango_db del máximo global. Para que la densidad no dependa del volumen ni del tipo
+    de música se dejan los picos_por_segundo más fuertes de cada segundo.
+    Retorna las frecuencias y frames de los picos ordenados por frame y frecuencia.
+    """
+    # scipy se carga solo al calcular huellas, así la extracción de MFCC no paga su importación
+    from scipy.ndimage import maximum_filter
+    maximos = maximum_filter(espectro_db, size=(vecindad_frecuencia, vecindad_tiempo), mode='constant',
+                             cval=-np.inf)
+    es_pico = (espectro_db == maximos) & (espectro_db > espectro_db.max() - rango_db)
+    frecuencias, frames = np.nonzero(es_pico)
+    if len(frames) == 0:
+        return frecuencias, frames
+    amplitudes = espectro_db[frecuencias, frames]
+
+    # rango de cada pico dentro de su segundo, de mayor a menor amplitud
+    segundo = (frames / frames_por_segundo).astype(np.int64)
+    orden = np.lexsort((-amplitudes, segundo))
+    segundo_ordenado = segundo[orden]
+    inicio_grupo = np.flatnonzero(np.r_[True, segundo_ordenado[1:] != segundo_ordenado[:-1]])
+    largo_grupo = np.diff(np.r_[inicio_grupo, len(orden)])
+    rango = np.arange(len(orden)) - np.repeat(inicio_grupo, largo_grupo)
+    elegidos = orden[rango < picos_por_segundo]
+
+    orden = np.lexsort((frecuencias[elegidos], frames[elegidos]))
+    return frecuencias[elegidos][orden], frames[elegidos][orden]
+
+
+def emparejar_picos(frecuencias, frames, fan_out, distancia_max, delta_frecuencia_max):
+    """
+    Combina cada pico con los fan_out picos siguientes que caen en su zona objetivo
+    (entre 1 y distancia_max frames después y a lo más delta_frecuencia_max bins).
+    Retorna (índice del ancla, índice del objetivo) de cada par, ordenados por ancla.
+    """
+    anclas = []
+    objetivos = []
+    n = len(frames)
+    # con picos_por_segundo acotado basta mirar un número fijo de picos hacia adelante
+    for salto in range(1, 4 * fan_out + 1):
+        i = np.arange(n - salto)
+        j = i + salto
+        distancia = frames[j] - frames[i]
+        validos = (distancia >= 1) & (distancia <= distancia_max) & \
+                  (np.abs(frecuencias[j] - frecuencias[i]) <= delta_frecuencia_max)
+        anclas.append(i[validos])
+        objetivos.append(j[validos])
+    anclas = np.concatenate(anclas)
+    objetivos = np.concatenate(objetivos)
+    # los más cercanos primero; se dejan fan_out por ancla
+    orden = np.lexsort((objetivos, anclas))
+    anclas = anclas[orden]
+    objetivos = objetivos[orden]
+    inicio_grupo = np.flatnonzero(np.r_[True, anclas[1:] != anclas[:-1]]) if len(anclas) else np.zeros(0, int)
+    largo_grupo = np.diff(np.r_[inicio_grupo, len(anclas)])
+    rango = np.arange(len(anclas)) - np.repeat(inicio_grupo, largo_grupo)
+    return anclas[rango < fan_out], objetivos[rango < fan_out]
+
+
+def calcular_huellas(samples, sample_rate, n_fft, hop_length, fan_out=5, picos_por_segundo=30,
+                     vecindad_frecuencia=15, vecindad_tiempo=7):
+    """
+    Calcula las huellas de un audio mono ya decodificado. Retorna una matriz uint32 de
+    (num_huellas, 1) con los hashes y el tiempo de inicio (tiempo del ancla) de cada una,
+    con la misma convención de tiempos que mfcc.calcular_mfcc.
+    """
+    potencia = espectrograma_potencia(samples, n_fft, hop_length)
+    # el bin de Nyquist queda fuera para que la frecuencia quepa en BITS_FRECUENCIA;
+    # la matriz queda como (frecuencia, frame)
+    espectro_db = potencia_a_db(potencia[:, :1 << BITS_FRECUENCIA]).T
+    frames_por_segundo = sample_rate / hop_length
+    frecuencias, frames = detectar_picos(espectro_db, vecindad_frecuencia, vecindad_tiempo, picos_por_segundo,
+                                         frames_por_segundo)
+    distancia_max = (1 << BITS_DISTANCIA) - 1
+    anclas, objetivos = emparejar_picos(frecuencias, frames, fan_out, distancia_max,
+                                        delta_frecuencia_max=(1 << BITS_FRECUENCIA) // 4)
+
+    hashes = (frecuencias[anclas].astype(np.uint32) << (BITS_FRECUENCIA + BITS_DISTANCIA)) | \
+             (frecuencias[objetivos].astype(np.uint32) << BITS_DISTANCIA) | \
+             (frames[objetivos] - frames[anclas]).astype(np.uint32)
+    tiempos_inicio = tiempos_de_frames(frames[anclas], sample_rate, hop_length, n_fft)
+    return hashes.reshape(-1, 1), tiempos_inicio
+
+
+def es_almacen_de_huellas(descriptores):
+    parametros = descriptores.parametros or {}
+    return parametros.get('descriptor') == 'huellas'
+
+
+class IndiceInvertido:
+    """
+    Tabla hash -> filas de R, guardada como los hashes ordenados junto a sus filas.
+    Buscar un bloque de hashes de Q es un searchsorted; no hay distancias, todas las
+    coincidencias valen lo mismo. Los hashes que aparecen más de max_por_hash veces en R
+    se ignoran, porque casi no distinguen canciones y generan muchos votos.
+    """
+    nombre = "invertido"
+    persistente = False
+
+    def __init__(self, max_por_hash=500):
+        self.max_por_hash = max_por_hash
+        self.hashes = None
+        self.filas = None
+
+    def construir(self, hashes, vivas=None):
+        hashes = np.asarray(hashes).reshape(-1)
+        filas = np.arange(len(hashes)) if vivas is None else np.flatnonzero(vivas)
+        orden = np.argsort(hashes[filas], kind='stable')
+        self.hashes = hashes[filas][orden]
+        self.filas = filas[orden]
+
+    def buscar(self, hashes_Q):
+        """
+        Retorna (filas_Q, filas_R) de todas las coincidencias, ordenadas por fila de Q
+        y luego por fila de R.
+        """
+        hashes_Q = np.asarray(hashes_Q).reshape(-1)
+        izquierda = np.searchsorted(self.hashes, hashes_Q, side='left')
+        derecha = np.searchsorted(self.hashes, hashes_Q, side='right')
+        cuentas = derecha - izquierda
+        cuentas[cuentas > self.max_por_hash] = 0
+        filas_Q = np.repeat(np.arange(len(hashes_Q)), cuentas)
+        inicio_Q = np.cumsum(cuentas) - cuentas
+        posiciones = np.arange(len(filas_Q)) - inicio_Q[filas_Q] + izquierda[filas_Q]
+        return filas_Q, self.filas[posiciones]
+
+
+def buscar_coincidencias_por_bloques(indice, hashes_Q, tamano_bloque=65536, inicio=0, fin=None, vivas_Q=None):
+    """
+    Recorre las filas [inicio, fin) de hashes_Q en bloques y entrega (filas_Q, filas_R)
+    de las coincidencias de cada bloque, con las filas de Q ya absolutas.
+    """
+    if fin is None:
+        fin = len(hashes_Q)
+    for inicio_bloque in range(inicio, fin, tamano_bloque):
+        fin_bloque = min(inicio_bloque + tamano_bloque, fin)
+        with medir("consultar_indice"):
+            filas_Q, filas_R = indice.buscar(hashes_Q[inicio_bloque:fin_bloque])
+        contar("consultas", fin_bloque - inicio_bloque)
+        filas_Q += inicio_bloque
+        if vivas_Q is not None:
+            filas_R = filas_R[vivas_Q[filas_Q]]
+            filas_Q = filas_Q[vivas_Q[filas_Q]]
+        yield filas_Q, filas_R
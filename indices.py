@@ -0,0 +1,504 @@
+# indices.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Índices de vecinos más cercanos intercambiables para la búsqueda de Q en R.
+# Todos exponen la misma interfaz:
+#   construir(matriz)            crea el índice sobre la matriz float32 de R
+#   buscar(consultas, k)         retorna (indices int64, distancias float32) de forma (num_consultas, k)
+#   guardar(archivo)             escribe el índice construido
+#   cargar(archivo, matriz)      lee un índice guardado sobre la misma matriz
+#   parametros()                 dict con lo que define el índice (se usa para el hash)
+# Las distancias son siempre L2 al cuadrado, igual que FLANN. Si un índice encuentra
+# menos de k candidatos, completa con índice -1 y distancia infinita.
+# Las librerías de cada índice se importan solo al crearlo, así no es necesario
+# tener instaladas las que no se usan.
+
+import os
+import signal
+import multiprocessing
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from util import Descriptores, hash_descriptores, listar_archivos_con_extension, medir, contar
+
+
+class IndiceFlann:
+    nombre = "flann"
+    persistente = True
+
+    def __init__(self, cores=1, trees=5, checks=64):
+        from pyflann import FLANN
+        self.flann = FLANN()
+        self.cores = cores
+        self.trees = trees
+        self.checks = checks
+
+    def parametros(self):
+        return {'indice': self.nombre, 'algorithm': 'kdtree', 'trees': self.trees}
+
+    def construir(self, matriz):
+        self.flann.build_index(matriz, algorithm='kdtree', trees=self.trees)
+
+    def guardar(self, archivo):
+        self.flann.save_index(os.fsencode(archivo))
+
+    def cargar(self, archivo, matriz):
+        self.flann.load_index(os.fsencode(archivo), matriz)
+
+    def buscar(self, consultas, k):
+        indices, distancias = self.flann.nn_index(consultas, num_neighbors=k, checks=self.checks, cores=self.cores)
+        # con k=1 FLANN retorna arreglos de una dimensión
+        return np.reshape(indices, (len(consultas), k)).astype(np.int64), np.reshape(distancias, (len(consultas), k))
+
+
+class IndiceFaiss:
+    persistente = True
+
+    def __init__(self, tipo="flat", cores=1, nlist=None, nprobe=16, hnsw_m=32, ef_search=64,
+                 dim_pca=16, m_pq=8, bits_pq=8, blanquear=False, muestra_entrenamiento=100000):
+        import faiss
+        self.faiss = faiss
+        self.faiss.omp_set_num_threads(cores)
+        self.tipo = tipo
+        self.nombre = "faiss-" + tipo
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.dim_pca = dim_pca
+        self.m_pq = m_pq
+        self.bits_pq = bits_pq
+        self.blanquear = blanquear
+        self.muestra_entrenamiento = muestra_entrenamiento
+        self.indice = None
+
+    def parametros(self):
+        parametros = {'indice': self.nombre, 'nlist': self.nlist, 'hnsw_m': self.hnsw_m}
+        if self.tipo in ("pq", "ivfpq"):
+            parametros.update({'dim_pca': self.dim_pca, 'm_pq': self.m_pq, 'bits_pq': self.bits_pq,
+                               'blanquear': self.blanquear})
+        return parametros
+
+    def muestra(self, matriz, cantidad):
+        # muestra fija de filas de R para entrenar
+        filas = np.random.default_rng(0).permutation(len(matriz))[:cantidad]
+        return matriz[np.sort(filas)]
+
+    def construir(self, matriz):
+        matriz = np.ascontiguousarray(matriz, dtype=np.float32)
+        dim = matriz.shape[1]
+        if self.tipo == "flat":
+            self.indice = self.faiss.IndexFlatL2(dim)
+        elif self.tipo == "ivf":
+            if self.nlist is None:
+                self.nlist = max(1, int(4 * np.sqrt(len(matriz))))
+            cuantizador = self.faiss.IndexFlatL2(dim)
+            self.indice = self.faiss.IndexIVFFlat(cuantizador, dim, self.nlist)
+            # faiss recomienda entre 39 y 256 ejemplos por centroide para entrenar
+            self.indice.train(self.muestra(matriz, 256 * self.nlist))
+        elif self.tipo == "hnsw":
+            self.indice = self.faiss.IndexHNSWFlat(dim, self.hnsw_m)
+        elif self.tipo in ("pq", "ivfpq"):
+            # rotación PCA (opcionalmente con blanqueo) entrenada con una muestra de R, y
+            # cuantización por productos: cada frame se guarda en m_pq códigos de bits_pq bits.
+            # La búsqueda compara la consulta sin cuantizar con los códigos (distancia asimétrica).
+            # Con los valores por omisión son 8 bytes por frame en vez de 80
+            bits = min(self.bits_pq, int(np.log2(max(2, len(matriz)))))
+            pca = "PCAW{}".format(self.dim_pca) if self.blanquear else "PCA{}".format(self.dim_pca)
+            if self.tipo == "pq":
+                descripcion = "{},PQ{}x{}".format(pca, self.m_pq, bits)
+            else:
+                if self.nlist is None:
+                    self.nlist = max(1, int(4 * np.sqrt(len(matriz))))
+                descripcion = "{},IVF{},PQ{}x{}".format(pca, min(self.nlist, len(matriz)), self.m_pq, bits)
+            self.indice = self.faiss.index_factory(dim, descripcion)
+            self.indice.train(self.muestra(matriz, self.muestra_entrenamiento))
+        else:
+            raise Exception("tipo de índice faiss desconocido: {}".format(self.tipo))
+        self.indice.add(matriz)
+
+    def guardar(self, archivo):
+        self.faiss.write_index(self.indice, archivo)
+
+    def cargar(self, archivo, matriz):
+        self.indice = self.faiss.read_index(archivo)
+
+    def buscar(self, consultas, k):
+        if self.tipo in ("ivf", "ivfpq"):
+            self.faiss.extract_index_ivf(self.indice).nprobe = self.nprobe
+        elif self.tipo == "hnsw":
+            self.indice.hnsw.efSearch = max(self.ef_search, k)
+        distancias, indices = self.indice.search(np.ascontiguousarray(consultas, dtype=np.float32), k)
+        distancias[indices < 0] = np.inf
+        return indices.astype(np.int64), distancias
+
+
+class IndiceAnnoy:
+    nombre = "annoy"
+    persistente = True
+
+    def __init__(self, cores=1, n_trees=20, search_k=-1):
+        from annoy import AnnoyIndex
+        self.AnnoyIndex = AnnoyIndex
+        self.cores = cores
+        self.n_trees = n_trees
+        self.search_k = search_k
+        self.indice = None
+
+    def parametros(self):
+        return {'indice': self.nombre, 'n_trees': self.n_trees}
+
+    def construir(self, matriz):
+        self.indice = self.AnnoyIndex(matriz.shape[1], 'euclidean')
+        for i in range(len(matriz)):
+            self.indice.add_item(i, matriz[i])
+        self.indice.build(self.n_trees, n_jobs=self.cores)
+
+    def guardar(self, archivo):
+        self.indice.save(archivo)
+
+    def cargar(self, archivo, matriz):
+        self.indice = self.AnnoyIndex(matriz.shape[1], 'euclidean')
+        self.indice.load(archivo)
+
+    def buscar(self, consultas, k):
+        indices = np.full((len(consultas), k), -1, dtype=np.int64)
+        distancias = np.full((len(consultas), k), np.inf, dtype=np.float32)
+
+        def buscar_fila(i):
+            ids, dist = self.indice.get_nns_by_vector(consultas[i], k, search_k=self.search_k,
+                                                      include_distances=True)
+            indices[i, :len(ids)] = ids
+            # annoy retorna la distancia euclidiana, se eleva al cuadrado como en FLANN
+            distancias[i, :len(ids)] = np.square(dist)
+
+        # annoy consulta de a un vector, pero libera el GIL durante la búsqueda
+        with ThreadPoolExecutor(max_workers=self.cores) as pool:
+            list(pool.map(buscar_fila, range(len(consultas))))
+        return indices, distancias
+
+
+class IndiceExacto:
+    """
+    Búsqueda exacta por fuerza bruta: las distancias de un bloque de consultas contra
+    todo R se calculan con un producto de matrices (BLAS) usando
+    |q - r|^2 = |q|^2 - 2 q·r + |r|^2
+    """
+    nombre = "exacto"
+    persistente = False
+
+    def __init__(self, celdas_por_bloque=1 << 25):
+        self.celdas_por_bloque = celdas_por_bloque
+        self.matriz = None
+        self.normas = None
+
+    def parametros(self):
+        return {'indice': self.nombre}
+
+    def construir(self, matriz, normas=None):
+        # normas (opcional) son las normas al cuadrado de las filas, si ya se conocen
+        self.matriz = np.asarray(matriz, dtype=np.float32)
+        self.normas = np.einsum('ij,ij->i', self.matriz, self.matriz) if normas is None else normas
+
+    def guardar(self, archivo):
+        pass
+
+    def cargar(self, archivo, matriz):
+        self.construir(matriz)
+
+    def buscar(self, consultas, k):
+        consultas = np.asarray(consultas, dtype=np.float32)
+        n = len(self.matriz)
+        k_real = min(k, n)
+        indices = np.full((len(consultas), k), -1, dtype=np.int64)
+        distancias = np.full((len(consultas), k), np.inf, dtype=np.float32)
+        # se limita el tamaño de la matriz de distancias de cada bloque
+        filas_por_bloque = max(1, min(4096, self.celdas_por_bloque // max(n, 1)))
+        for inicio in range(0, len(consultas), filas_por_bloque):
+            bloque = consultas[inicio:inicio + filas_por_bloque]
+            dist = self.normas[np.newaxis, :] - 2 * (bloque @ self.matriz.T)
+            dist += np.einsum('ij,ij->i', bloque, bloque)[:, np.newaxis]
+            np.maximum(dist, 0, out=dist)
+            if k_real < n:
+                cercanos = np.argpartition(dist, k_real - 1, axis=1)[:, :k_real]
+            else:
+                cercanos = np.tile(np.arange(n), (len(bloque), 1))
+            dist_cercanos = np.take_along_axis(dist, cercanos, axis=1)
+            # a igual distancia primero la fila menor, así el orden no depende de argpartition
+            orden = np.lexsort((cercanos, dist_cercanos), axis=1)
+            fin = inicio + len(bloque)
+            indices[inicio:fin, :k_real] = np.take_along_axis(cercanos, orden, axis=1)
+            distancias[inicio:fin, :k_real] = np.take_along_axis(dist_cercanos, orden, axis=1)
+        return indices, distancias
+
+
+# nombres que se pueden usar en la línea de comandos
+NOMBRES_INDICES = ["flann", "faiss-flat", "faiss-ivf", "faiss-hnsw", "faiss-pq", "faiss-ivfpq", "annoy", "exacto"]
+
+
+def crear_indice(nombre, cores=1):
+    if nombre == "flann":
+        return IndiceFlann(cores=cores)
+    elif nombre.startswith("faiss-"):
+        return IndiceFaiss(tipo=nombre[len("faiss-"):], cores=cores)
+    elif nombre == "annoy":
+        return IndiceAnnoy(cores=cores)
+    elif nombre == "exacto":
+        # usa los threads de la librería BLAS de numpy
+        return IndiceExacto()
+    raise Exception("índice desconocido: {} (opciones: {})".format(nombre, ", ".join(NOMBRES_INDICES)))
+
+
+def cargar_o_construir_indice(indice, matriz, carpeta, sufijo=""):
+    """
+    Construye el índice sobre la matriz de R. Si el índice se puede guardar, queda en la
+    carpeta con un nombre que incluye el hash de los descriptores y de los parámetros,
+    de modo que las siguientes ejecuciones con el mismo R solo tienen que leerlo.
+    El sufijo separa los nombres de índices de otro tipo (los fragmentos de IndiceFragmentado),
+    para que limpiar_indices de uno no borre los del otro.
+    Retorna el nombre del archivo del índice (None si no se guarda, por ejemplo con
+    descriptores en memoria, que no tienen carpeta).
+    """
+    if not indice.persistente or carpeta is None:
+        print("Creando índice {}...".format(indice.nombre))
+        indice.construir(matriz)
+        return None
+    hash_R = hash_descriptores(matriz, indice.parametros())
+    archivo_indice = os.path.join(carpeta, "indice_{}{}.{}.idx".format(indice.nombre, sufijo, hash_R))
+    if os.path.isfile(archivo_indice):
+        print("Cargando índice {}...".format(archivo_indice))
+        indice.cargar(archivo_indice, matriz)
+        return archivo_indice
+    print("Creando índice {}...".format(indice.nombre))
+    indice.construir(matriz)
+    indice.guardar(archivo_indice + ".tmp")
+    os.replace(archivo_indice + ".tmp", archivo_indice)
+    return archivo_indice
+
+
+def limpiar_indices(carpeta, nombre_indice, archivos_en_uso):
+    # descarta índices guardados de versiones anteriores de R
+    if carpeta is None:
+        return
+    prefijo = "indice_{}.".format(nombre_indice)
+    en_uso = set(os.path.basename(archivo) for archivo in archivos_en_uso if archivo is not None)
+    for archivo in listar_archivos_con_extension(carpeta, ".idx"):
+        if archivo.startswith(prefijo) and archivo not in en_uso:
+            os.remove(os.path.join(carpeta, archivo))
+
+
+class IndiceSegmentado:
+    """
+    Índice sobre un almacén de R (util.Descriptores) que puede tener varios segmentos
+    por actualizaciones incrementales. Cada segmento tiene su propio índice guardado,
+    así agregar canciones solo construye el índice del segmento nuevo. Las consultas
+    se hacen en todos los segmentos, se juntan los k más cercanos y se descartan las
+    filas de archivos desactivados.
+    """
+
+    def __init__(self, nombre_indice, cores, descriptores):
+        self.nombre = nombre_indice
+        self.persistente = False
+        self.segmentos = []
+        archivos_en_uso = []
+        for inicio, fin in zip(descriptores.segmentos[:-1], descriptores.segmentos[1:]):
+            indice = crear_indice(nombre_indice, cores=cores)
+            with medir("construir_indice"):
+                archivos_en_uso.append(cargar_o_construir_indice(indice, descriptores.matriz[inicio:fin],
+                                                                 descriptores.carpeta))
+            self.segmentos.append((inicio, indice))
+        limpiar_indices(descriptores.carpeta, nombre_indice, archivos_en_uso)
+        self.vivas = descriptores.filas_vivas()
+
+    def buscar(self, consultas, k):
+        if len(self.segmentos) == 1 and self.vivas is None:
+            return self.segmentos[0][1].buscar(consultas, k)
+        todos_indices = []
+        todas_distancias = []
+        for inicio, indice in self.segmentos:
+            indices, distancias = indice.buscar(consultas, k)
+            todos_indices.append(np.where(indices >= 0, indices + inicio, -1))
+            todas_distancias.append(distancias)
+        return unir_vecinos(todos_indices, todas_distancias, k, self.vivas)
+
+
+def unir_vecinos(todos_indices, todas_distancias, k, vivas=None):
+    """
+    Junta los vecinos de varios índices sobre partes de R (con filas ya absolutas) y deja
+    los k más cercanos de cada consulta. Entre distancias iguales queda primero la parte
+    anterior de la lista; se descartan las filas que no están en vivas.
+    """
+    indices = np.concatenate(todos_indices, axis=1)
+    distancias = np.concatenate(todas_distancias, axis=1)
+    if vivas is not None:
+        muertas = (indices >= 0) & ~vivas[np.maximum(indices, 0)]
+        indices[muertas] = -1
+        distancias[muertas] = np.inf
+    orden = np.argsort(distancias, axis=1, kind='stable')[:, :k]
+    indices = np.take_along_axis(indices, orden, axis=1)
+    distancias = np.take_along_axis(distancias, orden, axis=1)
+    indices[np.isinf(distancias)] = -1
+    return indices, distancias
+
+
+def repartir_por_cancion(descriptores, fragmentos):
+    """
+    Reparte los archivos de R en a lo más `fragmentos` grupos de archivos consecutivos con
+    cantidades de filas parecidas. Cada grupo es un rango [inicio, fin) de filas; un archivo
+    nunca queda en dos grupos.
+    """
+    filas = np.diff(descriptores.offsets)
+    if len(filas) == 0 or filas.sum() == 0:
+        raise Exception("R no tiene descriptores para repartir en fragmentos")
+    # cada grupo termina en el archivo donde las filas acumuladas pasan su parte del total
+    acumuladas = np.cumsum(filas)
+    cortes = np.searchsorted(acumuladas, acumuladas[-1] * np.arange(1, fragmentos) / fragmentos, side='left') + 1
+    limites = np.unique(np.concatenate([[0], cortes, [len(filas)]]))
+    return [(int(descriptores.offsets[a]), int(descriptores.offsets[b])) for a, b in zip(limites[:-1], limites[1:])
+            if descriptores.offsets[b] > descriptores.offsets[a]]
+
+
+# los índices guardados de cada fragmento se llaman indice_<nombre>-fragmento.<hash>.idx
+SUFIJO_FRAGMENTO = "-fragmento"
+
+
+def servir_fragmento(conexion, nombre_indice, cores, carpeta, inicio, fin, matriz):
+    """
+    Proceso de un fragmento de IndiceFragmentado: construye (o carga) el índice de las filas
+    [inicio, fin) de R y responde las consultas que llegan por la conexión con filas absolutas de R.
+    Es el equivalente local de un nodo remoto; solo recibe consultas y entrega vecinos.
+    """
+    # Ctrl+C llega a todo el grupo de procesos; el proceso principal es el que cierra los fragmentos
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        if matriz is None:
+            matriz = Descriptores(carpeta).matriz[inicio:fin]
+        matriz = np.ascontiguousarray(matriz, dtype=np.float32)
+        indice = crear_indice(nombre_indice, cores=cores)
+        archivo_indice = cargar_o_construir_indice(indice, matriz, carpeta, sufijo=SUFIJO_FRAGMENTO)
+    except Exception as e:
+        conexion.send(("error", repr(e)))
+        return
+    conexion.send(("listo", archivo_indice))
+    while True:
+        try:
+            pedido = conexion.recv()
+        except EOFError:
+            # el proceso principal terminó sin cerrar el fragmento
+            break
+        if pedido is None:
+            break
+        consultas, k = pedido
+        try:
+            indices, distancias = indice.buscar(consultas, k)
+            conexion.send(("vecinos", np.where(indices >= 0, indices + inicio, -1), distancias))
+        except Exception as e:
+            conexion.send(("error", repr(e)))
+
+
+class IndiceFragmentado:
+    """
+    Índice de R repartido por canción en varios fragmentos, cada uno con su propio índice en
+    su propio proceso (ver servir_fragmento). Cada bloque de consultas se envía a todos los
+    fragmentos y se juntan sus k más cercanos por distancia, así el resultado es el de un solo
+    índice sobre R (igual con el índice exacto; con uno aproximado cada fragmento busca en
+    menos puntos). Las filas de archivos desactivados se descartan después de juntar, como
+    en IndiceSegmentado con un solo segmento.
+    """
+
+    def __init__(self, nombre_indice, cores, descriptores, fragmentos):
+        self.nombre = nombre_indice
+        self.persistente = False
+        grupos = repartir_por_cancion(descriptores, fragmentos)
+        cores_por_fragmento = max(1, cores // len(grupos))
+        self.vivas = descriptores.filas_vivas()
+        self.conexiones = []
+        self.procesos = []
+        # con spawn cada fragmento empieza sin heredar archivos, sockets ni threads del proceso
+        # principal, como un nodo aparte; así además detecta cuando el principal termina
+        contexto = multiprocessing.get_context("spawn")
+        print("Creando {} fragmentos del índice {}...".format(len(grupos), nombre_indice))
+        with medir("construir_indice"):
+            for inicio, fin in grupos:
+                # sin carpeta (descriptores en memoria) el fragmento recibe sus filas
+                matriz = descriptores.matriz[inicio:fin] if descriptores.carpeta is None else None
+                conexion, conexion_fragmento = contexto.Pipe()
+                proceso = contexto.Process(target=servir_fragmento, daemon=True,
+                                                  args=(conexion_fragmento, nombre_indice, cores_por_fragmento,
+                                                        descriptores.carpeta, inicio, fin, matriz))
+                proceso.start()
+                conexion_fragmento.close()
+                self.conexiones.append(conexion)
+                self.procesos.append(proceso)
+            # los fragmentos construyen sus índices al mismo tiempo
+            archivos_en_uso = [self.recibir(conexion)[0] for conexion in self.conexiones]
+        limpiar_indices(descriptores.carpeta, nombre_indice + SUFIJO_FRAGMENTO, archivos_en_uso)
+
+    def __len__(self):
+        return len(self.procesos)
+
+    def recibir(self, conexion):
+        try:
+            respuesta = conexion.recv()
+        except EOFError:
+            raise Exception("un fragmento del índice {} terminó inesperadamente".format(self.nombre))
+        if respuesta[0] == "error":
+            raise Exception("error en un fragmento del índice {}: {}".format(self.nombre, respuesta[1]))
+        return respuesta[1:]
+
+    def buscar(self, consultas, k):
+        consultas = np.ascontiguousarray(consultas, dtype=np.float32)
+        for conexion in self.conexiones:
+            conexion.send((consultas, k))
+        respuestas = [self.recibir(conexion) for conexion in self.conexiones]
+        indices, distancias = unir_vecinos([r[0] for r in respuestas], [r[1] for r in respuestas], k)
+        if self.vivas is None:
+            return indices, distancias
+        # como un solo índice sobre todo R: primero los k más cercanos, después se descartan los desactivados
+        return unir_vecinos([indices], [distancias], k, self.vivas)
+
+    def cerrar(self):
+        for conexion, proceso in zip(self.conexiones, self.procesos):
+            try:
+                conexion.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            conexion.close()
+            proceso.join()
+        self.conexiones = []
+        self.procesos = []
+
+
+def buscar_vecinos_por_bloques(indice, matriz_Q, k, tamano_bloque=65536, inicio=0, fin=None):
+    """
+    Recorre las filas [inicio, fin) de matriz_Q en bloques y consulta el índice con cada
+    bloque completo. Entrega (primera fila del bloque, indices, distancias) por bloque.
+    """
+    if fin is None:
+        fin = len(matriz_Q)
+    for inicio_bloque in range(inicio, fin, tamano_bloque):
+        fin_bloque = min(inicio_bloque + tamano_bloque, fin)
+        bloque = np.ascontiguousarray(matriz_Q[inicio_bloque:fin_bloque], dtype=np.float32)
+        with medir("consultar_indice"):
+            indices, distancias = indice.buscar(bloque, k)
+        contar("consultas", len(bloque))
+        yield inicio_bloque, indices, distancias
+
+
+def buscar_vecinos(indice, matriz_Q, k, tamano_bloque=65536, mostrar_progreso=True):
+    """
+    Busca los k vecinos de todas las filas de matriz_Q consultando el índice por
+    bloques de filas, de modo que cada llamada al índice procesa muchas consultas.
+    Retorna dos arreglos (num_Q, k): índices de filas de R y distancias.
+    """
+    indices = np.empty((len(matriz_Q), k), dtype=np.int64)
+    distancias = np.empty((len(matriz_Q), k), dtype=np.float32)
+    bloques = buscar_vecinos_por_bloques(indice, matriz_Q, k, tamano_bloque)
+    total = (len(matriz_Q) + tamano_bloque - 1) // tamano_bloque
+    for inicio, indices_bloque, distancias_bloque in tqdm(bloques, total=total, desc="Procesando Q",
+                                                          disable=not mostrar_progreso):
+        indices[inicio:inicio + len(indices_bloque)] = indices_bloque
+        distancias[inicio:inicio + len(indices_bloque)] = distancias_bloque
+    return indices, distancias
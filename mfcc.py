@@ -0,0 +1,129 @@
+# mfcc.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Cálculo de MFCC solo con numpy, equivalente a librosa.feature.mfcc con sus valores
+# por omisión (ventana de Hann, center=True con ceros, 128 filtros mel de Slaney,
+# power_to_db con top_db=80 y DCT tipo II ortonormal). Los filtros mel y la matriz de
+# la DCT se calculan una vez por combinación de parámetros, y la FFT se hace de una vez
+# sobre bloques de frames. Así no se importa librosa ni se compila nada con numba al
+# iniciar cada proceso.
+
+import functools
+import numpy as np
+
+# frames por cada llamada a rfft, para acotar la memoria con audios largos
+FRAMES_POR_BLOQUE = 256
+
+
+def hz_a_mel(frecuencias):
+    # escala mel de Slaney: lineal bajo 1000 Hz y logarítmica sobre 1000 Hz
+    frecuencias = np.atleast_1d(np.asarray(frecuencias, dtype=np.float64))
+    mels = frecuencias / (200.0 / 3)
+    logaritmica = frecuencias >= 1000.0
+    mels[logaritmica] = 15.0 + np.log(frecuencias[logaritmica] / 1000.0) / (np.log(6.4) / 27.0)
+    return mels
+
+
+def mel_a_hz(mels):
+    mels = np.atleast_1d(np.asarray(mels, dtype=np.float64))
+    frecuencias = mels * (200.0 / 3)
+    logaritmica = mels >= 15.0
+    frecuencias[logaritmica] = 1000.0 * np.exp((np.log(6.4) / 27.0) * (mels[logaritmica] - 15.0))
+    return frecuencias
+
+
+@functools.lru_cache(maxsize=None)
+def filtros_mel(sample_rate, n_fft, n_mels=128):
+    """
+    Banco de filtros triangulares (n_mels, 1 + n_fft // 2) con normalización de Slaney,
+    igual a librosa.filters.mel(sr=sample_rate, n_fft=n_fft, n_mels=n_mels).
+    """
+    frecuencias_fft = np.fft.rfftfreq(n_fft, 1.0 / sample_rate)
+    limites = hz_a_mel([0.0, sample_rate / 2.0])
+    frecuencias_mel = mel_a_hz(np.linspace(limites[0], limites[1], n_mels + 2))
+    anchos = np.diff(frecuencias_mel)
+    rampas = frecuencias_mel[:, None] - frecuencias_fft[None, :]
+    subida = -rampas[:-2] / anchos[:-1, None]
+    bajada = rampas[2:] / anchos[1:, None]
+    filtros = np.maximum(0, np.minimum(subida, bajada))
+    filtros *= (2.0 / (frecuencias_mel[2:] - frecuencias_mel[:-2]))[:, None]
+    return filtros.astype(np.float32)
+
+
+@functools.lru_cache(maxsize=None)
+def matriz_dct(n_mfcc, n_mels=128):
+    # primeras n_mfcc filas de la DCT tipo II ortonormal de largo n_mels
+    n = np.arange(n_mels)
+    dct = np.cos(np.pi / n_mels * (n[None, :] + 0.5) * np.arange(n_mfcc)[:, None]) * np.sqrt(2.0 / n_mels)
+    dct[0] /= np.sqrt(2.0)
+    return dct.astype(np.float32)
+
+
+@functools.lru_cache(maxsize=None)
+def ventana_hann(n_fft):
+    # ventana de Hann periódica, la que usa librosa.stft
+    return (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n_fft) / n_fft)).astype(np.float32)
+
+
+def espectrograma_potencia(samples, n_fft, hop_length, centrar=True):
+    """
+    |STFT|^2 de un audio mono como matriz (num_frames, 1 + n_fft // 2) en float32.
+    Con centrar se agregan n_fft // 2 ceros a cada lado, como center=True en librosa.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if centrar:
+        samples = np.pad(samples, n_fft // 2)
+    if len(samples) < n_fft:
+        return np.zeros((0, 1 + n_fft // 2), dtype=np.float32)
+    # vista (num_frames, n_fft) sobre las muestras, sin copiar
+    frames = np.lib.stride_tricks.sliding_window_view(samples, n_fft)[::hop_length]
+    ventana = ventana_hann(n_fft)
+    potencia = np.empty((len(frames), 1 + n_fft // 2), dtype=np.float32)
+    for inicio in range(0, len(frames), FRAMES_POR_BLOQUE):
+        espectro = np.fft.rfft(frames[inicio:inicio + FRAMES_POR_BLOQUE] * ventana, axis=1)
+        potencia[inicio:inicio + len(espectro)] = espectro.real ** 2 + espectro.imag ** 2
+    return potencia
+
+
+def potencia_a_db(potencia, top_db=80.0, maximo_db=None):
+    # como librosa.power_to_db con ref=1; el recorte es top_db bajo maximo_db (por omisión el máximo de la matriz)
+    db = 10.0 * np.log10(np.maximum(potencia, 1e-10))
+    if maximo_db is None:
+        maximo_db = db.max() if db.size > 0 else 0.0
+    return np.maximum(db, maximo_db - top_db)
+
+
+def mfcc_desde_db(mel_db, n_mfcc):
+    # (num_frames, n_mels) en dB -> (num_frames, n_mfcc)
+    return mel_db @ matriz_dct(n_mfcc, mel_db.shape[1]).T
+
+
+def normalizar_frames(mfcc):
+    # cada frame a media 0 y desviación 1
+    medias = np.mean(mfcc, axis=1, keepdims=True)
+    desviaciones = np.std(mfcc, axis=1, keepdims=True)
+    return ((mfcc - medias) / (desviaciones + 1e-8)).astype(np.float32)
+
+
+def tiempos_de_frames(frames, sample_rate, hop_length, n_fft):
+    # igual a librosa.frames_to_time(frames, sr, hop_length, n_fft): centro de la ventana sin relleno
+    return (np.asarray(frames) * hop_length + n_fft // 2) / float(sample_rate)
+
+
+def calcular_mfcc(samples, sample_rate, n_fft, hop_length, n_mfcc):
+    """
+    Calcula los MFCC de un audio mono ya decodificado y retorna la matriz de
+    descriptores (num_frames, n_mfcc) en float32, normalizada por frame, junto con
+    el tiempo de inicio de cada frame.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    # como librosa.util.normalize: el máximo absoluto queda en 1
+    pico = np.max(np.abs(samples)) if len(samples) > 0 else 0.0
+    if pico > np.finfo(np.float32).tiny:
+        samples = samples / pico
+    potencia = espectrograma_potencia(samples, n_fft, hop_length)
+    mel_db = potencia_a_db(potencia @ filtros_mel(sample_rate, n_fft).T)
+    descriptores = normalizar_frames(mfcc_desde_db(mel_db, n_mfcc))
+    return descriptores, tiempos_de_frames(np.arange(len(descriptores)), sample_rate, hop_length, n_fft)
@@ -0,0 +1,497 @@
+# pipeline.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Las etapas de la tarea como funciones importables: extraer descriptores de una carpeta
+# de audios, buscar las ventanas similares de Q en R y detectar por desfase.
+# tarea2-extractor.py, tarea2-busqueda.py y tarea2-deteccion.py usan estas funciones y
+# agregan la lectura y escritura de sus archivos. run() ejecuta las cuatro etapas en un
+# solo proceso pasando los arreglos en memoria, sin escribir descriptores ni ventanas.
+# Uso:
+#   python pipeline.py [carpeta_radio] [carpeta_canciones] [archivo_detecciones] [opciones]
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+from tqdm import tqdm
+import util
+import mfcc
+import huellas
+import cache_extraccion
+from indices import IndiceSegmentado, IndiceFragmentado, buscar_vecinos, NOMBRES_INDICES
+from preseleccion import IndiceDosEtapas
+from votacion import detectar_ventanas_similares
+
+# Parámetros para el cálculo de MFCC
+PARAMETROS_MFCC = {'sample_rate': 7000, 'n_fft': 2048, 'hop_length': 256, 'n_mfcc': 20}
+
+
+def parametros_extraccion(usar_huellas=False, apilar=1, paso=1, contexto="concatenar"):
+    """
+    Retorna (parametros, dim, tipo) del almacén de descriptores para las opciones
+    de tarea2-extractor.py.
+    """
+    parametros = dict(PARAMETROS_MFCC)
+    n_mfcc = parametros['n_mfcc']
+    dim = n_mfcc
+    tipo = 'float32'
+    if apilar > 1 or paso > 1:
+        # se guardan solo si cambian, así un almacén sin apilar tiene los mismos parámetros de antes
+        parametros.update({'apilar': apilar, 'paso': paso, 'contexto': contexto})
+        dim = n_mfcc * apilar if contexto == "concatenar" else 2 * n_mfcc
+    if usar_huellas:
+        # un hash uint32 por fila (ver huellas.py), con ventanas más cortas para ubicar bien los picos
+        parametros = {'descriptor': 'huellas', 'sample_rate': parametros['sample_rate'], 'n_fft': 1024,
+                      'hop_length': 128, 'fan_out': 5, 'picos_por_segundo': 30}
+        dim = 1
+        tipo = 'uint32'
+    return parametros, dim, tipo
+
+
+def apilar_frames(descriptores, inicios, apilar, paso, contexto="concatenar"):
+    """
+    Junta cada apilar frames consecutivos en un solo descriptor y avanza paso frames
+    entre descriptores. Con contexto="concatenar" el descriptor son los frames uno tras
+    otro (dimensión apilar * n_mfcc); con "estadisticas" es la media y la desviación de
+    cada coeficiente en esos frames (dimensión 2 * n_mfcc). El inicio es el del primer frame.
+    """
+    if len(descriptores) < apilar:
+        dim = descriptores.shape[1] * (apilar if contexto == "concatenar" else 2)
+        return np.zeros((0, dim), dtype=np.float32), inicios[:0]
+    # vista (num_ventanas, n_mfcc, apilar) sin copiar, ya con el paso aplicado
+    ventanas = np.lib.stride_tricks.sliding_window_view(descriptores, apilar, axis=0)[::paso]
+    if contexto == "concatenar":
+        apilados = ventanas.transpose(0, 2, 1).reshape(len(ventanas), -1)
+    elif contexto == "estadisticas":
+        apilados = np.concatenate([ventanas.mean(axis=2), ventanas.std(axis=2)], axis=1)
+    else:
+        raise Exception("contexto desconocido: {}".format(contexto))
+    return np.ascontiguousarray(apilados, dtype=np.float32), inicios[:len(descriptores) - apilar + 1:paso]
+
+
+def calcular_descriptores(samples, parametros):
+    # MFCC (mfcc.py), opcionalmente apilados, o huellas (huellas.py) según los parámetros del almacén
+    if parametros.get('descriptor') == 'huellas':
+        return huellas.calcular_huellas(samples, parametros['sample_rate'], parametros['n_fft'],
+                                        parametros['hop_length'], parametros['fan_out'],
+                                        parametros['picos_por_segundo'])
+    descriptores, inicios = mfcc.calcular_mfcc(samples, parametros['sample_rate'], parametros['n_fft'],
+                                               parametros['hop_length'], parametros['n_mfcc'])
+    if parametros.get('apilar', 1) > 1 or parametros.get('paso', 1) > 1:
+        descriptores, inicios = apilar_frames(descriptores, inicios, parametros.get('apilar', 1),
+                                              parametros.get('paso', 1), parametros.get('contexto', 'concatenar'))
+    return descriptores, inicios
+
+
+def cargar_audio(ruta_entrada, sample_rate, dir_temporal, usar_wav):
+    """
+    Decodifica el audio a mono con el sample_rate pedido. Por omisión FFmpeg entrega
+    las muestras por un pipe; con usar_wav se mantiene el camino antiguo que crea
+    un archivo WAV en dir_temporal y lo lee con librosa.
+    """
+    if usar_wav:
+        # librosa se carga solo en este camino, así no se paga su importación por omisión
+        import librosa
+        archivo_wav = util.convertir_a_wav(ruta_entrada, sample_rate, dir_temporal)
+        samples, _ = librosa.load(archivo_wav, sr=sample_rate, mono=True)
+    else:
+        samples = util.decodificar_audio(ruta_entrada, sample_rate)
+    logging.info(f'Audio cargado: {ruta_entrada}, muestras: {len(samples)}, sample_rate: {sample_rate}')
+    return samples
+
+
+def procesar_archivo(tarea):
+    """
+    Decodifica un archivo de audio y calcula sus descriptores. Se ejecuta en los
+    procesos del pool, por lo que recibe todo lo necesario en una tupla y retorna
+    los arreglos al proceso principal, que es el único que escribe el almacén.
+    Con cache (cache_extraccion.py) se usan los descriptores o el audio ya calculados
+    para el mismo contenido; el último valor retornado indica qué se encontró.
+    """
+    archivo_m4a, ruta_entrada, dir_temporal, usar_wav, parametros, cache = tarea
+    t0 = time.time()
+    samples = None
+    if cache is not None:
+        # el decodificador también es parte de la clave: librosa y FFmpeg no dan las mismas muestras
+        hash_audio = cache_extraccion.hash_contenido(ruta_entrada)
+        parametros_audio = {'sample_rate': parametros['sample_rate'], 'wav': usar_wav}
+        parametros_cache = dict(parametros, wav=usar_wav)
+        guardados = cache.leer_descriptores(hash_audio, parametros_cache)
+        if guardados is not None:
+            return archivo_m4a, guardados[0], guardados[1], (time.time() - t0, 0.0), "descriptores"
+        samples = cache.leer_audio(hash_audio, parametros_audio)
+    en_cache = None if samples is None else "audio"
+    if samples is None:
+        samples = cargar_audio(ruta_entrada, parametros['sample_rate'], dir_temporal, usar_wav)
+        if cache is not None:
+            cache.guardar_audio(hash_audio, parametros_audio, samples)
+    t1 = time.time()
+    descriptores, inicios = calcular_descriptores(samples, parametros)
+    if cache is not None:
+        cache.guardar_descriptores(hash_audio, parametros_cache, descriptores, inicios)
+    # los tiempos se retornan porque en un worker del pool no hay instrumentación (ver util.medir)
+    return archivo_m4a, descriptores, inicios, (t1 - t0, time.time() - t1), en_cache
+
+
+def extraer_archivos(carpeta_audios, archivos_m4a, parametros, workers=1, usar_wav=False, dir_temporal=None,
+                     cache=None):
+    """
+    Entrega (archivo, descriptores, inicios, segundos) de cada archivo de audio en el
+    orden de archivos_m4a, calculados en workers procesos (o leídos del cache).
+    """
+    tareas = []
+    for archivo_m4a in archivos_m4a:
+        ruta_entrada = os.path.join(carpeta_audios, archivo_m4a)
+        tareas.append((archivo_m4a, ruta_entrada, dir_temporal, usar_wav, parametros, cache))
+    pool = None
+    if workers <= 1:
+        resultados = map(procesar_archivo, tareas)
+    else:
+        # imap entrega los resultados en el mismo orden de las tareas,
+        # así el almacén queda igual que en la ejecución secuencial
+        pool = multiprocessing.Pool(workers)
+        resultados = pool.imap(procesar_archivo, tareas)
+    try:
+        for archivo_m4a, descriptores, inicios, (segundos_audio, segundos_descriptores), en_cache in resultados:
+            util.registrar_tiempo("extraccion/decodificar_audio", segundos_audio)
+            util.registrar_tiempo("extraccion/calcular_descriptores", segundos_descriptores)
+            if en_cache is not None:
+                util.contar("cache_" + en_cache)
+            util.contar("archivos_extraidos")
+            util.contar("frames_extraidos", len(descriptores))
+            yield archivo_m4a, descriptores, inicios, segundos_audio + segundos_descriptores
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def extraer(carpeta_audios, parametros=None, dim=None, tipo='float32', workers=1, usar_wav=False, cache=None):
+    """
+    Extrae los descriptores de todos los .m4a de la carpeta y los retorna en memoria
+    (util.DescriptoresEnMemoria), con la misma interfaz que un almacén en disco.
+    """
+    if parametros is None:
+        parametros, dim, tipo = parametros_extraccion()
+    archivos_m4a = util.listar_archivos_con_extension(carpeta_audios, ".m4a")
+    archivos = []
+    matrices = []
+    inicios = []
+    with tempfile.TemporaryDirectory() as dir_temporal:
+        for archivo_m4a, descriptores, inicios_archivo, segundos in extraer_archivos(
+                carpeta_audios, archivos_m4a, parametros, workers, usar_wav, dir_temporal, cache):
+            archivos.append(archivo_m4a)
+            matrices.append(descriptores)
+            inicios.append(inicios_archivo)
+            logging.info(f'Descriptores calculados para: {archivo_m4a} ({segundos:.1f} s)')
+    return util.DescriptoresEnMemoria(archivos, matrices, inicios, dim, parametros, tipo)
+
+
+def parametros_comparables(parametros):
+    # parámetros de extracción que Q y R deben compartir: todos salvo el paso (R puede usar uno
+    # mayor), con los valores por omisión de los almacenes sin apilar
+    parametros = dict(parametros)
+    parametros.pop('paso', None)
+    if parametros.get('descriptor') != 'huellas':
+        parametros.setdefault('apilar', 1)
+        parametros.setdefault('contexto', "concatenar")
+    return parametros
+
+
+def validar_Q_R(descriptores_Q, descriptores_R, candidatos=0):
+    # candidatos es el de construir_indice_R, para avisar antes de cargar nada que no sirve con huellas
+    if len(descriptores_R) == 0:
+        raise Exception("No se encontraron descriptores en R.")
+    if huellas.es_almacen_de_huellas(descriptores_Q) != huellas.es_almacen_de_huellas(descriptores_R):
+        raise Exception("Q y R deben ser ambos MFCC o ambos huellas (extraiga ambos con o sin --huellas)")
+    if descriptores_Q.dim != descriptores_R.dim:
+        raise Exception("Q tiene descriptores de dimensión {} y R de {} (extraiga ambos con el mismo --apilar "
+                        "y --contexto)".format(descriptores_Q.dim, descriptores_R.dim))
+    # almacenes antiguos no guardan sus parámetros; en ese caso solo se puede comparar la dimensión
+    if descriptores_Q.parametros is not None and descriptores_R.parametros is not None:
+        parametros_Q = parametros_comparables(descriptores_Q.parametros)
+        parametros_R = parametros_comparables(descriptores_R.parametros)
+        if parametros_Q != parametros_R:
+            raise Exception("Q y R se extrajeron con parámetros distintos (solo --paso puede cambiar): "
+                            "Q {} y R {}".format(parametros_Q, parametros_R))
+    if candidatos > 0 and huellas.es_almacen_de_huellas(descriptores_R):
+        raise Exception("la búsqueda en dos etapas (--candidatos) es solo para MFCC, no para huellas")
+
+
+def construir_indice_R(descriptores_R, cores=None, nombre_indice="flann", fragmentos=1, candidatos=0):
+    """
+    Índice sobre R para buscar(): un índice invertido si R tiene huellas, si no el
+    índice de vecinos elegido (uno por segmento si R se actualizó de forma incremental).
+    Con fragmentos > 1 el índice de vecinos se reparte por canción en ese número de
+    procesos (indices.IndiceFragmentado), que hay que terminar con cerrar_indice.
+    Con candidatos > 0 la búsqueda es en dos etapas (preseleccion.py): el índice elegido
+    es el de los resúmenes de R y cada segmento de Q se busca solo en sus canciones candidatas.
+    Las dos opciones no se pueden combinar (la primera etapa no se fragmenta).
+    """
+    if huellas.es_almacen_de_huellas(descriptores_R):
+        if candidatos > 0:
+            raise Exception("la búsqueda en dos etapas (--candidatos) es solo para MFCC, no para huellas")
+        print("Creando índice invertido de huellas...")
+        indice = huellas.IndiceInvertido()
+        with util.medir("construir_indice"):
+            indice.construir(descriptores_R.matriz, descriptores_R.filas_vivas())
+        return indice
+    if cores is None:
+        cores = multiprocessing.cpu_count()
+    if candidatos > 0 and fragmentos > 1:
+        raise Exception("la búsqueda en dos etapas (candidatos) no se puede fragmentar")
+    if candidatos > 0:
+        return IndiceDosEtapas(descriptores_R, candidatos, nombre_indice, cores)
+    if fragmentos > 1:
+        return IndiceFragmentado(nombre_indice, cores, descriptores_R, fragmentos)
+    return IndiceSegmentado(nombre_indice, cores, descriptores_R)
+
+
+def cerrar_indice(indice):
+    # termina los procesos de un índice fragmentado; los demás índices no tienen nada que cerrar
+    if isinstance(indice, IndiceFragmentado):
+        indice.cerrar()
+
+
+def buscar_filas(indice, matriz_Q, k=10, tamano_bloque=65536, vivas_Q=None, mostrar_progreso=True):
+    """
+    Retorna (filas_Q, filas_R, distancias) de las ventanas similares de cada fila de Q
+    en un índice de construir_indice_R.
+    """
+    with util.medir("busqueda"):
+        if isinstance(indice, huellas.IndiceInvertido):
+            pares = list(huellas.buscar_coincidencias_por_bloques(indice, matriz_Q, tamano_bloque, vivas_Q=vivas_Q))
+            filas_Q = np.concatenate([p[0] for p in pares]) if pares else np.zeros(0, dtype=np.int64)
+            filas_R = np.concatenate([p[1] for p in pares]) if pares else np.zeros(0, dtype=np.int64)
+            util.contar("vecinos_emitidos", len(filas_Q))
+            return filas_Q, filas_R, np.zeros(len(filas_Q), dtype=np.float32)
+        indices, distancias = buscar_vecinos(indice, matriz_Q, k, tamano_bloque=tamano_bloque,
+                                             mostrar_progreso=mostrar_progreso)
+        # cada fila de Q se repite k veces, una por vecino; se omiten los
+        # vecinos que el índice no encontró (índice -1) y los de archivos de Q desactivados
+        filas_Q = np.repeat(np.arange(len(matriz_Q)), k)
+        filas_R = indices.ravel()
+        encontrados = filas_R >= 0
+        if vivas_Q is not None:
+            encontrados &= vivas_Q[filas_Q]
+        util.contar("vecinos_emitidos", int(encontrados.sum()))
+        return filas_Q[encontrados], filas_R[encontrados], distancias.ravel()[encontrados]
+
+
+def buscar(descriptores_Q, descriptores_R, k=10, cores=None, tamano_bloque=65536, nombre_indice="flann",
+           indice=None, fragmentos=1, candidatos=0):
+    """
+    Busca las ventanas más similares de R para cada ventana de Q. Con MFCC son los k
+    vecinos de cada ventana en el índice elegido; con huellas son todas las ventanas de R
+    con el mismo hash (distancia 0). Se puede entregar un índice ya construido con
+    construir_indice_R. Retorna util.VentanasSimilares con los tiempos en float32, igual
+    que al leer el archivo binario de ventanas similares.
+    """
+    validar_Q_R(descriptores_Q, descriptores_R, candidatos)
+    propio = indice is None
+    if propio:
+        indice = construir_indice_R(descriptores_R, cores, nombre_indice, fragmentos, candidatos)
+    try:
+        print("Usando k =" + str(k))
+        if isinstance(indice, IndiceDosEtapas):
+            # necesita los tiempos y archivos de Q para dividirla en segmentos
+            with util.medir("busqueda"):
+                filas_Q, filas_R, distancias = indice.buscar_filas(descriptores_Q, k,
+                                                                   vivas_Q=descriptores_Q.filas_vivas())
+            util.contar("vecinos_emitidos", len(filas_Q))
+        else:
+            filas_Q, filas_R, distancias = buscar_filas(indice, descriptores_Q.matriz, k, tamano_bloque,
+                                                        descriptores_Q.filas_vivas())
+    finally:
+        if propio:
+            cerrar_indice(indice)
+    return ventanas_de_filas(descriptores_Q, descriptores_R, filas_Q, filas_R, distancias)
+
+
+def ventanas_de_filas(descriptores_Q, descriptores_R, filas_Q, filas_R, distancias):
+    return util.VentanasSimilares(descriptores_Q.archivos, descriptores_R.archivos,
+                                  descriptores_Q.ids_archivo(filas_Q).astype(np.int32),
+                                  np.asarray(descriptores_Q.inicios[filas_Q], dtype=np.float32),
+                                  descriptores_R.ids_archivo(filas_R).astype(np.int32),
+                                  np.asarray(descriptores_R.inicios[filas_R], dtype=np.float32),
+                                  np.asarray(distancias, dtype=np.float32))
+
+
+# Memoria de trabajo por cada ventana similar mientras se procesa un bloque de Q: resultado
+# del índice (int64 + float32), filas de Q y R con su máscara, ids e inicios en float64 y float32,
+# y el registro de util.DTYPE_VENTANA que se escribe. Es una cota, no todo coexiste a la vez.
+BYTES_POR_VENTANA = 120
+
+
+def filas_por_bloque_para_memoria(memoria_mb, descriptores_Q, k, indice=None):
+    """
+    Cantidad de filas de Q que se pueden buscar a la vez sin pasar de memoria_mb megabytes
+    de memoria de trabajo. Con huellas se supone el peor caso de coincidencias por hash
+    (max_por_hash del índice invertido), porque no dependen de k.
+    """
+    if isinstance(indice, huellas.IndiceInvertido):
+        ventanas_por_fila = indice.max_por_hash
+    else:
+        ventanas_por_fila = k
+    bytes_por_fila = descriptores_Q.dim * 4 + ventanas_por_fila * BYTES_POR_VENTANA
+    filas = int(memoria_mb * 1024 * 1024) // bytes_por_fila
+    if filas < 1:
+        raise Exception("{} MB no alcanzan para buscar una fila de Q ({} bytes)".format(memoria_mb, bytes_por_fila))
+    return filas
+
+
+def rangos_de_Q(descriptores_Q, filas_por_bloque, por_archivo=False):
+    """
+    Rangos [inicio, fin) de filas de Q de a lo más filas_por_bloque filas. Con por_archivo
+    un rango nunca mezcla dos archivos (un archivo largo se divide en varios rangos).
+    Se omiten los archivos desactivados.
+    """
+    if por_archivo:
+        limites = [descriptores_Q.filas_de_archivo(i) for i in range(len(descriptores_Q.archivos))
+                   if descriptores_Q.activos[i]]
+    else:
+        limites = [(0, len(descriptores_Q))]
+    for inicio_archivo, fin_archivo in limites:
+        for inicio in range(int(inicio_archivo), int(fin_archivo), filas_por_bloque):
+            yield inicio, min(inicio + filas_por_bloque, int(fin_archivo))
+
+
+def buscar_por_bloques(descriptores_Q, descriptores_R, k=10, cores=None, tamano_bloque=65536,
+                       nombre_indice="flann", indice=None, memoria_mb=256, por_archivo=False, fragmentos=1,
+                       candidatos=0):
+    """
+    Igual que buscar(), pero entrega las ventanas similares de a un bloque de Q (un
+    util.VentanasSimilares por bloque, en el orden de Q), para escribirlas antes de seguir.
+    La memoria de trabajo de la búsqueda queda acotada por memoria_mb sin importar cuántas
+    horas de radio tenga Q (las páginas ya leídas del almacén de Q se liberan después de cada
+    bloque); no incluye el índice de R.
+    """
+    validar_Q_R(descriptores_Q, descriptores_R, candidatos)
+    propio = indice is None
+    if propio:
+        indice = construir_indice_R(descriptores_R, cores, nombre_indice, fragmentos, candidatos)
+    try:
+        filas_por_bloque = filas_por_bloque_para_memoria(memoria_mb, descriptores_Q, k, indice)
+        print("Usando k = {}, bloques de hasta {} descriptores de Q".format(k, filas_por_bloque))
+        vivas_Q = descriptores_Q.filas_vivas()
+        rangos = list(rangos_de_Q(descriptores_Q, filas_por_bloque, por_archivo))
+        for inicio, fin in tqdm(rangos, desc="Procesando Q"):
+            if isinstance(indice, IndiceDosEtapas):
+                # los segmentos cortados por el borde del bloque se preseleccionan con la parte que tienen
+                with util.medir("busqueda"):
+                    filas_Q, filas_R, distancias = indice.buscar_filas(descriptores_Q, k, inicio, fin, vivas_Q)
+                util.contar("vecinos_emitidos", len(filas_Q))
+                filas_Q = filas_Q - inicio
+            else:
+                filas_Q, filas_R, distancias = buscar_filas(indice, descriptores_Q.matriz[inicio:fin], k,
+                                                            min(tamano_bloque, fin - inicio),
+                                                            None if vivas_Q is None else vivas_Q[inicio:fin],
+                                                            mostrar_progreso=False)
+            ventanas = ventanas_de_filas(descriptores_Q, descriptores_R, filas_Q + inicio, filas_R, distancias)
+            # las páginas de Q de este bloque no se vuelven a leer
+            descriptores_Q.liberar_paginas()
+            yield ventanas
+    finally:
+        if propio:
+            cerrar_indice(indice)
+
+
+def detectar(ventanas, ventana_duracion=5.0, k_min=2, margen_desfase=1.0, umbral_confianza=1):
+    # detecciones [archivo_Q, inicio, largo, archivo_R, confianza] por votación de desfase (ver votacion.py)
+    with util.medir("deteccion"):
+        detecciones = detectar_ventanas_similares(ventanas, ventana_duracion=ventana_duracion, k_min=k_min,
+                                                  margen_desfase=margen_desfase, umbral_confianza=umbral_confianza)
+    util.contar("detecciones", len(detecciones))
+    return detecciones
+
+
+def run(carpeta_radio, carpeta_canciones, archivo_detecciones=None, k=10, workers=1, cores=None,
+        nombre_indice="flann", usar_huellas=False, apilar=1, paso_Q=1, paso_R=1, contexto="concatenar",
+        fragmentos=1, cache=None, candidatos=0):
+    """
+    Extrae Q y R, busca y detecta en un solo proceso. Retorna las detecciones y, si se
+    indica archivo_detecciones, las escribe en el formato de tarea2-deteccion.py.
+    cache es un cache_extraccion.CacheExtraccion (o None) compartido por Q y R.
+    """
+    t0 = time.time()
+    parametros_Q, dim, tipo = parametros_extraccion(usar_huellas, apilar, paso_Q, contexto)
+    with util.medir("extraer_Q"):
+        descriptores_Q = extraer(carpeta_radio, parametros_Q, dim, tipo, workers, cache=cache)
+    logging.info(f'Q: {len(descriptores_Q)} descriptores ({time.time() - t0:.1f} s)')
+
+    t0 = time.time()
+    parametros_R, dim, tipo = parametros_extraccion(usar_huellas, apilar, paso_R, contexto)
+    with util.medir("extraer_R"):
+        descriptores_R = extraer(carpeta_canciones, parametros_R, dim, tipo, workers, cache=cache)
+    logging.info(f'R: {len(descriptores_R)} descriptores ({time.time() - t0:.1f} s)')
+
+    t0 = time.time()
+    ventanas = buscar(descriptores_Q, descriptores_R, k, cores, nombre_indice=nombre_indice, fragmentos=fragmentos,
+                      candidatos=candidatos)
+    logging.info(f'Búsqueda: {len(ventanas)} ventanas similares ({time.time() - t0:.1f} s)')
+
+    t0 = time.time()
+    detecciones = detectar(ventanas)
+    logging.info(f'Detección: {len(detecciones)} detecciones ({time.time() - t0:.1f} s)')
+    if archivo_detecciones is not None:
+        util.escribir_lista_de_columnas_en_archivo(detecciones, archivo_detecciones)
+    return detecciones
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(usage="python pipeline.py [carpeta_radio] [carpeta_canciones] [archivo_detecciones]")
+    parser.add_argument("carpeta_radio")
+    parser.add_argument("carpeta_canciones")
+    parser.add_argument("archivo_detecciones")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="cantidad de procesos para decodificar y calcular descriptores en paralelo")
+    parser.add_argument("--cores", type=int, default=None,
+                        help="cores que usa el índice en cada consulta (por omisión todos)")
+    parser.add_argument("--indice", default="flann", choices=NOMBRES_INDICES,
+                        help="índice de vecinos más cercanos a usar sobre R")
+    parser.add_argument("--fragmentos", type=int, default=1,
+                        help="reparte el índice de R por canción en N procesos y junta sus vecinos (solo MFCC)")
+    parser.add_argument("--candidatos", type=int, default=0,
+                        help="búsqueda en dos etapas: cada segmento de Q se busca solo en sus N canciones "
+                             "candidatas según resúmenes por segundo (solo MFCC, 0 = buscar en todo R; "
+                             "no se combina con --fragmentos)")
+    parser.add_argument("--huellas", action="store_true",
+                        help="usar huellas de pares de picos (huellas.py) en vez de MFCC")
+    parser.add_argument("--apilar", type=int, default=1,
+                        help="cantidad de frames MFCC consecutivos que forman cada descriptor")
+    parser.add_argument("--paso", type=int, default=1, help="frames que se avanza entre descriptores de Q")
+    parser.add_argument("--paso-r", type=int, default=None,
+                        help="frames que se avanza entre descriptores de R (por omisión igual a --paso)")
+    parser.add_argument("--contexto", default="concatenar", choices=["concatenar", "estadisticas"],
+                        help="cómo se combinan los frames apilados")
+    parser.add_argument("--cache", default=None,
+                        help="carpeta del cache de audio y descriptores entre ejecuciones (o variable TAREA2_CACHE)")
+    parser.add_argument("--cache-mb", type=float, default=None,
+                        help="tamaño máximo del cache en MB (por omisión TAREA2_CACHE_MB o 4096)")
+    parser.add_argument("--metricas", default=None,
+                        help="escribe tiempos por etapa, contadores y memoria máxima en este archivo JSON")
+    args = parser.parse_args(argumentos)
+    if args.candidatos > 0 and args.fragmentos > 1:
+        parser.error("--candidatos no se puede combinar con --fragmentos")
+    util.iniciar_metricas("pipeline", args.metricas)
+
+    for carpeta in [args.carpeta_radio, args.carpeta_canciones]:
+        if not os.path.isdir(carpeta):
+            print("ERROR: no existe {}".format(carpeta))
+            sys.exit(1)
+    paso_R = args.paso if args.paso_r is None else args.paso_r
+    run(args.carpeta_radio, args.carpeta_canciones, args.archivo_detecciones, workers=args.workers,
+        cores=args.cores, nombre_indice=args.indice, usar_huellas=args.huellas, apilar=args.apilar,
+        paso_Q=args.paso, paso_R=paso_R, contexto=args.contexto, fragmentos=args.fragmentos,
+        cache=cache_extraccion.abrir_cache(args.cache, args.cache_mb), candidatos=args.candidatos)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,178 @@
+# preseleccion.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Búsqueda en dos etapas, de lo general a lo detallado.
+# 1. Cada canción de R se resume en ventanas de 1 s (cada 0.5 s) con la media y la desviación
+#    de sus descriptores. La radio se divide en segmentos de unos segundos y cada segundo del
+#    segmento, resumido igual, busca sus vecinos entre los resúmenes de R; las canciones con
+#    más vecinos quedan como candidatas del segmento.
+# 2. Los k vecinos de cada descriptor del segmento se buscan solo entre los descriptores de
+#    sus canciones candidatas, con búsqueda exacta.
+# Así el costo de la segunda etapa depende de la cantidad de candidatas y no del tamaño de R.
+# Si una canción no queda entre las candidatas de un segmento, sus ventanas similares en ese
+# segmento se pierden: con pocas candidatas la búsqueda es más rápida pero puede detectar menos.
+
+import numpy as np
+from indices import IndiceExacto, crear_indice, cargar_o_construir_indice
+from util import medir, contar
+
+
+def resumir(matriz, tiempos, largo_tramo, tramos_por_ventana=1):
+    """
+    Resume las filas de un archivo (ordenadas por tiempo) en ventanas de tramos_por_ventana
+    tramos consecutivos de largo_tramo segundos: media y desviación de cada columna.
+    Retorna (resúmenes float32 de (num_ventanas, 2 * dim), primera fila de cada ventana).
+    """
+    tramos = np.floor(np.asarray(tiempos) / largo_tramo).astype(np.int64)
+    inicios = np.flatnonzero(np.concatenate([[True], tramos[1:] != tramos[:-1]]))
+    datos = np.asarray(matriz, dtype=np.float64)
+    # sumas acumuladas por tramo, así cada ventana es una resta
+    sumas = np.zeros((len(inicios) + 1, datos.shape[1]))
+    cuadrados = np.zeros((len(inicios) + 1, datos.shape[1]))
+    cuentas = np.zeros(len(inicios) + 1)
+    sumas[1:] = np.cumsum(np.add.reduceat(datos, inicios, axis=0), axis=0)
+    cuadrados[1:] = np.cumsum(np.add.reduceat(datos * datos, inicios, axis=0), axis=0)
+    cuentas[1:] = np.cumsum(np.diff(np.append(inicios, len(datos))))
+    ancho = min(tramos_por_ventana, len(inicios))
+    primeros = np.arange(len(inicios) - ancho + 1)
+    n = (cuentas[primeros + ancho] - cuentas[primeros])[:, np.newaxis]
+    media = (sumas[primeros + ancho] - sumas[primeros]) / n
+    varianza = (cuadrados[primeros + ancho] - cuadrados[primeros]) / n - media * media
+    resumenes = np.concatenate([media, np.sqrt(np.maximum(varianza, 0))], axis=1)
+    return resumenes.astype(np.float32), inicios[primeros]
+
+
+class IndiceDosEtapas:
+    """
+    Índice de R para la búsqueda en dos etapas: un índice de vecinos sobre los resúmenes de
+    las canciones (primera etapa) y la matriz de R para buscar solo en las candidatas.
+    """
+
+    def __init__(self, descriptores_R, candidatos=5, nombre_indice="flann", cores=1, segundos_segmento=5.0,
+                 largo_resumen=1.0, salto_resumen=0.5, vecinos_resumen=10):
+        self.descriptores_R = descriptores_R
+        self.candidatos = candidatos
+        self.segundos_segmento = segundos_segmento
+        self.largo_resumen = largo_resumen
+        self.vecinos_resumen = vecinos_resumen
+        # id_R -> (filas de R, matriz float32 contigua, normas), de las canciones ya usadas como candidatas
+        self.canciones = {}
+        resumenes = []
+        ids = []
+        with medir("construir_indice"):
+            for id_R in range(len(descriptores_R.archivos)):
+                inicio, fin = descriptores_R.filas_de_archivo(id_R)
+                # los archivos desactivados nunca quedan como candidatos
+                if not descriptores_R.activos[id_R] or fin == inicio:
+                    continue
+                resumenes_R, _ = resumir(descriptores_R.matriz[inicio:fin], descriptores_R.inicios[inicio:fin],
+                                         salto_resumen, int(round(largo_resumen / salto_resumen)))
+                resumenes.append(resumenes_R)
+                ids.append(np.full(len(resumenes_R), id_R, dtype=np.int64))
+            if len(resumenes) == 0:
+                raise Exception("R no tiene descriptores activos para resumir")
+            resumenes = np.concatenate(resumenes)
+            self.ids_resumen = np.concatenate(ids)
+            # cada columna con desviación 1, para que c0 (energía) no domine la distancia
+            self.escala = resumenes.std(axis=0) + 1e-6
+            self.indice_resumenes = crear_indice(nombre_indice, cores=cores)
+            print("Resúmenes de R: {} ventanas de {} s".format(len(resumenes), largo_resumen))
+            cargar_o_construir_indice(self.indice_resumenes, np.ascontiguousarray(resumenes / self.escala), None)
+
+    def segmentos(self, descriptores_Q, inicio, fin):
+        # rangos [inicio, fin) de filas de Q de cada segmento, sin mezclar archivos
+        ids = descriptores_Q.ids_archivo(np.arange(inicio, fin)) if fin > inicio else np.zeros(0, dtype=np.int64)
+        numero = np.floor(np.asarray(descriptores_Q.inicios[inicio:fin]) / self.segundos_segmento).astype(np.int64)
+        cambios = np.flatnonzero((ids[1:] != ids[:-1]) | (numero[1:] != numero[:-1])) + 1
+        limites = np.concatenate([[0], cambios, [fin - inicio]]) + inicio
+        return list(zip(limites[:-1], limites[1:]))
+
+    def preseleccionar(self, descriptores_Q, segmentos):
+        """
+        Ids de las canciones candidatas de cada segmento (lista de arreglos ordenados),
+        según los vecinos de los resúmenes de cada segundo del segmento.
+        """
+        resumenes = []
+        segmento_de_resumen = []
+        for numero, (inicio, fin) in enumerate(segmentos):
+            resumenes_Q, _ = resumir(descriptores_Q.matriz[inicio:fin], descriptores_Q.inicios[inicio:fin],
+                                     self.largo_resumen)
+            resumenes.append(resumenes_Q)
+            segmento_de_resumen.append(np.full(len(resumenes_Q), numero, dtype=np.int64))
+        resumenes = np.concatenate(resumenes) / self.escala
+        segmento_de_resumen = np.concatenate(segmento_de_resumen)
+        vecinos = min(self.vecinos_resumen, len(self.ids_resumen))
+        indices, _ = self.indice_resumenes.buscar(np.ascontiguousarray(resumenes, dtype=np.float32), vecinos)
+        contar("consultas_resumen", len(resumenes))
+        # votos por (segmento, canción); las más votadas de cada segmento son las candidatas
+        encontrados = indices >= 0
+        votos_segmento = np.repeat(segmento_de_resumen, vecinos)[encontrados.ravel()]
+        votos_cancion = self.ids_resumen[indices[encontrados]]
+        pares, cuentas = np.unique(np.stack([votos_segmento, votos_cancion], axis=1), axis=0, return_counts=True)
+        orden = np.lexsort((pares[:, 1], -cuentas, pares[:, 0]))
+        pares = pares[orden]
+        candidatas = [[] for _ in segmentos]
+        for segmento, cancion in pares:
+            if len(candidatas[segmento]) < self.candidatos:
+                candidatas[segmento].append(cancion)
+        return [np.sort(np.array(c, dtype=np.int64)) for c in candidatas]
+
+    def cancion(self, id_R):
+        # las filas de cada canción se copian del almacén y se calculan sus normas una sola vez;
+        # a lo más se guarda una copia de R
+        if id_R not in self.canciones:
+            inicio, fin = self.descriptores_R.filas_de_archivo(id_R)
+            filas = np.arange(inicio, fin)
+            matriz = np.ascontiguousarray(self.descriptores_R.matriz[inicio:fin], dtype=np.float32)
+            self.canciones[id_R] = (filas, matriz, np.einsum('ij,ij->i', matriz, matriz))
+        return self.canciones[id_R]
+
+    def buscar_filas(self, descriptores_Q, k, inicio=0, fin=None, vivas_Q=None):
+        """
+        Retorna (filas_Q, filas_R, distancias) de los k vecinos de cada fila [inicio, fin) de Q,
+        buscados solo entre las filas de las canciones candidatas de su segmento. Los segmentos
+        consecutivos con las mismas candidatas se buscan juntos, en un mismo índice exacto.
+        """
+        if fin is None:
+            fin = len(descriptores_Q)
+        segmentos = [(a, b) for a, b in self.segmentos(descriptores_Q, inicio, fin)
+                     if vivas_Q is None or vivas_Q[a]]
+        if len(segmentos) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        with medir("preseleccionar"):
+            candidatas = self.preseleccionar(descriptores_Q, segmentos)
+        # grupos de segmentos consecutivos con las mismas candidatas: (ids_R, rangos de Q)
+        grupos = []
+        for rango, ids_R in zip(segmentos, candidatas):
+            if len(ids_R) == 0:
+                continue
+            if len(grupos) > 0 and np.array_equal(grupos[-1][0], ids_R):
+                grupos[-1][1].append(rango)
+            else:
+                grupos.append((ids_R, [rango]))
+        todas_Q = []
+        todas_R = []
+        todas_distancias = []
+        filas_comparadas = 0
+        with medir("consultar_indice"):
+            for ids_R, rangos in grupos:
+                canciones = [self.cancion(i) for i in ids_R]
+                filas = np.concatenate([c[0] for c in canciones])
+                indice = IndiceExacto()
+                indice.construir(np.concatenate([c[1] for c in canciones]), np.concatenate([c[2] for c in canciones]))
+                filas_Q = np.concatenate([np.arange(a, b) for a, b in rangos])
+                consultas = np.concatenate([np.asarray(descriptores_Q.matriz[a:b], dtype=np.float32) for a, b in rangos])
+                indices, distancias = indice.buscar(consultas, k)
+                filas_comparadas += len(filas_Q) * len(filas)
+                filas_Q = np.repeat(filas_Q, k)
+                encontrados = indices.ravel() >= 0
+                todas_Q.append(filas_Q[encontrados])
+                todas_R.append(filas[indices.ravel()[encontrados]])
+                todas_distancias.append(distancias.ravel()[encontrados])
+        contar("consultas", fin - inicio)
+        contar("comparaciones", filas_comparadas)
+        if len(todas_Q) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(todas_Q), np.concatenate(todas_R), np.concatenate(todas_distancias)
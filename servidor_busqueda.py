@@ -0,0 +1,325 @@
+# servidor_busqueda.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Servicio de búsqueda que deja cargados los descriptores de R y su índice, para no
+# reconstruir el índice en cada consulta. Escucha HTTP en localhost y atiende varios
+# clientes a la vez (un thread por conexión). Rutas:
+#   GET  /estado     -> JSON con el catálogo cargado
+#   POST /vecinos    -> cuerpo .npy con descriptores de Q; retorna .npz con las ventanas similares
+#   POST /detectar   -> JSON {"carpeta_Q": ...} o cuerpo .npz con un lote de Q; retorna JSON con detecciones
+#   POST /recargar   -> JSON opcional {"carpeta_R": ...}; vuelve a abrir R y construir el índice
+# La recarga construye el índice nuevo mientras se siguen atendiendo consultas con el
+# anterior, y luego los reemplaza.
+# Uso:
+#   python servidor_busqueda.py servir [carpeta_descriptores_R] [--puerto 8765] [--indice flann]
+#   python servidor_busqueda.py detectar [carpeta_descriptores_Q] [archivo_detecciones]
+#   python servidor_busqueda.py recargar [--carpeta-r carpeta_descriptores_R]
+#   python servidor_busqueda.py estado
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import util
+import pipeline
+from indices import NOMBRES_INDICES
+
+PUERTO_POR_OMISION = 8765
+
+
+class CatalogoR:
+    """
+    Descriptores de R con su índice ya construido. Las búsquedas en el índice se hacen de
+    a una (lock), porque no todas las librerías permiten consultas concurrentes sobre el
+    mismo índice; cada búsqueda ya usa todos los cores del índice. La lectura de
+    los pedidos y la votación de detecciones sí corren en paralelo.
+    Cada pedido toma el catálogo (tomar) y lo suelta al responder (soltar); un catálogo
+    reemplazado por una recarga (retirar) se cierra cuando lo suelta su último pedido.
+    """
+
+    def __init__(self, carpeta_R, nombre_indice="flann", cores=None, version=1, fragmentos=1):
+        t0 = time.time()
+        self.carpeta_R = carpeta_R
+        self.nombre_indice = nombre_indice
+        self.version = version
+        self.descriptores_R = util.Descriptores(carpeta_R)
+        self.fragmentos = fragmentos
+        self.indice = pipeline.construir_indice_R(self.descriptores_R, cores, nombre_indice, fragmentos)
+        self.lock = threading.Lock()
+        self.lock_usuarios = threading.Lock()
+        self.usuarios = 0
+        self.retirado = False
+        self.segundos_carga = time.time() - t0
+
+    def cerrar(self):
+        # espera a que termine la búsqueda en curso antes de terminar los fragmentos
+        with self.lock:
+            pipeline.cerrar_indice(self.indice)
+
+    def tomar(self):
+        with self.lock_usuarios:
+            self.usuarios += 1
+
+    def soltar(self):
+        with self.lock_usuarios:
+            self.usuarios -= 1
+            cerrar = self.retirado and self.usuarios == 0
+        if cerrar:
+            self.cerrar()
+
+    def retirar(self):
+        # ya no lo toman pedidos nuevos; se cierra ahora o al soltarlo el último pedido
+        with self.lock_usuarios:
+            self.retirado = True
+            cerrar = self.usuarios == 0
+        if cerrar:
+            self.cerrar()
+
+    def buscar_filas(self, matriz_Q, k, vivas_Q=None):
+        with self.lock:
+            return pipeline.buscar_filas(self.indice, matriz_Q, k, vivas_Q=vivas_Q)
+
+    def buscar(self, descriptores_Q, k):
+        with self.lock:
+            return pipeline.buscar(descriptores_Q, self.descriptores_R, k, indice=self.indice)
+
+    def estado(self):
+        return {'carpeta_R': self.carpeta_R, 'indice': self.nombre_indice, 'fragmentos': self.fragmentos,
+                'version': self.version,
+                'archivos': len(self.descriptores_R.archivos), 'total': len(self.descriptores_R),
+                'dim': self.descriptores_R.dim, 'parametros': self.descriptores_R.parametros,
+                'segundos_carga': round(self.segundos_carga, 3)}
+
+
+class ServidorBusqueda(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion, carpeta_R, nombre_indice="flann", cores=None, fragmentos=1):
+        self.nombre_indice = nombre_indice
+        self.cores = cores
+        self.fragmentos = fragmentos
+        self.catalogo = CatalogoR(carpeta_R, nombre_indice, cores, fragmentos=fragmentos)
+        self.lock_recarga = threading.Lock()
+        # protege el reemplazo del catálogo, para que un pedido no tome uno ya retirado
+        self.lock_catalogo = threading.Lock()
+        super().__init__(direccion, ManejadorBusqueda)
+
+    def tomar_catalogo(self):
+        # el catálogo actual, que el pedido debe soltar al terminar
+        with self.lock_catalogo:
+            catalogo = self.catalogo
+            catalogo.tomar()
+        return catalogo
+
+    def recargar(self, carpeta_R=None):
+        # una recarga a la vez; las consultas siguen usando el catálogo anterior hasta el reemplazo,
+        # y los pedidos que ya lo tomaron lo siguen usando hasta responder
+        with self.lock_recarga:
+            anterior = self.catalogo
+            nuevo = CatalogoR(carpeta_R or anterior.carpeta_R, self.nombre_indice, self.cores, anterior.version + 1,
+                              self.fragmentos)
+            with self.lock_catalogo:
+                self.catalogo = nuevo
+        anterior.retirar()
+        return nuevo
+
+
+def descriptores_desde_npz(datos, parametros_R):
+    # lote de Q enviado por un cliente: matriz, inicios, offsets y nombres de archivos
+    matriz = datos['matriz']
+    inicios = datos['inicios']
+    offsets = datos['offsets']
+    matrices = [matriz[inicio:fin] for inicio, fin in zip(offsets[:-1], offsets[1:])]
+    lista_inicios = [inicios[inicio:fin] for inicio, fin in zip(offsets[:-1], offsets[1:])]
+    # se asume que el cliente extrajo Q con los mismos parámetros de R (se valida la dimensión)
+    return util.DescriptoresEnMemoria([str(a) for a in datos['archivos']], matrices, lista_inicios,
+                                      matriz.shape[1], parametros_R, matriz.dtype)
+
+
+def columna_a_json(valor):
+    # los números de numpy se entregan como int o float de python
+    return valor.item() if isinstance(valor, np.generic) else valor
+
+
+class ManejadorBusqueda(BaseHTTPRequestHandler):
+
+    def log_message(self, formato, *args):
+        print("[{}] {}".format(time.strftime("%d-%m-%Y %H:%M:%S"), formato % args))
+
+    def responder(self, codigo, cuerpo, tipo="application/json"):
+        if tipo == "application/json":
+            cuerpo = json.dumps(cuerpo).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def leer_cuerpo(self):
+        largo = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(largo) if largo > 0 else b""
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/estado":
+            self.responder(200, self.server.catalogo.estado())
+        else:
+            self.responder(404, {'error': 'ruta desconocida: {}'.format(self.path)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        consulta = parse_qs(url.query)
+        k = int(consulta.get('k', ['10'])[0])
+        try:
+            cuerpo = self.leer_cuerpo()
+            if url.path in ["/vecinos", "/detectar"]:
+                # se toma el catálogo una vez, así una recarga a mitad del pedido no lo afecta
+                # (no se cierra hasta que el pedido lo suelte)
+                catalogo = self.server.tomar_catalogo()
+                try:
+                    if url.path == "/vecinos":
+                        self.vecinos(catalogo, cuerpo, k)
+                    else:
+                        self.detectar(catalogo, cuerpo, k)
+                finally:
+                    catalogo.soltar()
+            elif url.path == "/recargar":
+                opciones = json.loads(cuerpo) if cuerpo else {}
+                self.responder(200, self.server.recargar(opciones.get('carpeta_R')).estado())
+            else:
+                self.responder(404, {'error': 'ruta desconocida: {}'.format(self.path)})
+        except Exception as e:
+            self.responder(400, {'error': str(e)})
+
+    def vecinos(self, catalogo, cuerpo, k):
+        matriz_Q = np.load(io.BytesIO(cuerpo), allow_pickle=False)
+        if matriz_Q.ndim != 2 or matriz_Q.shape[1] != catalogo.descriptores_R.dim:
+            raise Exception("se esperaba una matriz de (n, {})".format(catalogo.descriptores_R.dim))
+        filas_Q, filas_R, distancias = catalogo.buscar_filas(matriz_Q, k)
+        salida = io.BytesIO()
+        np.savez(salida, filas_Q=filas_Q, filas_R=filas_R, distancias=distancias,
+                 id_R=catalogo.descriptores_R.ids_archivo(filas_R),
+                 inicio_R=np.asarray(catalogo.descriptores_R.inicios[filas_R]))
+        self.responder(200, salida.getvalue(), "application/octet-stream")
+
+    def detectar(self, catalogo, cuerpo, k):
+        if self.headers.get("Content-Type") == "application/json":
+            descriptores_Q = util.Descriptores(json.loads(cuerpo)['carpeta_Q'])
+        else:
+            descriptores_Q = descriptores_desde_npz(np.load(io.BytesIO(cuerpo), allow_pickle=False),
+                                                    catalogo.descriptores_R.parametros)
+        ventanas = catalogo.buscar(descriptores_Q, k)
+        detecciones = pipeline.detectar(ventanas)
+        self.responder(200, {'version': catalogo.version,
+                             'detecciones': [[columna_a_json(c) for c in d] for d in detecciones]})
+
+
+class ClienteBusqueda:
+    """
+    Cliente del servicio de búsqueda. Las respuestas con error se entregan como Exception.
+    """
+
+    def __init__(self, url="http://127.0.0.1:{}".format(PUERTO_POR_OMISION)):
+        self.url = url.rstrip("/")
+
+    def pedir(self, ruta, cuerpo=None, tipo="application/json"):
+        if tipo == "application/json" and cuerpo is not None:
+            cuerpo = json.dumps(cuerpo).encode("utf-8")
+        pedido = urllib.request.Request(self.url + ruta, data=cuerpo, headers={"Content-Type": tipo},
+                                        method="GET" if cuerpo is None else "POST")
+        try:
+            with urllib.request.urlopen(pedido) as respuesta:
+                datos = respuesta.read()
+                if respuesta.headers.get("Content-Type") == "application/json":
+                    return json.loads(datos)
+                return datos
+        except urllib.error.HTTPError as e:
+            raise Exception(json.loads(e.read()).get('error', str(e)))
+
+    def estado(self):
+        return self.pedir("/estado")
+
+    def vecinos(self, matriz_Q, k=10):
+        # retorna un dict con filas_Q, filas_R, distancias, id_R e inicio_R
+        entrada = io.BytesIO()
+        np.save(entrada, np.ascontiguousarray(matriz_Q))
+        datos = np.load(io.BytesIO(self.pedir("/vecinos?k={}".format(k), entrada.getvalue(),
+                                              "application/octet-stream")), allow_pickle=False)
+        return {nombre: datos[nombre] for nombre in datos.files}
+
+    def detectar_carpeta(self, carpeta_Q, k=10):
+        return self.pedir("/detectar?k={}".format(k), {'carpeta_Q': carpeta_Q})['detecciones']
+
+    def detectar(self, descriptores_Q, k=10):
+        # descriptores_Q es un util.Descriptores (por ejemplo de pipeline.extraer)
+        entrada = io.BytesIO()
+        np.savez(entrada, matriz=np.asarray(descriptores_Q.matriz), inicios=np.asarray(descriptores_Q.inicios),
+                 offsets=descriptores_Q.offsets, archivos=np.array(descriptores_Q.archivos))
+        return self.pedir("/detectar?k={}".format(k), entrada.getvalue(), "application/octet-stream")['detecciones']
+
+    def recargar(self, carpeta_R=None):
+        return self.pedir("/recargar", {'carpeta_R': carpeta_R})
+
+
+def servir(carpeta_R, puerto=PUERTO_POR_OMISION, nombre_indice="flann", cores=None, fragmentos=1):
+    servidor = ServidorBusqueda(("127.0.0.1", puerto), carpeta_R, nombre_indice, cores, fragmentos)
+    estado = servidor.catalogo.estado()
+    print("Sirviendo {} ({} descriptores, índice {}) en http://127.0.0.1:{}".format(
+        carpeta_R, estado['total'], nombre_indice, puerto))
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    servidor.server_close()
+    servidor.catalogo.retirar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python servidor_busqueda.py [servir|detectar|recargar|estado] ...")
+    parser.add_argument("--url", default="http://127.0.0.1:{}".format(PUERTO_POR_OMISION),
+                        help="dirección del servicio (para los comandos de cliente)")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    parser_servir = comandos.add_parser("servir")
+    parser_servir.add_argument("carpeta_descriptores_R")
+    parser_servir.add_argument("--puerto", type=int, default=PUERTO_POR_OMISION)
+    parser_servir.add_argument("--indice", default="flann", choices=NOMBRES_INDICES,
+                               help="índice de vecinos más cercanos a usar sobre R")
+    parser_servir.add_argument("--cores", type=int, default=None,
+                               help="cores que usa el índice en cada consulta (por omisión todos)")
+    parser_servir.add_argument("--fragmentos", type=int, default=1,
+                               help="reparte el índice de R por canción en N procesos y junta sus vecinos (solo MFCC)")
+    parser_servir.add_argument("--metricas", default=None,
+                               help="al detener el servicio escribe tiempos, contadores y memoria máxima en este JSON")
+    parser_detectar = comandos.add_parser("detectar")
+    parser_detectar.add_argument("carpeta_descriptores_Q")
+    parser_detectar.add_argument("archivo_detecciones")
+    parser_detectar.add_argument("--k", type=int, default=10)
+    parser_recargar = comandos.add_parser("recargar")
+    parser_recargar.add_argument("--carpeta-r", default=None,
+                                 help="otra carpeta de descriptores de R (por omisión vuelve a abrir la misma)")
+    comandos.add_parser("estado")
+    args = parser.parse_args()
+
+    if args.comando == "servir":
+        util.iniciar_metricas("servidor_busqueda", args.metricas)
+        servir(args.carpeta_descriptores_R, args.puerto, args.indice, args.cores, args.fragmentos)
+        sys.exit(0)
+    cliente = ClienteBusqueda(args.url)
+    if args.comando == "detectar":
+        # la carpeta se abre en el servidor, que corre en la misma máquina
+        detecciones = cliente.detectar_carpeta(os.path.abspath(args.carpeta_descriptores_Q), args.k)
+        util.escribir_lista_de_columnas_en_archivo(detecciones, args.archivo_detecciones)
+        print("{} detecciones en {}".format(len(detecciones), args.archivo_detecciones))
+    elif args.comando == "recargar":
+        print(json.dumps(cliente.recargar(args.carpeta_r and os.path.abspath(args.carpeta_r)), indent=2))
+    else:
+        print(json.dumps(cliente.estado(), indent=2))
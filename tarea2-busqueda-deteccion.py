@@ -0,0 +1,124 @@
+# tarea2-busqueda-deteccion.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Búsqueda y detección en un solo proceso: los vecinos de cada bloque de Q pasan
+# directo a la votación por desfase, sin escribir el archivo de ventanas similares.
+# Las detecciones de cada archivo de Q se escriben apenas termina ese archivo.
+# El resultado es el mismo que tarea2-busqueda.py seguido de tarea2-deteccion.py,
+# también con descriptores de huellas (tarea2-extractor.py --huellas).
+
+import sys
+import argparse
+import numpy as np
+from tqdm import tqdm
+import util
+import pipeline
+from util import Descriptores, escribir_lista_de_columnas_en_handle
+from indices import buscar_vecinos_por_bloques, NOMBRES_INDICES
+from votacion import VotadorEnLinea
+from preseleccion import IndiceDosEtapas
+from huellas import IndiceInvertido, buscar_coincidencias_por_bloques
+
+
+def buscar_pares(indice, descriptores_Q, k, tamano_bloque, inicio, fin):
+    # entrega (filas_Q, filas_R) de cada bloque, en el orden de Q
+    if isinstance(indice, IndiceInvertido):
+        yield from buscar_coincidencias_por_bloques(indice, descriptores_Q.matriz, tamano_bloque, inicio, fin)
+        return
+    if isinstance(indice, IndiceDosEtapas):
+        # necesita los tiempos de Q para dividir el archivo en segmentos
+        filas_Q, filas_R, _ = indice.buscar_filas(descriptores_Q, k, inicio, fin)
+        yield filas_Q, filas_R
+        return
+    for inicio_bloque, indices, _ in buscar_vecinos_por_bloques(indice, descriptores_Q.matriz, k, tamano_bloque,
+                                                                inicio, fin):
+        filas_Q = np.repeat(np.arange(inicio_bloque, inicio_bloque + len(indices)), k)
+        filas_R = indices.ravel()
+        encontrados = filas_R >= 0
+        yield filas_Q[encontrados], filas_R[encontrados]
+
+
+def tarea2_busqueda_deteccion(carpeta_descriptores_Q, carpeta_descriptores_R, archivo_detecciones, k,
+                              cores=None, tamano_bloque=65536, nombre_indice="flann",
+                              ventana_duracion=5.0, k_min=2, margen_desfase=1.0, umbral_confianza=1,
+                              fragmentos=1, candidatos=0):
+    """
+    Busca las ventanas más similares de R para cada ventana de Q y vota por desfase
+    en línea, escribiendo las detecciones de cada archivo de Q al terminarlo. Con
+    candidatos > 0 cada archivo se busca en dos etapas (ver preseleccion.py).
+    """
+    print("Cargando descriptores de Q...")
+    with util.medir("cargar_descriptores"):
+        descriptores_Q = Descriptores(carpeta_descriptores_Q)
+    print(f"Total de descriptores en Q: {len(descriptores_Q)}")
+
+    print("Cargando descriptores de R...")
+    with util.medir("cargar_descriptores"):
+        descriptores_R = Descriptores(carpeta_descriptores_R)
+    print(f"Total de descriptores en R: {len(descriptores_R)}")
+
+    # las mismas validaciones e índice que tarea2-busqueda.py (índice invertido con huellas)
+    try:
+        pipeline.validar_Q_R(descriptores_Q, descriptores_R, candidatos)
+    except Exception as e:
+        print("ERROR: {}".format(e))
+        sys.exit(1)
+    indice = pipeline.construir_indice_R(descriptores_R, cores, nombre_indice, fragmentos, candidatos)
+
+    votador = VotadorEnLinea(ventana_duracion=ventana_duracion, k_min=k_min, margen_desfase=margen_desfase,
+                             umbral_confianza=umbral_confianza)
+    total_detecciones = 0
+    print("Usando k =" + str(k))
+    try:
+        with open(archivo_detecciones, 'w') as handle:
+            for id_Q in tqdm(range(len(descriptores_Q.archivos)), desc="Archivos Q"):
+                if not descriptores_Q.activos[id_Q]:
+                    continue
+                inicio, fin = descriptores_Q.filas_de_archivo(id_Q)
+                for filas_Q, filas_R in buscar_pares(indice, descriptores_Q, k, tamano_bloque, inicio, fin):
+                    util.contar("vecinos_emitidos", len(filas_Q))
+                    with util.medir("votacion"):
+                        votador.agregar(np.full(len(filas_Q), id_Q), descriptores_Q.inicios[filas_Q],
+                                        descriptores_R.ids_archivo(filas_R), descriptores_R.inicios[filas_R])
+                with util.medir("deteccion"):
+                    detecciones = votador.terminar(descriptores_Q.archivos, descriptores_R.archivos)
+                util.contar("detecciones", len(detecciones))
+                escribir_lista_de_columnas_en_handle(detecciones, handle)
+                handle.flush()
+                total_detecciones += len(detecciones)
+    finally:
+        # termina los procesos de un índice fragmentado aunque la búsqueda falle o se interrumpa
+        pipeline.cerrar_indice(indice)
+    print(f"{total_detecciones} detecciones escritas en {archivo_detecciones}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python tarea2-busqueda-deteccion.py [carpeta_descriptores_radio_Q] [carpeta_descritores_canciones_R] [archivo_detecciones]")
+    parser.add_argument("carpeta_descriptores_Q")
+    parser.add_argument("carpeta_descriptores_R")
+    parser.add_argument("archivo_detecciones")
+    parser.add_argument("--cores", type=int, default=None,
+                        help="cores que usa el índice en cada consulta (por omisión todos)")
+    parser.add_argument("--bloque", type=int, default=65536,
+                        help="cantidad de descriptores de Q consultados en cada llamada al índice")
+    parser.add_argument("--indice", default="flann", choices=NOMBRES_INDICES,
+                        help="índice de vecinos más cercanos a usar sobre R")
+    parser.add_argument("--fragmentos", type=int, default=1,
+                        help="reparte el índice de R por canción en N procesos y junta sus vecinos (solo MFCC)")
+    parser.add_argument("--candidatos", type=int, default=0,
+                        help="búsqueda en dos etapas: cada segmento de Q se busca solo en sus N canciones "
+                             "candidatas según resúmenes por segundo (solo MFCC, 0 = buscar en todo R; "
+                             "no se combina con --fragmentos)")
+    parser.add_argument("--metricas", default=None,
+                        help="escribe tiempos por etapa, contadores y memoria máxima en este archivo JSON")
+    args = parser.parse_args()
+    if args.candidatos > 0 and args.fragmentos > 1:
+        parser.error("--candidatos no se puede combinar con --fragmentos")
+    util.iniciar_metricas("tarea2-busqueda-deteccion", args.metricas)
+
+    tarea2_busqueda_deteccion(args.carpeta_descriptores_Q, args.carpeta_descriptores_R, args.archivo_detecciones,
+                              k=10, cores=args.cores, tamano_bloque=args.bloque, nombre_indice=args.indice,
+                              ventana_duracion=5.0, k_min=2, margen_desfase=1.0, umbral_confianza=1,
+                              fragmentos=args.fragmentos, candidatos=args.candidatos)
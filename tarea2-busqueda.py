@@ -6,23 +6,29 @@
 
 import sys
 import os
+import argparse
+import pipeline
+import util
 import numpy as np
-from util import listar_archivos_con_extension, leer_objeto, escribir_lista_de_columnas_en_archivo
-from pyflann import FLANN
-from tqdm import tqdm
+from util import Descriptores, EscritorVentanasSimilares, escribir_ventanas_similares_texto, \
+    escribir_lista_de_columnas_en_handle
+from indices import NOMBRES_INDICES
 
 def cargar_descriptores(carpeta_descriptores):
-    descriptores = []
-    archivos = listar_archivos_con_extension(carpeta_descriptores, ".pkl")
-    for archivo in archivos:
-        ruta_archivo = os.path.join(carpeta_descriptores, archivo)
-        lista_descriptores = leer_objeto(carpeta_descriptores, archivo)
-        descriptores.extend(lista_descriptores)
-    return descriptores
+    # abre el almacén columnar con memmap, sin copiar la matriz
+    with util.medir("cargar_descriptores"):
+        return Descriptores(carpeta_descriptores)
 
-def tarea2_busqueda(carpeta_descriptores_Q, carpeta_descriptores_R, archivo_ventanas_similares, k):
+
+def tarea2_busqueda(carpeta_descriptores_Q, carpeta_descriptores_R, archivo_ventanas_similares, k,
+                    cores=None, tamano_bloque=65536, nombre_indice="flann", archivo_texto=None,
+                    memoria_mb=None, por_archivo=False, fragmentos=1, candidatos=0):
     """
     Realiza la búsqueda de las ventanas más similares de R para cada ventana en Q.
+    La búsqueda es pipeline.buscar, que con descriptores de huellas usa un índice invertido
+    (distancia 0) y con MFCC el índice de vecinos elegido, repartido en varios procesos si
+    fragmentos > 1, o en dos etapas si candidatos > 0 (ver preseleccion.py). Con memoria_mb
+    (o por_archivo) se busca por bloques de Q y cada bloque se escribe antes de buscar el siguiente.
     """
     # Cargar descriptores
     print("Cargando descriptores de Q...")
@@ -33,56 +39,96 @@ def tarea2_busqueda(carpeta_descriptores_Q, carpeta_descriptores_R, archivo_vent
     descriptores_R = cargar_descriptores(carpeta_descriptores_R)
     print(f"Total de descriptores en R: {len(descriptores_R)}")
 
-    if len(descriptores_R) == 0:
-        print("No se encontraron descriptores en R.")
+    try:
+        pipeline.validar_Q_R(descriptores_Q, descriptores_R, candidatos)
+    except Exception as e:
+        print("ERROR: {}".format(e))
         sys.exit(1)
 
-    # Preparar datos para FLANN
-    print("Preparando datos para FLANN...")
-    # Extraer los vectores de características de R
-    data_R = np.array([d['descriptor'] for d in descriptores_R], dtype=np.float32)
-
-    print("Creando índice FLANN...")
-    flann = FLANN()
-    flann_params = flann.build_index(data_R, algorithm='kdtree', trees=5)
+    if memoria_mb is not None or por_archivo:
+        buscar_y_escribir_por_bloques(descriptores_Q, descriptores_R, archivo_ventanas_similares, k, cores,
+                                      tamano_bloque, nombre_indice, archivo_texto,
+                                      256 if memoria_mb is None else memoria_mb, por_archivo, fragmentos, candidatos)
+        print("Búsqueda completada.")
+        return
 
     # Realizar la búsqueda
     print("Realizando búsqueda de vecinos más cercanos...")
-    print("Usando k =" + str(k))
-    resultados = []
-    for q in tqdm(descriptores_Q, desc="Procesando Q"):
-        descriptor_q = np.array(q['descriptor'], dtype=np.float32).reshape(1, -1)
-        indices, _ = flann.nn_index(descriptor_q, num_neighbors=k, checks=64)
-        
-        if k == 1:
-            if isinstance(indices, (int, np.integer)):
-                indices = [indices]
-            else:
-                indices = indices.flatten().tolist()
-        else:
-            # Para k > 1, 'indices' debería ser una lista de listas
-            indices = indices.flatten().tolist()
-        
-        for idx in indices:
-            r_meta = descriptores_R[idx]
-            resultados.append([
-                q['archivo'],
-                q['inicio'],
-                r_meta['archivo'],
-                r_meta['inicio']
-            ])
+    ventanas = pipeline.buscar(descriptores_Q, descriptores_R, k, cores, tamano_bloque, nombre_indice,
+                               fragmentos=fragmentos, candidatos=candidatos)
 
     print(f"Escribiendo resultados en {archivo_ventanas_similares}...")
-    escribir_lista_de_columnas_en_archivo(resultados, archivo_ventanas_similares)
+    with util.medir("escribir_ventanas"):
+        escritor = EscritorVentanasSimilares(archivo_ventanas_similares, descriptores_Q.archivos,
+                                             descriptores_R.archivos)
+        escritor.agregar(ventanas.id_Q, ventanas.inicio_Q, ventanas.id_R, ventanas.inicio_R, ventanas.distancia)
+        escritor.cerrar()
+    if archivo_texto is not None:
+        print(f"Exportando resultados en texto a {archivo_texto}...")
+        escribir_ventanas_similares_texto(ventanas, archivo_texto)
     print("Búsqueda completada.")
 
+
+def buscar_y_escribir_por_bloques(descriptores_Q, descriptores_R, archivo_ventanas_similares, k, cores,
+                                  tamano_bloque, nombre_indice, archivo_texto, memoria_mb, por_archivo, fragmentos,
+                                  candidatos):
+    # las ventanas de cada bloque de Q se agregan a los archivos de salida y se descartan
+    print("Realizando búsqueda por bloques de Q con {} MB de memoria de trabajo...".format(memoria_mb))
+    escritor = EscritorVentanasSimilares(archivo_ventanas_similares, descriptores_Q.archivos,
+                                         descriptores_R.archivos)
+    handle_texto = None if archivo_texto is None else open(archivo_texto, 'w')
+    try:
+        for ventanas in pipeline.buscar_por_bloques(descriptores_Q, descriptores_R, k, cores, tamano_bloque,
+                                                    nombre_indice, memoria_mb=memoria_mb,
+                                                    por_archivo=por_archivo, fragmentos=fragmentos,
+                                                    candidatos=candidatos):
+            with util.medir("escribir_ventanas"):
+                escritor.agregar(ventanas.id_Q, ventanas.inicio_Q, ventanas.id_R, ventanas.inicio_R,
+                                 ventanas.distancia)
+                if handle_texto is not None:
+                    archivos_Q = np.array(ventanas.archivos_Q, dtype=object)[ventanas.id_Q]
+                    archivos_R = np.array(ventanas.archivos_R, dtype=object)[ventanas.id_R]
+                    escribir_lista_de_columnas_en_handle(zip(archivos_Q, ventanas.inicio_Q, archivos_R,
+                                                             ventanas.inicio_R), handle_texto)
+    finally:
+        escritor.cerrar()
+        if handle_texto is not None:
+            handle_texto.close()
+    print(f"Resultados escritos en {archivo_ventanas_similares} ({escritor.num_filas} ventanas similares)")
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Uso: python tarea2-busqueda.py [carpeta_descriptores_radio_Q] [carpeta_descritores_canciones_R] [archivo_ventanas_similares]")
-        sys.exit(1)
-    
-    carpeta_descriptores_Q = sys.argv[1]
-    carpeta_descriptores_R = sys.argv[2]
-    archivo_ventanas_similares = sys.argv[3]
+    parser = argparse.ArgumentParser(usage="python tarea2-busqueda.py [carpeta_descriptores_radio_Q] [carpeta_descritores_canciones_R] [archivo_ventanas_similares]")
+    parser.add_argument("carpeta_descriptores_Q")
+    parser.add_argument("carpeta_descriptores_R")
+    parser.add_argument("archivo_ventanas_similares")
+    parser.add_argument("--cores", type=int, default=None,
+                        help="cores que usa el índice en cada consulta (por omisión todos)")
+    parser.add_argument("--bloque", type=int, default=65536,
+                        help="cantidad de descriptores de Q consultados en cada llamada al índice")
+    parser.add_argument("--indice", default="flann", choices=NOMBRES_INDICES,
+                        help="índice de vecinos más cercanos a usar sobre R")
+    parser.add_argument("--fragmentos", type=int, default=1,
+                        help="reparte el índice de R por canción en N procesos y junta sus vecinos (solo MFCC)")
+    parser.add_argument("--candidatos", type=int, default=0,
+                        help="búsqueda en dos etapas: cada segmento de Q se busca solo en sus N canciones "
+                             "candidatas según resúmenes por segundo (solo MFCC, 0 = buscar en todo R; "
+                             "no se combina con --fragmentos)")
+    parser.add_argument("--texto", default=None,
+                        help="exporta además las ventanas similares en el formato de texto de 4 columnas")
+    parser.add_argument("--memoria", type=float, default=None,
+                        help="busca por bloques de Q y escribe cada uno al terminarlo, usando a lo más "
+                             "estos MB de memoria de trabajo (sin contar el índice de R)")
+    parser.add_argument("--por-archivo", action="store_true",
+                        help="busca por bloques que no mezclan archivos de Q (con --memoria, o 256 MB)")
+    parser.add_argument("--metricas", default=None,
+                        help="escribe tiempos por etapa, contadores y memoria máxima en este archivo JSON")
+    args = parser.parse_args()
+    if args.candidatos > 0 and args.fragmentos > 1:
+        parser.error("--candidatos no se puede combinar con --fragmentos")
+    util.iniciar_metricas("tarea2-busqueda", args.metricas)
     
-    tarea2_busqueda(carpeta_descriptores_Q, carpeta_descriptores_R, archivo_ventanas_similares, k=10)
+    tarea2_busqueda(args.carpeta_descriptores_Q, args.carpeta_descriptores_R, args.archivo_ventanas_similares, k=10,
+                    cores=args.cores, tamano_bloque=args.bloque, nombre_indice=args.indice,
+                    archivo_texto=args.texto, memoria_mb=args.memoria, por_archivo=args.por_archivo,
+                    fragmentos=args.fragmentos, candidatos=args.candidatos)
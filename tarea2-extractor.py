@@ -5,83 +5,153 @@
 
 import sys
 import os
+import time
+import argparse
+import subprocess
 import util as util
-import librosa
-import numpy as np
+import pipeline
+import cache_extraccion
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def calcular_mfcc(archivo_wav, sample_rate, n_fft, hop_length, n_mfcc, nombre_archivo):
+# en modo incremental, sobre estos límites se compacta el almacén en segundo plano
+MAX_SEGMENTOS = 8
+MAX_FRACCION_INACTIVA = 0.25
+
+def planificar_incremental(descriptores, archivos_m4a, firmas):
     """
-    Calcula los MFCC para un archivo WAV y retorna una lista de descriptores con metadata.
+    Compara los archivos de audio con los que ya están en el almacén. Retorna los
+    archivos que hay que extraer (nuevos o modificados) y los ids del almacén que hay
+    que desactivar (eliminados o modificados).
     """
-    samples, sr = librosa.load(archivo_wav, sr=sample_rate, mono=True)
-    logging.info(f'Audio cargado: {archivo_wav}, muestras: {len(samples)}, sample_rate: {sr}')
-
-    samples = librosa.util.normalize(samples)
-
-    # Calcular los MFCC
-    mfcc = librosa.feature.mfcc(
-        y=samples,
-        sr=sr,
-        n_mfcc=n_mfcc,
-        n_fft=n_fft,
-        hop_length=hop_length
-    )
-
-    mfcc = mfcc.T  # Forma: (num_frames, n_mfcc)
-
-    tiempos_inicio = librosa.frames_to_time(np.arange(len(mfcc)), sr=sr, hop_length=hop_length, n_fft=n_fft)
-
-    descriptores = []
-    for idx, frame in enumerate(mfcc):
-        frame_normalizado = (frame - np.mean(frame)) / (np.std(frame) + 1e-8)
-        descriptor = {
-            'descriptor': frame_normalizado.astype(np.float32),  
-            'archivo': nombre_archivo,
-            'inicio': tiempos_inicio[idx]
-        }
-        descriptores.append(descriptor)
-
-    return descriptores
-
-
-def tarea2_extractor(carpeta_audios_entrada, carpeta_descriptores_salida):
+    activos = {}
+    for id_archivo, nombre in enumerate(descriptores.archivos):
+        if descriptores.activos[id_archivo]:
+            activos[nombre] = id_archivo
+    por_extraer = []
+    por_desactivar = []
+    for archivo_m4a in archivos_m4a:
+        id_archivo = activos.pop(archivo_m4a, None)
+        if id_archivo is None:
+            por_extraer.append(archivo_m4a)
+        elif descriptores.firmas[id_archivo] != firmas[archivo_m4a]:
+            por_extraer.append(archivo_m4a)
+            por_desactivar.append(id_archivo)
+    # los que quedan ya no están en la carpeta de audios
+    por_desactivar.extend(activos.values())
+    return por_extraer, sorted(por_desactivar)
+
+
+def compactar_en_segundo_plano(carpeta_descriptores):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "compactar_descriptores.py")
+    logging.info(f'Compactando {carpeta_descriptores} en segundo plano')
+    subprocess.Popen([sys.executable, script, carpeta_descriptores])
+
+
+def tarea2_extractor(carpeta_audios_entrada, carpeta_descriptores_salida, workers=1, usar_wav=False,
+                     incremental=False, usar_huellas=False, apilar=1, paso=1, contexto="concatenar", cache=None):
+    existe_almacen = os.path.isfile(os.path.join(carpeta_descriptores_salida, util.ARCHIVO_TABLA))
     if not os.path.isdir(carpeta_audios_entrada):
         print("ERROR: no existe {}".format(carpeta_audios_entrada))
         sys.exit(1)
-    elif os.path.exists(carpeta_descriptores_salida):
+    elif os.path.exists(carpeta_descriptores_salida) and not (incremental and existe_almacen):
         print("ERROR: ya existe {}".format(carpeta_descriptores_salida))
         sys.exit(1)
+    # al agregar a un almacén existente se toma su bloqueo hasta cerrar el escritor, para que
+    # compactar_descriptores.py no lo reescriba (ni borre sus archivos) mientras se agrega
+    elif existe_almacen and not util.tomar_bloqueo(carpeta_descriptores_salida):
+        print("ERROR: se está compactando o actualizando {}, intente más tarde".format(carpeta_descriptores_salida))
+        sys.exit(1)
 
-    # Parámetros para el cálculo de MFCC
-    sample_rate = 7000
-    n_fft = 2048
-    hop_length = 256
-    n_mfcc = 20  # Dimensión de los MFCC
-
-    os.makedirs(carpeta_descriptores_salida, exist_ok=True)
+    # Parámetros de los descriptores (MFCC, apilados o huellas), los mismos de pipeline.py
+    parametros, dim, tipo = pipeline.parametros_extraccion(usar_huellas, apilar, paso, contexto)
 
     # 1. Leer los archivos con extensión .m4a en carpeta_audios_entrada
     archivos_m4a = util.listar_archivos_con_extension(carpeta_audios_entrada, ".m4a")
-    logging.info(f'Archivos a procesar: {len(archivos_m4a)}')
-
-    # 2. Convertir cada archivo de audio a WAV y calcular descriptores
+    firmas = {}
     for archivo_m4a in archivos_m4a:
-        ruta_entrada = os.path.join(carpeta_audios_entrada, archivo_m4a)
-        archivo_wav = util.convertir_a_wav(ruta_entrada, sample_rate, carpeta_descriptores_salida)
-        descriptores = calcular_mfcc(archivo_wav, sample_rate, n_fft, hop_length, n_mfcc, archivo_m4a)
-        nombre_descriptor = os.path.splitext(os.path.basename(archivo_m4a))[0] + ".pkl"
-        util.guardar_objeto(descriptores, carpeta_descriptores_salida, nombre_descriptor)
-        logging.info(f'Descriptores guardados para: {archivo_wav}')
+        firmas[archivo_m4a] = util.firma_archivo(os.path.join(carpeta_audios_entrada, archivo_m4a))
+    escritor = None
+    try:
+        escritor = util.EscritorDescriptores(carpeta_descriptores_salida, dim, parametros, anexar=existe_almacen,
+                                             tipo=tipo)
+        if existe_almacen:
+            archivos_m4a, por_desactivar = planificar_incremental(util.Descriptores(carpeta_descriptores_salida),
+                                                                  archivos_m4a, firmas)
+            for id_archivo in por_desactivar:
+                escritor.desactivar(id_archivo)
+            logging.info(f'Actualización incremental: {len(archivos_m4a)} archivos por extraer, '
+                         f'{len(por_desactivar)} desactivados')
+        logging.info(f'Archivos a procesar: {len(archivos_m4a)}')
+
+        # 2. Decodificar cada archivo de audio y calcular descriptores
+        t0 = time.time()
+        segundos_por_archivo = 0
+        filas_previas = escritor.offsets[-1]
+        for archivo_m4a, descriptores, inicios, segundos in pipeline.extraer_archivos(
+                carpeta_audios_entrada, archivos_m4a, parametros, workers, usar_wav, carpeta_descriptores_salida, cache):
+            escritor.agregar(archivo_m4a, descriptores, inicios, firmas[archivo_m4a])
+            segundos_por_archivo += segundos
+            logging.info(f'Descriptores guardados para: {archivo_m4a} ({segundos:.1f} s)')
+        with util.medir("escribir_almacen"):
+            escritor.cerrar()
+    except BaseException:
+        # incluye Ctrl+C: un almacén nuevo a medio escribir se borra
+        if escritor is not None:
+            escritor.descartar()
+        raise
+    finally:
+        if existe_almacen:
+            util.soltar_bloqueo(carpeta_descriptores_salida)
+
+    segundos_total = time.time() - t0
+    filas_nuevas = escritor.offsets[-1] - filas_previas
+    if usar_huellas:
+        detalle = f'{filas_nuevas} huellas'
+    else:
+        duracion_audio = filas_nuevas * paso * parametros['hop_length'] / parametros['sample_rate']
+        detalle = f'{filas_nuevas} descriptores, {duracion_audio:.0f} s de audio'
+    logging.info(f'Resumen: {len(archivos_m4a)} archivos, {detalle}, workers={workers}, '
+                 f'tiempo={segundos_total:.1f} s (suma por archivo={segundos_por_archivo:.1f} s)')
+
+    if existe_almacen:
+        almacen = util.Descriptores(carpeta_descriptores_salida)
+        vivas = almacen.filas_vivas()
+        fraccion_inactiva = 0 if vivas is None else 1 - vivas.mean()
+        if len(almacen.segmentos) - 1 > MAX_SEGMENTOS or fraccion_inactiva > MAX_FRACCION_INACTIVA:
+            compactar_en_segundo_plano(carpeta_descriptores_salida)
 
-if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("Uso: {} [carpeta_audios_entrada] [carpeta_descriptores_salida]".format(sys.argv[0]))
-        sys.exit(1)
 
-    carpeta_audios_entrada = sys.argv[1]
-    carpeta_descriptores_salida = sys.argv[2]
-
-    tarea2_extractor(carpeta_audios_entrada, carpeta_descriptores_salida)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="{} [carpeta_audios_entrada] [carpeta_descriptores_salida] [--workers N] [--wav] [--incremental] [--huellas] [--apilar N] [--paso P]".format(sys.argv[0]))
+    parser.add_argument("carpeta_audios_entrada")
+    parser.add_argument("carpeta_descriptores_salida")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="cantidad de procesos para decodificar y calcular MFCC en paralelo")
+    parser.add_argument("--wav", action="store_true",
+                        help="convertir a un archivo WAV temporal en vez de decodificar por pipe")
+    parser.add_argument("--incremental", action="store_true",
+                        help="si la carpeta de descriptores existe, extraer solo los audios nuevos o modificados "
+                             "y desactivar los eliminados")
+    parser.add_argument("--huellas", action="store_true",
+                        help="extraer huellas de pares de picos (huellas.py) en vez de MFCC")
+    parser.add_argument("--apilar", type=int, default=1,
+                        help="cantidad de frames MFCC consecutivos que forman cada descriptor")
+    parser.add_argument("--paso", type=int, default=1,
+                        help="frames que se avanza entre descriptores (R puede usar un paso mayor que Q)")
+    parser.add_argument("--contexto", default="concatenar", choices=["concatenar", "estadisticas"],
+                        help="cómo se combinan los frames apilados")
+    parser.add_argument("--cache", default=None,
+                        help="carpeta del cache de audio y descriptores entre ejecuciones (o variable TAREA2_CACHE)")
+    parser.add_argument("--cache-mb", type=float, default=None,
+                        help="tamaño máximo del cache en MB (por omisión TAREA2_CACHE_MB o 4096)")
+    parser.add_argument("--metricas", default=None,
+                        help="escribe tiempos por etapa, contadores y memoria máxima en este archivo JSON")
+    args = parser.parse_args()
+    util.iniciar_metricas("tarea2-extractor", args.metricas)
+
+    tarea2_extractor(args.carpeta_audios_entrada, args.carpeta_descriptores_salida, workers=args.workers,
+                     usar_wav=args.wav, incremental=args.incremental, usar_huellas=args.huellas,
+                     apilar=args.apilar, paso=args.paso, contexto=args.contexto,
+                     cache=cache_extraccion.abrir_cache(args.cache, args.cache_mb))
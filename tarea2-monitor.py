@@ -0,0 +1,293 @@
+# tarea2-monitor.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Monitoreo en vivo de una radio. FFmpeg decodifica la fuente (un pipe, una URL o un
+# archivo que sigue creciendo) y las muestras se leen en trozos de pocos segundos.
+# Los MFCC de cada trozo se calculan con los mismos parámetros con que se extrajo R,
+# se consultan en el índice de R cargado una sola vez, y se vota por desfase sobre
+# una ventana deslizante de los últimos segundos. Cada canción se informa apenas
+# junta suficientes votos, en el formato de 5 columnas de tarea2-deteccion.py.
+# Uso:
+#   python tarea2-monitor.py [fuente_audio] [carpeta_descritores_canciones_R] [archivo_detecciones]
+#   (fuente_audio puede ser - para leer la entrada estándar)
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+import multiprocessing
+import collections
+import numpy as np
+import util
+import mfcc as motor_mfcc
+from indices import IndiceSegmentado, NOMBRES_INDICES
+from votacion import TablaVotos, detectar_desde_votos
+
+# parámetros de tarea2-extractor.py, por si el almacén de R no los tiene guardados
+PARAMETROS_POR_OMISION = {'sample_rate': 7000, 'n_fft': 2048, 'hop_length': 256, 'n_mfcc': 20}
+
+
+class MfccEnLinea:
+    """
+    Calcula los mismos descriptores que mfcc.calcular_mfcc, pero sobre
+    un audio que llega por trozos. Se guardan las muestras que aún no completan un frame
+    y el número del siguiente frame, así los tiempos de inicio coinciden con los del
+    audio completo. Como no se conoce el audio entero, la normalización por el máximo
+    y el recorte de 80 dB usan el máximo visto hasta el momento.
+    """
+
+    def __init__(self, sample_rate, n_fft, hop_length, n_mfcc, top_db=80.0):
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.n_mfcc = n_mfcc
+        self.top_db = top_db
+        # calcular_mfcc usa center=True, que agrega n_fft // 2 ceros al inicio
+        self.pendientes = np.zeros(n_fft // 2, dtype=np.float32)
+        self.siguiente_frame = 0
+        self.pico = 0.0
+        self.max_db = -np.inf
+
+    def agregar(self, samples):
+        # retorna (descriptores, tiempos_inicio) de los frames completados con este trozo
+        if len(samples) > 0:
+            self.pico = max(self.pico, float(np.max(np.abs(samples))))
+        self.pendientes = np.concatenate([self.pendientes, samples])
+        return self.calcular_frames()
+
+    def terminar(self):
+        # al final del audio center=True también agrega n_fft // 2 ceros
+        self.pendientes = np.concatenate([self.pendientes, np.zeros(self.n_fft // 2, dtype=np.float32)])
+        return self.calcular_frames()
+
+    def calcular_frames(self):
+        if len(self.pendientes) < self.n_fft:
+            return np.zeros((0, self.n_mfcc), dtype=np.float32), np.zeros(0)
+        num_frames = 1 + (len(self.pendientes) - self.n_fft) // self.hop_length
+        usadas = (num_frames - 1) * self.hop_length + self.n_fft
+        y = self.pendientes[:usadas]
+        if self.pico > 0:
+            y = y / self.pico
+        potencia = motor_mfcc.espectrograma_potencia(y, self.n_fft, self.hop_length, centrar=False)
+        mel_db = motor_mfcc.potencia_a_db(potencia @ motor_mfcc.filtros_mel(self.sample_rate, self.n_fft).T,
+                                          top_db=np.inf)
+        self.max_db = max(self.max_db, float(mel_db.max()))
+        mel_db = np.maximum(mel_db, self.max_db - self.top_db)
+        descriptores = motor_mfcc.normalizar_frames(motor_mfcc.mfcc_desde_db(mel_db, self.n_mfcc))
+
+        frames = np.arange(self.siguiente_frame, self.siguiente_frame + num_frames)
+        tiempos_inicio = motor_mfcc.tiempos_de_frames(frames, self.sample_rate, self.hop_length, self.n_fft)
+        self.siguiente_frame += num_frames
+        self.pendientes = self.pendientes[num_frames * self.hop_length:]
+        return descriptores, tiempos_inicio
+
+
+def abrir_fuente(fuente, sample_rate, seguir):
+    # FFmpeg entrega la fuente como muestras float32 mono por su salida estándar
+    comando = [util.FFMPEG, "-hide_banner", "-loglevel", "error"]
+    if seguir:
+        # el protocolo file de FFmpeg sigue leyendo cuando el archivo crece
+        comando += ["-follow", "1"]
+    entrada = "pipe:0" if fuente == "-" else fuente
+    comando += ["-i", entrada, "-ac", "1", "-ar", str(sample_rate), "-f", "f32le", "-"]
+    print("  {}".format(" ".join(comando)), file=sys.stderr)
+    return subprocess.Popen(comando, stdout=subprocess.PIPE)
+
+
+class VotacionDeslizante:
+    """
+    Guarda los vecinos de los últimos ventana_votos segundos de la radio y en cada paso
+    vota por desfase sobre ellos. Una detección sigue abierta mientras la misma canción
+    siga ganando con un desfase parecido; se cierra cuando deja de tener votos durante
+    ventana_votos segundos.
+    """
+
+    def __init__(self, nombre_radio, archivos_R, ventana_votos=10.0, umbral_confianza=300, margen_desfase=1.0,
+                 ventana_duracion=5.0):
+        self.nombre_radio = nombre_radio
+        self.archivos_R = archivos_R
+        self.ventana_votos = ventana_votos
+        self.umbral_confianza = umbral_confianza
+        self.margen_desfase = margen_desfase
+        self.ventana_duracion = ventana_duracion
+        self.bloques = collections.deque()
+        self.abiertas = {}
+
+    def agregar(self, inicios_Q, ids_R, inicios_R):
+        if len(ids_R) > 0:
+            self.bloques.append((inicios_Q, ids_R, inicios_R))
+
+    def paso(self, ahora):
+        """
+        Vota con los vecinos de la ventana y retorna (nuevas, cerradas): las detecciones
+        que recién superan el umbral y las que terminaron, con su duración completa.
+        """
+        while self.bloques and self.bloques[0][0][-1] < ahora - self.ventana_votos:
+            self.bloques.popleft()
+        nuevas = []
+        cerradas = []
+        vigentes = set()
+        if self.bloques:
+            inicios_Q = np.concatenate([b[0] for b in self.bloques])
+            ids_R = np.concatenate([b[1] for b in self.bloques])
+            inicios_R = np.concatenate([b[2] for b in self.bloques])
+            dentro = inicios_Q >= ahora - self.ventana_votos
+            num_votos = np.count_nonzero(dentro)
+            votos = TablaVotos.desde_vecinos(np.zeros(num_votos), inicios_Q[dentro], ids_R[dentro],
+                                             inicios_R[dentro], np.arange(num_votos)).reducir()
+            detecciones = detectar_desde_votos(votos, [self.nombre_radio], self.archivos_R, self.ventana_duracion,
+                                               umbral_confianza=self.umbral_confianza,
+                                               margen_desfase=self.margen_desfase, con_desfase=True)
+            for _, inicio, largo, archivo_R, confianza, desfase in detecciones:
+                abierta = self.abiertas.get(archivo_R)
+                if abierta is not None and abs(abierta['desfase'] - desfase) <= self.margen_desfase:
+                    abierta['fin'] = max(abierta['fin'], inicio + largo)
+                    abierta['confianza'] = max(abierta['confianza'], confianza)
+                else:
+                    if abierta is not None:
+                        # la misma canción con otro desfase es una nueva emisión
+                        cerradas.append(self.cerrar(archivo_R))
+                    abierta = {'inicio': inicio, 'fin': inicio + largo, 'confianza': confianza, 'desfase': desfase}
+                    self.abiertas[archivo_R] = abierta
+                    nuevas.append([self.nombre_radio, inicio, largo, archivo_R, confianza])
+                vigentes.add(archivo_R)
+        for archivo_R in list(self.abiertas):
+            abierta = self.abiertas[archivo_R]
+            if archivo_R not in vigentes and abierta['fin'] < ahora - self.ventana_votos:
+                cerradas.append(self.cerrar(archivo_R))
+        return nuevas, cerradas
+
+    def cerrar(self, archivo_R):
+        abierta = self.abiertas.pop(archivo_R)
+        return [self.nombre_radio, abierta['inicio'], abierta['fin'] - abierta['inicio'], archivo_R,
+                abierta['confianza']]
+
+    def terminar(self):
+        return [self.cerrar(archivo_R) for archivo_R in list(self.abiertas)]
+
+
+def tarea2_monitor(fuente, carpeta_descriptores_R, archivo_detecciones, k=10, cores=None, nombre_indice="flann",
+                   segundos_por_trozo=1.0, ventana_votos=10.0, umbral_confianza=300, margen_desfase=1.0,
+                   seguir=False, nombre_radio=None, archivo_final=None):
+    """
+    Lee la fuente de audio hasta que termina (o hasta Ctrl+C) y escribe cada detección
+    en archivo_detecciones apenas supera el umbral. Si se indica archivo_final, ahí se
+    escribe cada detección al cerrarse, con su duración completa.
+    """
+    descriptores_R = util.Descriptores(carpeta_descriptores_R)
+    if len(descriptores_R) == 0:
+        print("No se encontraron descriptores en R.")
+        sys.exit(1)
+    parametros = descriptores_R.parametros or PARAMETROS_POR_OMISION
+    if 'descriptor' in parametros or parametros.get('apilar', 1) > 1 or parametros.get('paso', 1) > 1:
+        print("ERROR: el monitoreo solo funciona con descriptores MFCC de un frame (sin --huellas, --apilar ni --paso)")
+        sys.exit(1)
+    print("Parámetros MFCC de R: {}".format(parametros), file=sys.stderr)
+    if cores is None:
+        cores = multiprocessing.cpu_count()
+    indice = IndiceSegmentado(nombre_indice, cores, descriptores_R)
+
+    if nombre_radio is None:
+        nombre_radio = "stdin" if fuente == "-" else os.path.basename(fuente)
+    mfcc = MfccEnLinea(parametros['sample_rate'], parametros['n_fft'], parametros['hop_length'],
+                       parametros['n_mfcc'])
+    votacion = VotacionDeslizante(nombre_radio, descriptores_R.archivos, ventana_votos, umbral_confianza,
+                                  margen_desfase)
+    proceso = abrir_fuente(fuente, parametros['sample_rate'], seguir)
+    bytes_por_trozo = 4 * max(1, int(segundos_por_trozo * parametros['sample_rate']))
+
+    handle = open(archivo_detecciones, 'w')
+    handle_final = open(archivo_final, 'w') if archivo_final is not None else None
+
+    def procesar(descriptores, inicios):
+        if len(descriptores) > 0:
+            util.contar("frames_extraidos", len(descriptores))
+            with util.medir("consultar_indice"):
+                indices, _ = indice.buscar(np.ascontiguousarray(descriptores), k)
+            util.contar("consultas", len(descriptores))
+            filas_Q = np.repeat(np.arange(len(descriptores)), k)
+            filas_R = indices.ravel()
+            encontrados = filas_R >= 0
+            filas_Q = filas_Q[encontrados]
+            filas_R = filas_R[encontrados]
+            util.contar("vecinos_emitidos", len(filas_Q))
+            # tiempos en float32, igual que en la búsqueda por lotes
+            with util.medir("votacion"):
+                votacion.agregar(inicios[filas_Q].astype(np.float32), descriptores_R.ids_archivo(filas_R),
+                                 descriptores_R.inicios[filas_R].astype(np.float32))
+        ahora = mfcc.siguiente_frame * mfcc.hop_length / mfcc.sample_rate
+        with util.medir("votacion"):
+            nuevas, cerradas = votacion.paso(ahora)
+        util.contar("detecciones", len(nuevas))
+        escribir(nuevas, cerradas)
+
+    def escribir(nuevas, cerradas):
+        if nuevas:
+            util.escribir_lista_de_columnas_en_handle(nuevas, handle)
+            handle.flush()
+            for deteccion in nuevas:
+                print("{:.1f} s: {} en {} (confianza {})".format(deteccion[1], deteccion[3], deteccion[0],
+                                                                 deteccion[4]), file=sys.stderr)
+        if cerradas and handle_final is not None:
+            util.escribir_lista_de_columnas_en_handle(cerradas, handle_final)
+            handle_final.flush()
+
+    t0 = time.time()
+    try:
+        while True:
+            datos = proceso.stdout.read(bytes_por_trozo)
+            if not datos:
+                break
+            # un trozo puede terminar a mitad de una muestra si la fuente se cortó
+            datos = datos[:len(datos) - len(datos) % 4]
+            with util.medir("calcular_mfcc"):
+                descriptores, inicios = mfcc.agregar(np.frombuffer(datos, dtype=np.float32))
+            procesar(descriptores, inicios)
+        procesar(*mfcc.terminar())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proceso.kill()
+        proceso.wait()
+        escribir([], votacion.terminar())
+        handle.close()
+        if handle_final is not None:
+            handle_final.close()
+    segundos_audio = mfcc.siguiente_frame * mfcc.hop_length / mfcc.sample_rate
+    print("Monitoreo terminado: {:.0f} s de audio en {:.1f} s".format(segundos_audio, time.time() - t0),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python tarea2-monitor.py [fuente_audio] [carpeta_descritores_canciones_R] [archivo_detecciones]")
+    parser.add_argument("fuente_audio", help="archivo, URL o - para la entrada estándar")
+    parser.add_argument("carpeta_descriptores_R")
+    parser.add_argument("archivo_detecciones")
+    parser.add_argument("--cores", type=int, default=None,
+                        help="cores que usa el índice en cada consulta (por omisión todos)")
+    parser.add_argument("--indice", default="flann", choices=NOMBRES_INDICES,
+                        help="índice de vecinos más cercanos a usar sobre R")
+    parser.add_argument("--trozo", type=float, default=1.0,
+                        help="segundos de audio que se leen antes de cada consulta")
+    parser.add_argument("--ventana", type=float, default=10.0,
+                        help="segundos de la ventana deslizante sobre la que se vota")
+    parser.add_argument("--umbral", type=int, default=300,
+                        help="votos dentro de la ventana para informar una canción")
+    parser.add_argument("--seguir", action="store_true",
+                        help="seguir leyendo cuando el archivo de entrada crece")
+    parser.add_argument("--nombre", default=None,
+                        help="nombre de la radio en la primera columna (por omisión el nombre de la fuente)")
+    parser.add_argument("--final", default=None,
+                        help="archivo donde escribir cada detección al cerrarse, con su duración completa")
+    parser.add_argument("--metricas", default=None,
+                        help="escribe tiempos por etapa, contadores y memoria máxima en este archivo JSON")
+    args = parser.parse_args()
+    util.iniciar_metricas("tarea2-monitor", args.metricas)
+
+    tarea2_monitor(args.fuente_audio, args.carpeta_descriptores_R, args.archivo_detecciones, k=10,
+                   cores=args.cores, nombre_indice=args.indice, segundos_por_trozo=args.trozo,
+                   ventana_votos=args.ventana, umbral_confianza=args.umbral, seguir=args.seguir,
+                   nombre_radio=args.nombre, archivo_final=args.final)
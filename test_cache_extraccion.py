@@ -0,0 +1,61 @@
+# test_cache_extraccion.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Lectura, escritura y desalojo (LRU) del cache de extracción. Uso: python -m pytest -q test_cache_extraccion.py
+
+import os
+import numpy as np
+import cache_extraccion
+from cache_extraccion import CacheExtraccion
+
+PARAMETROS_AUDIO = {'sample_rate': 22050}
+KB = 1024
+
+
+def test_guardar_y_leer(tmp_path):
+    cache = CacheExtraccion(str(tmp_path))
+    samples = np.arange(100, dtype=np.float32)
+    cache.guardar_audio("a" * 40, PARAMETROS_AUDIO, samples)
+    np.testing.assert_array_equal(cache.leer_audio("a" * 40, PARAMETROS_AUDIO), samples)
+    assert cache.leer_audio("a" * 40, {'sample_rate': 16000}) is None
+
+    descriptores = np.ones((3, 4), dtype=np.float32)
+    inicios = np.array([0.0, 0.5, 1.0])
+    cache.guardar_descriptores("a" * 40, {'n_mfcc': 4}, descriptores, inicios)
+    leidos, leidos_inicios = cache.leer_descriptores("a" * 40, {'n_mfcc': 4})
+    np.testing.assert_array_equal(leidos, descriptores)
+    np.testing.assert_array_equal(leidos_inicios, inicios)
+
+
+def test_desalojo_lru_sin_tocar_otros_archivos(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_extraccion, "tamanos_estimados", {})
+    carpeta = str(tmp_path)
+    with open(os.path.join(carpeta, "notas.txt"), 'wb') as handle:
+        handle.write(b"x" * 64 * KB)
+    # 3 entradas de 16 KB caben en 60 KB; los otros archivos de la carpeta no cuentan
+    cache = CacheExtraccion(carpeta, max_mb=60 / 1024)
+    samples = np.zeros(4 * KB, dtype=np.float32)
+    for i, hash_audio in enumerate(["a" * 40, "b" * 40, "c" * 40]):
+        cache.guardar_audio(hash_audio, PARAMETROS_AUDIO, samples)
+        ruta = cache.ruta(cache.clave(hash_audio, PARAMETROS_AUDIO), ".audio.f32")
+        os.utime(ruta, ns=(i * 10 ** 9, i * 10 ** 9))
+    assert len(cache.entradas()) == 3
+
+    # leer "a" la marca como recién usada: al pasarse del máximo se desaloja "b", la usada hace más tiempo
+    assert cache.leer_audio("a" * 40, PARAMETROS_AUDIO) is not None
+    cache.guardar_audio("d" * 40, PARAMETROS_AUDIO, samples)
+    assert cache.leer_audio("b" * 40, PARAMETROS_AUDIO) is None
+    for hash_audio in ["a" * 40, "c" * 40, "d" * 40]:
+        assert cache.leer_audio(hash_audio, PARAMETROS_AUDIO) is not None
+    assert os.path.getsize(os.path.join(carpeta, "notas.txt")) == 64 * KB
+
+    # un máximo menor se aplica al abrir el cache, aunque no se escriba nada
+    for i, hash_audio in enumerate(["a" * 40, "c" * 40, "d" * 40]):
+        ruta = cache.ruta(cache.clave(hash_audio, PARAMETROS_AUDIO), ".audio.f32")
+        os.utime(ruta, ns=(i * 10 ** 9, i * 10 ** 9))
+    cache = cache_extraccion.abrir_cache(carpeta, max_mb=20 / 1024)
+    assert len(cache.entradas()) == 1
+    assert cache.leer_audio("d" * 40, PARAMETROS_AUDIO) is not None
+    assert os.path.exists(os.path.join(carpeta, "notas.txt"))
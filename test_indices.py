@@ -0,0 +1,67 @@
+# test_indices.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# El índice repartido en fragmentos (y la unión de sus vecinos) debe dar lo mismo que un solo
+# índice exacto sobre todo R. Uso: python -m pytest -q test_indices.py
+
+import numpy as np
+import util
+from indices import IndiceExacto, IndiceFragmentado, repartir_por_cancion, unir_vecinos
+
+
+def descriptores_R(filas_por_archivo, dim=8):
+    rng = np.random.default_rng(0)
+    matrices = [rng.standard_normal((filas, dim)).astype(np.float32) for filas in filas_por_archivo]
+    inicios = [np.arange(filas) * 0.5 for filas in filas_por_archivo]
+    archivos = ["c{}.m4a".format(i) for i in range(len(filas_por_archivo))]
+    return util.DescriptoresEnMemoria(archivos, matrices, inicios, dim)
+
+
+def test_repartir_por_cancion():
+    descriptores = descriptores_R([10, 30, 5, 5, 50])
+    assert repartir_por_cancion(descriptores, 1) == [(0, 100)]
+    grupos = repartir_por_cancion(descriptores, 3)
+    # grupos consecutivos que cubren R sin partir archivos
+    assert grupos[0][0] == 0 and grupos[-1][1] == 100
+    assert all(a[1] == b[0] for a, b in zip(grupos[:-1], grupos[1:]))
+    assert all(inicio in descriptores.offsets and fin in descriptores.offsets for inicio, fin in grupos)
+    # con más fragmentos que archivos quedan a lo más tantos grupos como archivos, ninguno vacío
+    grupos = repartir_por_cancion(descriptores, 10)
+    assert len(grupos) <= 5 and all(fin > inicio for inicio, fin in grupos)
+
+
+def test_unir_vecinos_descarta_filas_muertas():
+    indices = [np.array([[0, 1]]), np.array([[5, 6]])]
+    distancias = [np.array([[0.1, 0.4]], dtype=np.float32), np.array([[0.1, 0.2]], dtype=np.float32)]
+    vivas = np.ones(8, dtype=bool)
+    vivas[6] = False
+    unidos, dist = unir_vecinos(indices, distancias, 3, vivas)
+    # a igual distancia queda primero la parte anterior
+    assert unidos.tolist() == [[0, 5, 1]]
+    np.testing.assert_allclose(dist, [[0.1, 0.1, 0.4]])
+    unidos, _ = unir_vecinos(indices, distancias, 4, vivas)
+    assert unidos.tolist() == [[0, 5, 1, -1]]
+
+
+def test_fragmentado_igual_a_un_indice_exacto():
+    descriptores = descriptores_R([40, 25, 60, 15, 35])
+    descriptores.activos[1] = False
+    consultas = np.random.default_rng(1).standard_normal((30, descriptores.dim)).astype(np.float32)
+    k = 5
+
+    exacto = IndiceExacto()
+    exacto.construir(descriptores.matriz)
+    esperado, esperado_dist = unir_vecinos(*[[x] for x in exacto.buscar(consultas, k)], k,
+                                           descriptores.filas_vivas())
+
+    indice = IndiceFragmentado("exacto", 3, descriptores, 3)
+    try:
+        assert len(indice) == 3
+        indices, distancias = indice.buscar(consultas, k)
+    finally:
+        indice.cerrar()
+    np.testing.assert_array_equal(indices, esperado)
+    np.testing.assert_allclose(distancias, esperado_dist, rtol=1e-5, atol=1e-5)
+    assert not np.isin(indices, np.arange(40, 65)).any()
@@ -0,0 +1,48 @@
+# test_servidor_busqueda.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Un catálogo reemplazado por una recarga se cierra solo cuando lo suelta su último pedido.
+# Uso: python -m pytest -q test_servidor_busqueda.py
+
+import numpy as np
+import util
+from servidor_busqueda import CatalogoR
+
+
+def catalogo(tmp_path):
+    carpeta = str(tmp_path / "R")
+    escritor = util.EscritorDescriptores(carpeta, 4)
+    escritor.agregar("c0.m4a", np.eye(4, dtype=np.float32), np.arange(4) * 0.5)
+    escritor.cerrar()
+    catalogo = CatalogoR(carpeta, nombre_indice="exacto", cores=1)
+    cierres = []
+    catalogo.cerrar = lambda: cierres.append(catalogo.usuarios)
+    return catalogo, cierres
+
+
+def test_retirar_sin_pedidos_cierra(tmp_path):
+    catalogo_R, cierres = catalogo(tmp_path)
+    catalogo_R.retirar()
+    assert cierres == [0]
+
+
+def test_retirar_espera_al_ultimo_pedido(tmp_path):
+    catalogo_R, cierres = catalogo(tmp_path)
+    catalogo_R.tomar()
+    catalogo_R.tomar()
+    filas_Q, filas_R, _ = catalogo_R.buscar_filas(np.eye(4, dtype=np.float32), 1)
+    assert filas_Q.tolist() == [0, 1, 2, 3] and filas_R.tolist() == [0, 1, 2, 3]
+    catalogo_R.retirar()
+    catalogo_R.soltar()
+    assert cierres == []
+    catalogo_R.soltar()
+    assert cierres == [0]
+
+
+def test_soltar_sin_retirar_no_cierra(tmp_path):
+    catalogo_R, cierres = catalogo(tmp_path)
+    catalogo_R.tomar()
+    catalogo_R.soltar()
+    assert cierres == []
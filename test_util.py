@@ -0,0 +1,151 @@
+# test_util.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Almacén columnar de descriptores (escribir, anexar, desactivar, compactar, leer) y formato
+# binario de ventanas similares. Uso: python -m pytest -q test_util.py
+
+import os
+import numpy as np
+import pytest
+import util
+
+
+def descriptores_archivo(semilla, filas, dim=4):
+    rng = np.random.default_rng(semilla)
+    return rng.standard_normal((filas, dim)).astype(np.float32), np.arange(filas) * 0.25 + semilla
+
+
+def revisar_archivo(descriptores, id_archivo, semilla, filas):
+    matriz, inicios = descriptores_archivo(semilla, filas)
+    inicio, fin = descriptores.filas_de_archivo(id_archivo)
+    assert fin - inicio == filas
+    np.testing.assert_array_equal(descriptores.matriz[inicio:fin], matriz)
+    np.testing.assert_array_equal(descriptores.inicios[inicio:fin], inicios)
+
+
+def test_escribir_anexar_compactar_leer(tmp_path):
+    carpeta = str(tmp_path / "R")
+    parametros = {'dim': 4}
+    escritor = util.EscritorDescriptores(carpeta, 4, parametros)
+    for semilla, filas in [(0, 5), (1, 3), (2, 7)]:
+        escritor.agregar("c{}.m4a".format(semilla), *descriptores_archivo(semilla, filas), firma=[semilla, 0])
+    escritor.cerrar()
+
+    descriptores = util.Descriptores(carpeta)
+    assert descriptores.archivos == ["c0.m4a", "c1.m4a", "c2.m4a"]
+    assert len(descriptores) == 15
+    assert descriptores.segmentos == [0, 15]
+    assert descriptores.filas_vivas() is None
+    revisar_archivo(descriptores, 1, 1, 3)
+
+    # anexar un archivo nuevo y reemplazar c1 (se desactiva y se agrega al final)
+    escritor = util.EscritorDescriptores(carpeta, 4, parametros, anexar=True)
+    escritor.desactivar(1)
+    escritor.agregar("c3.m4a", *descriptores_archivo(3, 4))
+    escritor.agregar("c1.m4a", *descriptores_archivo(11, 2))
+    escritor.cerrar()
+
+    descriptores = util.Descriptores(carpeta)
+    assert descriptores.archivos == ["c0.m4a", "c1.m4a", "c2.m4a", "c3.m4a", "c1.m4a"]
+    assert descriptores.activos.tolist() == [True, False, True, True, True]
+    assert descriptores.segmentos == [0, 15, 21]
+    assert descriptores.filas_vivas().tolist() == [True] * 5 + [False] * 3 + [True] * 13
+    assert descriptores.ids_archivo(np.array([0, 5, 8, 15, 20])).tolist() == [0, 1, 2, 3, 4]
+    revisar_archivo(descriptores, 0, 0, 5)
+    revisar_archivo(descriptores, 4, 11, 2)
+    del descriptores
+
+    util.compactar_descriptores(carpeta)
+    descriptores = util.Descriptores(carpeta)
+    assert descriptores.archivos == ["c0.m4a", "c2.m4a", "c3.m4a", "c1.m4a"]
+    assert descriptores.activos.all()
+    assert descriptores.segmentos == [0, 18]
+    assert descriptores.firmas == [[0, 0], [2, 0], None, None]
+    assert descriptores.parametros == parametros
+    for id_archivo, (semilla, filas) in enumerate([(0, 5), (2, 7), (3, 4), (11, 2)]):
+        revisar_archivo(descriptores, id_archivo, semilla, filas)
+    # los archivos de la versión anterior se borran
+    assert sorted(os.listdir(carpeta)) == ["descriptores.1.f32", "descriptores.json", "inicios.1.f64"]
+
+
+def test_anexar_con_otros_parametros_falla(tmp_path):
+    carpeta = str(tmp_path / "R")
+    escritor = util.EscritorDescriptores(carpeta, 4, {'dim': 4})
+    escritor.agregar("c0.m4a", *descriptores_archivo(0, 5))
+    escritor.cerrar()
+    with pytest.raises(Exception):
+        util.EscritorDescriptores(carpeta, 4, {'dim': 4, 'apilar': 2}, anexar=True)
+
+
+def test_descartar_anexar_deja_el_almacen_anterior(tmp_path):
+    carpeta = str(tmp_path / "R")
+    escritor = util.EscritorDescriptores(carpeta, 4)
+    escritor.agregar("c0.m4a", *descriptores_archivo(0, 5))
+    escritor.cerrar()
+    escritor = util.EscritorDescriptores(carpeta, 4, anexar=True)
+    escritor.agregar("c1.m4a", *descriptores_archivo(1, 3))
+    escritor.descartar()
+
+    # las filas que alcanzaron a escribirse no se ven y se descartan al volver a anexar
+    assert util.Descriptores(carpeta).archivos == ["c0.m4a"]
+    escritor = util.EscritorDescriptores(carpeta, 4, anexar=True)
+    escritor.agregar("c2.m4a", *descriptores_archivo(2, 2))
+    escritor.cerrar()
+    descriptores = util.Descriptores(carpeta)
+    assert descriptores.archivos == ["c0.m4a", "c2.m4a"]
+    revisar_archivo(descriptores, 1, 2, 2)
+
+
+def test_descartar_almacen_nuevo_borra_la_carpeta(tmp_path):
+    carpeta = str(tmp_path / "R")
+    escritor = util.EscritorDescriptores(carpeta, 4)
+    escritor.agregar("c0.m4a", *descriptores_archivo(0, 5))
+    escritor.descartar()
+    assert not os.path.exists(carpeta)
+
+
+def test_bloqueo(tmp_path):
+    carpeta = str(tmp_path)
+    assert util.tomar_bloqueo(carpeta)
+    assert not util.tomar_bloqueo(carpeta)
+    util.soltar_bloqueo(carpeta)
+    assert util.tomar_bloqueo(carpeta)
+
+
+def test_ventanas_similares_binario_y_texto(tmp_path):
+    archivos_Q = ["radio0.m4a", "radio1.m4a"]
+    archivos_R = ["c0.m4a", "c1.m4a", "c2.m4a"]
+    rng = np.random.default_rng(0)
+    ids_Q = np.repeat([0, 1], 10)
+    ids_R = rng.integers(3, size=20)
+    inicios_Q = (np.arange(20) * 0.5).astype(np.float32)
+    inicios_R = rng.uniform(0, 60, 20).astype(np.float32)
+    distancias = rng.uniform(0, 1, 20).astype(np.float32)
+
+    archivo = str(tmp_path / "ventanas.bin")
+    escritor = util.EscritorVentanasSimilares(archivo, archivos_Q, archivos_R)
+    # en dos bloques: la cabecera se completa al cerrar
+    escritor.agregar(ids_Q[:7], inicios_Q[:7], ids_R[:7], inicios_R[:7], distancias[:7])
+    escritor.agregar(ids_Q[7:], inicios_Q[7:], ids_R[7:], inicios_R[7:], distancias[7:])
+    escritor.cerrar()
+
+    ventanas = util.leer_ventanas_similares(archivo)
+    assert len(ventanas) == 20
+    assert ventanas.archivos_Q == archivos_Q
+    assert ventanas.archivos_R == archivos_R
+    np.testing.assert_array_equal(ventanas.id_Q, ids_Q)
+    np.testing.assert_array_equal(ventanas.id_R, ids_R)
+    np.testing.assert_array_equal(ventanas.inicio_Q, inicios_Q)
+    np.testing.assert_array_equal(ventanas.inicio_R, inicios_R)
+    np.testing.assert_array_equal(ventanas.distancia, distancias)
+
+    # exportado a texto se lee con los mismos archivos y tiempos
+    archivo_texto = str(tmp_path / "ventanas.txt")
+    util.escribir_ventanas_similares_texto(ventanas, archivo_texto)
+    texto = util.leer_ventanas_similares(archivo_texto)
+    assert [texto.archivos_Q[i] for i in texto.id_Q] == [archivos_Q[i] for i in ids_Q]
+    assert [texto.archivos_R[i] for i in texto.id_R] == [archivos_R[i] for i in ids_R]
+    np.testing.assert_array_equal(texto.inicio_Q.astype(np.float32), inicios_Q)
+    np.testing.assert_array_equal(texto.inicio_R.astype(np.float32), inicios_R)
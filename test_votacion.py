@@ -0,0 +1,108 @@
+# test_votacion.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Compara la votación vectorizada (votacion.py) con el ciclo original de tarea2-deteccion.py
+# sobre ventanas similares sintéticas. Uso: python -m pytest -q test_votacion.py
+
+from collections import defaultdict, Counter
+import numpy as np
+import util
+from votacion import cuantizar_desfases, detectar_ventanas_similares, VotadorEnLinea
+
+
+def deteccion_original(ventanas, ventana_duracion=5.0, k_min=2, margen_desfase=1.0, umbral_confianza=1):
+    # el algoritmo de tarea2-deteccion.py antes de vectorizar, con ventanas como diccionarios
+    ventanas_por_Q = defaultdict(list)
+    for v in ventanas:
+        ventanas_por_Q[v['archivo_Q']].append(v)
+    detecciones = []
+    for archivo_Q, ventanas_Q in ventanas_por_Q.items():
+        ventanas_por_R = defaultdict(list)
+        for v in ventanas_Q:
+            ventanas_por_R[v['archivo_R']].append(v)
+        for archivo_R, ventanas_R in ventanas_por_R.items():
+            ventanas_R_sorted = sorted(ventanas_R, key=lambda x: x['inicio_Q'])
+            desfases = [v['inicio_Q'] - v['inicio_R'] for v in ventanas_R_sorted]
+            desfases_redondeados = [round(d, 1) for d in desfases]
+            desfase_mas_comun, cuenta = Counter(desfases_redondeados).most_common(1)[0]
+            ventanas_filtradas = [v for v, d in zip(ventanas_R_sorted, desfases_redondeados)
+                                  if abs(d - desfase_mas_comun) <= margen_desfase]
+            if len(ventanas_filtradas) < k_min:
+                continue
+            inicio_Q = ventanas_filtradas[0]['inicio_Q']
+            fin_Q = ventanas_filtradas[-1]['inicio_Q'] + ventana_duracion
+            confianza = len(ventanas_filtradas)
+            if confianza < umbral_confianza:
+                continue
+            detecciones.append([archivo_Q, inicio_Q, fin_Q - inicio_Q, archivo_R, confianza])
+    return detecciones
+
+
+def ventanas_sinteticas(semilla, num_Q=4, num_R=6, k=3):
+    # filas en el orden de la búsqueda: por archivo de Q y por inicio en Q, k vecinos por ventana.
+    # Cada Q contiene un tramo de una canción de R (desfase constante con ruido) y el resto son vecinos al azar
+    rng = np.random.default_rng(semilla)
+    filas = []
+    for q in range(num_Q):
+        cancion = rng.integers(num_R)
+        desfase = rng.uniform(10, 100)
+        tramo = rng.uniform(20, 100)
+        for inicio_Q in np.arange(0, 180, 0.5):
+            for vecino in range(k):
+                if vecino == 0 and desfase <= inicio_Q < desfase + tramo:
+                    r, inicio_R = cancion, inicio_Q - desfase + rng.normal(0, 0.08)
+                else:
+                    r, inicio_R = rng.integers(num_R), rng.uniform(0, 120)
+                filas.append(("radio{}.m4a".format(q), float(inicio_Q), "cancion{}.m4a".format(r),
+                              round(float(inicio_R), 4)))
+    return filas
+
+
+def redondear(detecciones):
+    return [[q, round(inicio, 3), round(largo, 3), r, confianza] for q, inicio, largo, r, confianza in detecciones]
+
+
+def test_desfases_como_round_de_python():
+    desfases = np.array([0.05, 0.15, 0.25, 0.35, 1.05, 2.45, -0.15, -0.25, -3.35, 12.349999, 7.0, -0.04])
+    esperado = [round(round(d, 1) * 10) for d in desfases.tolist()]
+    assert cuantizar_desfases(desfases).tolist() == esperado
+
+
+def test_igual_al_ciclo_original(tmp_path):
+    for semilla in range(5):
+        archivo = str(tmp_path / "ventanas{}.txt".format(semilla))
+        filas = ventanas_sinteticas(semilla)
+        util.escribir_lista_de_columnas_en_archivo(filas, archivo)
+        originales = deteccion_original([{'archivo_Q': q, 'inicio_Q': tq, 'archivo_R': r, 'inicio_R': tr}
+                                         for q, tq, r, tr in filas])
+        detecciones = detectar_ventanas_similares(util.leer_ventanas_similares(archivo))
+        assert len(originales) > 0
+        assert detecciones == redondear(originales)
+
+
+def test_votador_en_linea_igual_que_todo_junto(tmp_path):
+    filas = ventanas_sinteticas(7)
+    archivos_Q = sorted(set(f[0] for f in filas))
+    archivos_R = sorted(set(f[2] for f in filas))
+    ids_Q = np.array([archivos_Q.index(f[0]) for f in filas])
+    ids_R = np.array([archivos_R.index(f[2]) for f in filas])
+    inicios_Q = np.array([f[1] for f in filas], dtype=np.float32)
+    inicios_R = np.array([f[3] for f in filas], dtype=np.float32)
+
+    archivo = str(tmp_path / "ventanas.bin")
+    escritor = util.EscritorVentanasSimilares(archivo, archivos_Q, archivos_R)
+    escritor.agregar(ids_Q, inicios_Q, ids_R, inicios_R, np.zeros(len(filas)))
+    escritor.cerrar()
+    esperado = detectar_ventanas_similares(util.leer_ventanas_similares(archivo))
+
+    # por archivo de Q y en bloques pequeños, compactando a menudo
+    detecciones = []
+    votador = VotadorEnLinea(grupos_para_compactar=50)
+    for id_Q in range(len(archivos_Q)):
+        filas_Q = np.flatnonzero(ids_Q == id_Q)
+        for bloque in np.array_split(filas_Q, 7):
+            votador.agregar(ids_Q[bloque], inicios_Q[bloque], ids_R[bloque], inicios_R[bloque])
+        detecciones += votador.terminar(archivos_Q, archivos_R)
+    assert detecciones == esperado
@@ -5,8 +5,26 @@
 # este archivo se puede importar en los .py 
 # para tener funciones compartidas entre todos los  programas
 import os
+import sys
+import json
+import mmap
+import time
+import atexit
+import hashlib
 import pickle
+import struct
+import shutil
+import threading
+import contextlib
 import subprocess
+import numpy as np
+
+
+# ruta al ejecutable de FFmpeg: la variable de ambiente FFMPEG, o ffmpeg del PATH, o la
+# instalación local con que se desarrolló la tarea
+FFMPEG_LOCAL = "C:\\Users\\Vicente\\Desktop\\FCFM\\recuperacion_info\\datos_tarea2\\ffmpeg-7.1-full_build\\bin\\ffmpeg.exe"
+FFMPEG = os.environ.get("FFMPEG") or shutil.which("ffmpeg") or \
+    (FFMPEG_LOCAL if os.path.isfile(FFMPEG_LOCAL) else "ffmpeg")
 
 
 # funcion que recibe un nombre de archivo y llama a FFmpeg para crear un archivo wav
@@ -16,15 +34,29 @@ def convertir_a_wav(archivo_audio, sample_rate, dir_temporal):
     if os.path.isfile(archivo_wav):
         return archivo_wav
     os.makedirs(dir_temporal, exist_ok=True)
-    comando = ["C:\\Users\\Vicente\\Desktop\\FCFM\\recuperacion_info\\datos_tarea2\\ffmpeg-7.1-full_build\\bin\\ffmpeg.exe", "-hide_banner", "-loglevel", "error", "-i", archivo_audio, "-ac", "1", "-ar", str(sample_rate), archivo_wav]
+    comando = [FFMPEG, "-hide_banner", "-loglevel", "error", "-i", archivo_audio, "-ac", "1", "-ar", str(sample_rate), "-f", "wav", archivo_wav + ".tmp"]
 
     print("  {}".format(" ".join(comando)))
     code = subprocess.call(comando)
     if code != 0:
         raise Exception("ERROR en comando: " + " ".join(comando))
+    # se renombra al terminar para que un wav incompleto nunca quede en el cache
+    os.replace(archivo_wav + ".tmp", archivo_wav)
     return archivo_wav
 
 
+# funcion que llama a FFmpeg para decodificar el audio directamente a memoria:
+# FFmpeg escribe PCM float32 mono (f32le) en su salida estandar, que se lee
+# como un arreglo de numpy sin crear archivos temporales ni volver a remuestrear
+def decodificar_audio(archivo_audio, sample_rate):
+    comando = [FFMPEG, "-hide_banner", "-loglevel", "error", "-i", archivo_audio, "-ac", "1", "-ar", str(sample_rate), "-f", "f32le", "-"]
+    print("  {}".format(" ".join(comando)))
+    proceso = subprocess.run(comando, stdout=subprocess.PIPE)
+    if proceso.returncode != 0:
+        raise Exception("ERROR en comando: " + " ".join(comando))
+    return np.frombuffer(proceso.stdout, dtype=np.float32)
+
+
 # Retorna todos los archivos que terminan con el parametro extension
 # ejemplo: listar_archivos_con_extension(dir, ".m4a") retorna los nombres de archivos .m4a en dir
 def listar_archivos_con_extension(carpeta, extension):
@@ -76,12 +108,18 @@ def leer_objeto(carpeta, nombre_archivo):
 # dato2a  dato2b   dato3c
 def escribir_lista_de_columnas_en_archivo(lista_con_columnas, archivo_texto_salida):
     with open(archivo_texto_salida, 'w') as handle:
-        for columnas in lista_con_columnas:
-            textos = []
-            for col in columnas:
-                textos.append(str(col))
-            texto = "\t".join(textos)
-            print(texto, file=handle)
+        escribir_lista_de_columnas_en_handle(lista_con_columnas, handle)
+
+
+# igual que escribir_lista_de_columnas_en_archivo, pero sobre un archivo ya abierto
+# (permite ir agregando filas a medida que se calculan)
+def escribir_lista_de_columnas_en_handle(lista_con_columnas, handle):
+    for columnas in lista_con_columnas:
+        textos = []
+        for col in columnas:
+            textos.append(str(col))
+        texto = "\t".join(textos)
+        print(texto, file=handle)
 
 
 # Función para generar ventanas para un archivo de audio
@@ -97,3 +135,529 @@ def lista_ventanas(nombre_archivo, num_ventanas, sample_rate, hop_length, n_fft)
         }
         ventanas.append(ventana)
     return ventanas
+
+
+# Almacén columnar de descriptores.
+# Una carpeta de descriptores contiene tres archivos:
+#   descriptores.f32  -> matriz float32 contigua de (total, dim), fila por ventana
+#   inicios.f64       -> tiempo de inicio (segundos) de cada fila
+#   descriptores.json -> dimensión, nombres de archivos y offsets de sus filas
+# La matriz es float32 salvo que la tabla indique otro tipo (las huellas de huellas.py
+# se guardan como uint32, ver 'tipo'). Las filas del archivo i están en el rango [offsets[i], offsets[i+1]).
+# El almacén se puede actualizar de forma incremental: los archivos nuevos se agregan
+# al final como un segmento nuevo (segmentos = límites de filas de cada segmento) y
+# los archivos eliminados o modificados se marcan como inactivos, sin mover filas.
+# compactar_descriptores reescribe el almacén sin filas inactivas y en un solo segmento.
+ARCHIVO_MATRIZ = "descriptores.f32"
+ARCHIVO_INICIOS = "inicios.f64"
+ARCHIVO_TABLA = "descriptores.json"
+# existe mientras se compacta el almacén o se le agregan archivos, para que no ocurran a la vez
+ARCHIVO_BLOQUEO = "compactando.lock"
+
+
+def tomar_bloqueo(carpeta):
+    """
+    Crea el bloqueo del almacén solo si no existe (O_EXCL, atómico). Retorna False si otro
+    proceso lo tiene; quien lo toma debe llamar a soltar_bloqueo al terminar.
+    """
+    try:
+        os.close(os.open(os.path.join(carpeta, ARCHIVO_BLOQUEO), os.O_CREAT | os.O_EXCL))
+    except FileExistsError:
+        return False
+    return True
+
+
+def soltar_bloqueo(carpeta):
+    os.remove(os.path.join(carpeta, ARCHIVO_BLOQUEO))
+
+
+def leer_tabla_descriptores(carpeta):
+    with open(os.path.join(carpeta, ARCHIVO_TABLA), 'r') as handle:
+        tabla = json.load(handle)
+    # valores por omisión para almacenes escritos antes de las actualizaciones incrementales
+    tabla.setdefault('matriz', ARCHIVO_MATRIZ)
+    tabla.setdefault('inicios', ARCHIVO_INICIOS)
+    tabla.setdefault('activos', [True] * len(tabla['archivos']))
+    tabla.setdefault('firmas', [None] * len(tabla['archivos']))
+    tabla.setdefault('segmentos', [0, tabla['total']] if tabla['total'] > 0 else [0])
+    tabla.setdefault('parametros', None)
+    tabla.setdefault('tipo', 'float32')
+    return tabla
+
+
+def escribir_tabla_descriptores(carpeta, tabla):
+    # la tabla se escribe con un rename: es la que marca el almacén como completo
+    archivo = os.path.join(carpeta, ARCHIVO_TABLA)
+    with open(archivo + ".tmp", 'w') as handle:
+        json.dump(tabla, handle)
+    os.replace(archivo + ".tmp", archivo)
+
+
+# firma de un archivo de audio para saber si cambió desde que se extrajo
+def firma_archivo(ruta):
+    estado = os.stat(ruta)
+    return [estado.st_size, estado.st_mtime_ns]
+
+
+class EscritorDescriptores:
+    """
+    Agrega los descriptores de cada archivo de audio al final del almacén columnar.
+    Un almacén nuevo se escribe en archivos temporales que se renombran al cerrar.
+    Con anexar=True se continúa un almacén existente: las filas nuevas se agregan al
+    final de la matriz y solo son visibles cuando se reescribe la tabla al cerrar, de
+    modo que una carpeta de descriptores nunca queda a medio escribir. Si la extracción
+    falla antes de cerrar() se llama a descartar().
+    """
+
+    def __init__(self, carpeta, dim, parametros=None, anexar=False, tipo='float32'):
+        # si la carpeta la crea el escritor, descartar() la borra completa
+        self.carpeta_nueva = not os.path.isdir(carpeta)
+        os.makedirs(carpeta, exist_ok=True)
+        self.carpeta = carpeta
+        self.dim = dim
+        self.tipo = np.dtype(tipo)
+        self.anexar = anexar
+        if anexar:
+            tabla = leer_tabla_descriptores(carpeta)
+            if tabla['dim'] != dim or tabla['parametros'] != parametros or np.dtype(tabla['tipo']) != self.tipo:
+                raise Exception("los parámetros de {} no coinciden con los de la extracción".format(carpeta))
+            self.tabla = tabla
+            self.handle_matriz = self.abrir_al_final(tabla['matriz'], tabla['total'] * dim * self.tipo.itemsize)
+            self.handle_inicios = self.abrir_al_final(tabla['inicios'], tabla['total'] * 8)
+        else:
+            self.tabla = {
+                'dim': dim,
+                'total': 0,
+                'archivos': [],
+                'offsets': [0],
+                'activos': [],
+                'firmas': [],
+                'segmentos': [0],
+                'matriz': ARCHIVO_MATRIZ,
+                'inicios': ARCHIVO_INICIOS,
+                'parametros': parametros,
+                'tipo': self.tipo.name
+            }
+            self.handle_matriz = open(os.path.join(carpeta, ARCHIVO_MATRIZ + ".tmp"), 'wb')
+            self.handle_inicios = open(os.path.join(carpeta, ARCHIVO_INICIOS + ".tmp"), 'wb')
+        self.archivos = self.tabla['archivos']
+        self.offsets = self.tabla['offsets']
+
+    def abrir_al_final(self, nombre, largo):
+        # descarta bytes de una escritura anterior que no alcanzó a quedar en la tabla
+        handle = open(os.path.join(self.carpeta, nombre), 'r+b')
+        handle.truncate(largo)
+        handle.seek(largo)
+        return handle
+
+    def agregar(self, nombre_archivo, descriptores, inicios, firma=None):
+        descriptores = np.ascontiguousarray(descriptores, dtype=self.tipo)
+        inicios = np.ascontiguousarray(inicios, dtype=np.float64)
+        if descriptores.ndim != 2 or descriptores.shape[1] != self.dim:
+            raise Exception("dimensión incorrecta {} para {}".format(descriptores.shape, nombre_archivo))
+        if len(inicios) != len(descriptores):
+            raise Exception("cantidad de inicios distinta a descriptores para {}".format(nombre_archivo))
+        descriptores.tofile(self.handle_matriz)
+        inicios.tofile(self.handle_inicios)
+        self.archivos.append(nombre_archivo)
+        self.offsets.append(self.offsets[-1] + len(descriptores))
+        self.tabla['activos'].append(True)
+        self.tabla['firmas'].append(firma)
+
+    def desactivar(self, id_archivo):
+        # el archivo deja de participar en la búsqueda; sus filas se eliminan al compactar
+        self.tabla['activos'][id_archivo] = False
+
+    def cerrar(self):
+        self.handle_matriz.close()
+        self.handle_inicios.close()
+        tabla = self.tabla
+        if self.offsets[-1] > tabla['segmentos'][-1]:
+            # las filas agregadas forman un segmento nuevo
+            tabla['segmentos'].append(self.offsets[-1])
+        tabla['total'] = self.offsets[-1]
+        if not self.anexar:
+            for nombre in [ARCHIVO_MATRIZ, ARCHIVO_INICIOS]:
+                ruta = os.path.join(self.carpeta, nombre)
+                os.replace(ruta + ".tmp", ruta)
+        escribir_tabla_descriptores(self.carpeta, tabla)
+
+    def descartar(self):
+        # abandona la escritura: un almacén nuevo no deja temporales ni su carpeta (así la siguiente
+        # ejecución no falla con "ya existe"); al anexar, la tabla sigue siendo la anterior y las
+        # filas que alcanzaron a escribirse se descartan la próxima vez que se abra (abrir_al_final)
+        self.handle_matriz.close()
+        self.handle_inicios.close()
+        if self.anexar:
+            return
+        if self.carpeta_nueva:
+            shutil.rmtree(self.carpeta, ignore_errors=True)
+            return
+        for nombre in [ARCHIVO_MATRIZ, ARCHIVO_INICIOS]:
+            try:
+                os.remove(os.path.join(self.carpeta, nombre + ".tmp"))
+            except OSError:
+                pass
+
+
+class Descriptores:
+    """
+    Vista de solo lectura sobre un almacén columnar. La matriz y los inicios
+    se abren con np.memmap, por lo que cargar no copia datos ni crea objetos por ventana.
+    """
+
+    def __init__(self, carpeta):
+        tabla = leer_tabla_descriptores(carpeta)
+        self.carpeta = carpeta
+        self.dim = tabla['dim']
+        self.total = tabla['total']
+        self.archivos = tabla['archivos']
+        self.offsets = np.array(tabla['offsets'], dtype=np.int64)
+        self.activos = np.array(tabla['activos'], dtype=bool)
+        self.firmas = tabla['firmas']
+        self.segmentos = tabla['segmentos']
+        self.parametros = tabla['parametros']
+        self.tipo = np.dtype(tabla['tipo'])
+        if self.total == 0:
+            self.matriz = np.empty((0, self.dim), dtype=self.tipo)
+            self.inicios = np.empty(0, dtype=np.float64)
+        else:
+            self.matriz = np.memmap(os.path.join(carpeta, tabla['matriz']), dtype=self.tipo, mode='r',
+                                    shape=(self.total, self.dim))
+            self.inicios = np.memmap(os.path.join(carpeta, tabla['inicios']), dtype=np.float64, mode='r',
+                                     shape=(self.total,))
+
+    def __len__(self):
+        return self.total
+
+    def ids_archivo(self, filas):
+        # id del archivo al que pertenece cada fila
+        return np.searchsorted(self.offsets, filas, side='right') - 1
+
+    def filas_de_archivo(self, id_archivo):
+        return self.offsets[id_archivo], self.offsets[id_archivo + 1]
+
+    def filas_vivas(self):
+        # máscara de filas de archivos activos, o None si todos están activos
+        if self.activos.all():
+            return None
+        return np.repeat(self.activos, np.diff(self.offsets))
+
+    def liberar_paginas(self):
+        # saca de la memoria del proceso las páginas del almacén ya leídas; siguen en el archivo
+        # y se vuelven a leer si se usan. Solo donde mmap tiene madvise (no en Windows)
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        for arreglo in (self.matriz, self.inicios):
+            mapa = getattr(arreglo, "_mmap", None)
+            if mapa is not None:
+                mapa.madvise(mmap.MADV_DONTNEED)
+
+
+class DescriptoresEnMemoria(Descriptores):
+    """
+    Descriptores recién calculados que no pasan por disco (ver pipeline.py), con la misma
+    interfaz que un almacén. No tiene carpeta, así los índices se construyen sin guardarse.
+    """
+
+    def __init__(self, archivos, matrices, inicios, dim, parametros=None, tipo='float32'):
+        self.carpeta = None
+        self.dim = dim
+        self.tipo = np.dtype(tipo)
+        self.archivos = list(archivos)
+        self.offsets = np.zeros(len(self.archivos) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(matriz) for matriz in matrices], dtype=np.int64)
+        self.total = int(self.offsets[-1])
+        self.activos = np.ones(len(self.archivos), dtype=bool)
+        self.firmas = [None] * len(self.archivos)
+        self.segmentos = [0, self.total] if self.total > 0 else [0]
+        self.parametros = parametros
+        if self.total == 0:
+            self.matriz = np.empty((0, dim), dtype=self.tipo)
+            self.inicios = np.empty(0, dtype=np.float64)
+        else:
+            self.matriz = np.ascontiguousarray(np.concatenate(matrices).reshape(-1, dim), dtype=self.tipo)
+            self.inicios = np.concatenate(inicios).astype(np.float64)
+
+
+def compactar_descriptores(carpeta):
+    """
+    Reescribe el almacén dejando solo los archivos activos, en un único segmento.
+    Los archivos nuevos tienen otro nombre y se publican al reemplazar la tabla,
+    así quien esté leyendo el almacén anterior no se ve afectado.
+    """
+    tabla = leer_tabla_descriptores(carpeta)
+    descriptores = Descriptores(carpeta)
+    version = tabla.get('version', 0) + 1
+    nombre_matriz = "descriptores.{}.f32".format(version)
+    nombre_inicios = "inicios.{}.f64".format(version)
+    archivos = []
+    offsets = [0]
+    firmas = []
+    with open(os.path.join(carpeta, nombre_matriz), 'wb') as handle_matriz, \
+            open(os.path.join(carpeta, nombre_inicios), 'wb') as handle_inicios:
+        for id_archivo, nombre in enumerate(descriptores.archivos):
+            if not descriptores.activos[id_archivo]:
+                continue
+            inicio, fin = descriptores.filas_de_archivo(id_archivo)
+            np.ascontiguousarray(descriptores.matriz[inicio:fin]).tofile(handle_matriz)
+            np.ascontiguousarray(descriptores.inicios[inicio:fin]).tofile(handle_inicios)
+            archivos.append(nombre)
+            offsets.append(offsets[-1] + int(fin - inicio))
+            firmas.append(tabla['firmas'][id_archivo])
+    del descriptores
+    # con el bloqueo nadie debería haber cambiado el almacén; si cambió (por ejemplo un extractor
+    # sin bloqueo), publicar esta copia perdería sus cambios y borraría archivos que está usando
+    actual = leer_tabla_descriptores(carpeta)
+    if any(actual.get(campo) != tabla.get(campo) for campo in ['version', 'total', 'segmentos', 'activos']):
+        for nombre in [nombre_matriz, nombre_inicios]:
+            os.remove(os.path.join(carpeta, nombre))
+        raise Exception("el almacén {} cambió mientras se compactaba, no se compactó".format(carpeta))
+    nueva = dict(tabla)
+    nueva.update({
+        'version': version,
+        'total': offsets[-1],
+        'archivos': archivos,
+        'offsets': offsets,
+        'activos': [True] * len(archivos),
+        'firmas': firmas,
+        'segmentos': [0, offsets[-1]] if offsets[-1] > 0 else [0],
+        'matriz': nombre_matriz,
+        'inicios': nombre_inicios
+    })
+    escribir_tabla_descriptores(carpeta, nueva)
+    for nombre in [tabla['matriz'], tabla['inicios']]:
+        try:
+            os.remove(os.path.join(carpeta, nombre))
+        except OSError:
+            # en Windows no se puede borrar mientras otro proceso lo tenga abierto
+            print("no se pudo borrar {}".format(nombre))
+
+
+# hash del contenido de una matriz de descriptores junto a los parámetros con que se usa.
+# sirve para nombrar archivos derivados (por ejemplo un índice guardado) que solo
+# son válidos para exactamente esos datos y esos parámetros
+def hash_descriptores(matriz, parametros, filas_por_bloque=1 << 18):
+    h = hashlib.sha1()
+    h.update(json.dumps(parametros, sort_keys=True).encode("utf-8"))
+    h.update(str(matriz.shape).encode("utf-8"))
+    for inicio in range(0, len(matriz), filas_por_bloque):
+        h.update(np.ascontiguousarray(matriz[inicio:inicio + filas_por_bloque]).data)
+    return h.hexdigest()
+
+
+# Archivo binario con las ventanas similares de Q en R.
+#   cabecera: magia (8 bytes) | num_filas uint64 | largo_tabla uint64
+#   tabla:    json utf-8 con los nombres de archivos de Q y de R (el id es la posición),
+#             rellenado con espacios hasta un múltiplo de 8 bytes
+#   filas:    num_filas registros de DTYPE_VENTANA
+# Los tiempos se guardan en float32 (precisión mejor a 0.02 s hasta unos 3 días de audio).
+MAGIA_VENTANAS = b"T2VSIM01"
+DTYPE_VENTANA = np.dtype([('id_Q', '<i4'), ('inicio_Q', '<f4'), ('id_R', '<i4'), ('inicio_R', '<f4'),
+                          ('distancia', '<f4')])
+
+
+class EscritorVentanasSimilares:
+    """
+    Escribe el archivo binario de ventanas similares. Las filas se pueden agregar en
+    varios bloques; la cantidad total se completa en la cabecera al cerrar.
+    """
+
+    def __init__(self, archivo, archivos_Q, archivos_R):
+        tabla = json.dumps({'archivos_Q': list(archivos_Q), 'archivos_R': list(archivos_R)}).encode("utf-8")
+        tabla += b" " * (-len(tabla) % 8)
+        self.num_filas = 0
+        self.handle = open(archivo, 'wb')
+        self.handle.write(MAGIA_VENTANAS)
+        self.handle.write(struct.pack("<QQ", 0, len(tabla)))
+        self.handle.write(tabla)
+
+    def agregar(self, ids_Q, inicios_Q, ids_R, inicios_R, distancias):
+        filas = np.empty(len(ids_Q), dtype=DTYPE_VENTANA)
+        filas['id_Q'] = ids_Q
+        filas['inicio_Q'] = inicios_Q
+        filas['id_R'] = ids_R
+        filas['inicio_R'] = inicios_R
+        filas['distancia'] = distancias
+        filas.tofile(self.handle)
+        self.num_filas += len(filas)
+
+    def cerrar(self):
+        self.handle.seek(len(MAGIA_VENTANAS))
+        self.handle.write(struct.pack("<Q", self.num_filas))
+        self.handle.close()
+
+
+class VentanasSimilares:
+    """
+    Ventanas similares como arreglos de numpy: para cada fila, id del archivo de Q,
+    inicio en Q, id del archivo de R, inicio en R y distancia entre descriptores.
+    """
+
+    def __init__(self, archivos_Q, archivos_R, id_Q, inicio_Q, id_R, inicio_R, distancia):
+        self.archivos_Q = archivos_Q
+        self.archivos_R = archivos_R
+        self.id_Q = id_Q
+        self.inicio_Q = inicio_Q
+        self.id_R = id_R
+        self.inicio_R = inicio_R
+        self.distancia = distancia
+
+    def __len__(self):
+        return len(self.id_Q)
+
+
+def leer_ventanas_similares(archivo):
+    with open(archivo, 'rb') as handle:
+        magia = handle.read(len(MAGIA_VENTANAS))
+    if magia != MAGIA_VENTANAS:
+        # archivo en el formato de texto antiguo
+        return leer_ventanas_similares_texto(archivo)
+    with open(archivo, 'rb') as handle:
+        handle.seek(len(MAGIA_VENTANAS))
+        num_filas, largo_tabla = struct.unpack("<QQ", handle.read(16))
+        tabla = json.loads(handle.read(largo_tabla).decode("utf-8"))
+        filas = np.fromfile(handle, dtype=DTYPE_VENTANA, count=num_filas)
+    return VentanasSimilares(tabla['archivos_Q'], tabla['archivos_R'], filas['id_Q'], filas['inicio_Q'],
+                             filas['id_R'], filas['inicio_R'], filas['distancia'])
+
+
+# lee el formato de texto: archivo_Q, inicio_Q, archivo_R, inicio_R separados por \t
+def leer_ventanas_similares_texto(archivo):
+    ids_Q = {}
+    ids_R = {}
+    columnas = ([], [], [], [])
+    with open(archivo, 'r') as handle:
+        for linea in handle:
+            partes = linea.rstrip("\r\n").split('\t')
+            if len(partes) != 4:
+                continue
+            columnas[0].append(ids_Q.setdefault(partes[0], len(ids_Q)))
+            columnas[1].append(float(partes[1]))
+            columnas[2].append(ids_R.setdefault(partes[2], len(ids_R)))
+            columnas[3].append(float(partes[3]))
+    return VentanasSimilares(list(ids_Q), list(ids_R),
+                             np.array(columnas[0], dtype=np.int32), np.array(columnas[1]),
+                             np.array(columnas[2], dtype=np.int32), np.array(columnas[3]),
+                             np.zeros(len(columnas[0]), dtype=np.float32))
+
+
+# exporta las ventanas similares al formato de texto de 4 columnas
+def escribir_ventanas_similares_texto(ventanas, archivo_texto_salida):
+    archivos_Q = np.array(ventanas.archivos_Q, dtype=object)[ventanas.id_Q]
+    archivos_R = np.array(ventanas.archivos_R, dtype=object)[ventanas.id_R]
+    filas = zip(archivos_Q, ventanas.inicio_Q, archivos_R, ventanas.inicio_R)
+    escribir_lista_de_columnas_en_archivo(filas, archivo_texto_salida)
+
+
+# Instrumentación: tiempo de cada etapa (tramos), contadores y memoria máxima.
+# Está desactivada salvo que un programa llame a iniciar_metricas, que lo hace con la opción
+# --metricas archivo.json o si existe la variable de ambiente TAREA2_METRICAS con una carpeta
+# (cada programa escribe ahí programa.pid.json). Desactivada, medir() entrega siempre el mismo
+# contexto vacío y contar() solo revisa una variable, así el costo es despreciable.
+# Los tramos anidados se guardan con nombres como "busqueda/consultar_indice".
+VARIABLE_METRICAS = "TAREA2_METRICAS"
+_instrumentacion = None
+_CONTEXTO_VACIO = contextlib.nullcontext()
+
+
+def memoria_maxima_mb(hijos=False):
+    # memoria máxima (RSS) del proceso o de sus hijos terminados; None si el sistema no la informa
+    try:
+        import resource
+    except ImportError:
+        return None
+    uso = resource.getrusage(resource.RUSAGE_CHILDREN if hijos else resource.RUSAGE_SELF)
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    return uso.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class Instrumentacion:
+
+    def __init__(self, programa, archivo):
+        self.programa = programa
+        self.archivo = archivo
+        self.inicio = time.time()
+        self.tramos = {}
+        self.contadores = {}
+        self.lock = threading.Lock()
+        # cada thread tiene su propia pila de tramos abiertos
+        self.local = threading.local()
+
+    def pila(self):
+        if not hasattr(self.local, "pila"):
+            self.local.pila = []
+        return self.local.pila
+
+    @contextlib.contextmanager
+    def tramo(self, nombre):
+        pila = self.pila()
+        pila.append(nombre)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - t0
+            nombre_completo = "/".join(pila)
+            pila.pop()
+            self.registrar_tiempo(nombre_completo, segundos, memoria_maxima_mb())
+
+    def registrar_tiempo(self, nombre, segundos, max_rss_mb=None):
+        with self.lock:
+            tramo = self.tramos.setdefault(nombre, {'llamadas': 0, 'total_s': 0.0, 'max_s': 0.0})
+            tramo['llamadas'] += 1
+            tramo['total_s'] += segundos
+            tramo['max_s'] = max(tramo['max_s'], segundos)
+            if max_rss_mb is not None:
+                # memoria máxima del proceso al terminar el tramo: muestra en qué tramo creció
+                tramo['max_rss_mb'] = max(tramo.get('max_rss_mb', 0.0), max_rss_mb)
+
+    def contar(self, nombre, cantidad):
+        with self.lock:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + int(cantidad)
+
+    def resumen(self):
+        return {'programa': self.programa, 'argumentos': sys.argv[1:], 'pid': os.getpid(),
+                'total_s': time.time() - self.inicio, 'max_rss_mb': memoria_maxima_mb(),
+                'max_rss_hijos_mb': memoria_maxima_mb(hijos=True), 'tramos': self.tramos,
+                'contadores': self.contadores}
+
+    def escribir(self):
+        carpeta = os.path.dirname(self.archivo)
+        if carpeta != "":
+            os.makedirs(carpeta, exist_ok=True)
+        with open(self.archivo, 'w') as handle:
+            json.dump(self.resumen(), handle, indent=2)
+
+
+def iniciar_metricas(programa, archivo=None):
+    """
+    Activa la instrumentación del proceso y la escribe en archivo al terminar. Sin archivo se
+    usa la carpeta de TAREA2_METRICAS; si tampoco existe, la instrumentación queda desactivada.
+    """
+    global _instrumentacion
+    if archivo is None and os.environ.get(VARIABLE_METRICAS):
+        archivo = os.path.join(os.environ[VARIABLE_METRICAS], "{}.{}.json".format(programa, os.getpid()))
+    if archivo is None:
+        return None
+    _instrumentacion = Instrumentacion(programa, archivo)
+    atexit.register(_instrumentacion.escribir)
+    return _instrumentacion
+
+
+def medir(nombre):
+    # uso: with util.medir("construir_indice"): ...
+    if _instrumentacion is None:
+        return _CONTEXTO_VACIO
+    return _instrumentacion.tramo(nombre)
+
+
+def contar(nombre, cantidad=1):
+    if _instrumentacion is not None:
+        _instrumentacion.contar(nombre, cantidad)
+
+
+def registrar_tiempo(nombre, segundos):
+    # para tiempos medidos en otro proceso (por ejemplo los workers de la extracción)
+    if _instrumentacion is not None:
+        _instrumentacion.registrar_tiempo(nombre, segundos)
@@ -0,0 +1,189 @@
+# votacion.py
+# CC5213 - TAREA 2 - RECUPERACIÓN DE INFORMACIÓN MULTIMEDIA
+# 20 septiembre de 2024
+# Alumno: [Juan Vicente Onetto]
+
+# Votación por desfase para detectar canciones a partir de las ventanas similares.
+# Cada vecino (ventana de Q, ventana de R) vota por el desfase inicio_Q - inicio_R
+# redondeado a 0.1 s. Para cada par (archivo de Q, archivo de R) se toma el desfase
+# más votado y se suman los votos dentro de margen_desfase alrededor de él.
+# Los votos se guardan agregados por (Q, R, desfase) en arreglos de numpy, por lo que
+# se pueden acumular por bloques sin guardar cada vecino.
+
+import numpy as np
+
+
+def cuantizar_desfases(desfases):
+    """
+    Equivalente vectorizado de round(d, 1) de Python, expresado en décimas enteras.
+    np.rint(d * 10) coincide con el redondeo decimal de Python excepto cuando d * 10
+    queda prácticamente en x.5; esos pocos casos se resuelven con round().
+    """
+    escalados = desfases * 10
+    decimas = np.rint(escalados)
+    dudosos = np.flatnonzero(np.abs(escalados - np.floor(escalados) - 0.5) < 1e-6)
+    for i in dudosos:
+        decimas[i] = round(round(float(desfases[i]), 1) * 10)
+    return decimas.astype(np.int64)
+
+
+class TablaVotos:
+    """
+    Votos agregados por (id_Q, id_R, desfase en décimas). Para cada grupo guarda la
+    cantidad de votos, el primer y último inicio en Q, y el número de orden del
+    primer voto (para desempatar igual que Counter.most_common).
+    """
+
+    def __init__(self, id_Q, id_R, desfase, cuenta, t_min, t_max, primera):
+        self.id_Q = id_Q
+        self.id_R = id_R
+        self.desfase = desfase
+        self.cuenta = cuenta
+        self.t_min = t_min
+        self.t_max = t_max
+        self.primera = primera
+
+    def __len__(self):
+        return len(self.id_Q)
+
+    @staticmethod
+    def desde_vecinos(ids_Q, inicios_Q, ids_R, inicios_R, orden):
+        inicios_Q = np.asarray(inicios_Q, dtype=np.float64)
+        inicios_R = np.asarray(inicios_R, dtype=np.float64)
+        desfases = cuantizar_desfases(inicios_Q - inicios_R)
+        return TablaVotos(np.asarray(ids_Q, dtype=np.int64), np.asarray(ids_R, dtype=np.int64), desfases,
+                          np.ones(len(desfases), dtype=np.int64), inicios_Q, inicios_Q,
+                          np.asarray(orden, dtype=np.int64))
+
+    @staticmethod
+    def concatenar(tablas):
+        return TablaVotos(*[np.concatenate([getattr(t, campo) for t in tablas]) for campo in
+                            ['id_Q', 'id_R', 'desfase', 'cuenta', 't_min', 't_max', 'primera']])
+
+    def reducir(self):
+        """
+        Ordena por (id_Q, id_R, desfase) y junta las filas repetidas en un solo grupo.
+        """
+        if len(self) == 0:
+            return self
+        orden = np.lexsort((self.desfase, self.id_R, self.id_Q))
+        id_Q = self.id_Q[orden]
+        id_R = self.id_R[orden]
+        desfase = self.desfase[orden]
+        nuevo = np.ones(len(orden), dtype=bool)
+        nuevo[1:] = (id_Q[1:] != id_Q[:-1]) | (id_R[1:] != id_R[:-1]) | (desfase[1:] != desfase[:-1])
+        inicios = np.flatnonzero(nuevo)
+        return TablaVotos(id_Q[inicios], id_R[inicios], desfase[inicios],
+                          np.add.reduceat(self.cuenta[orden], inicios),
+                          np.minimum.reduceat(self.t_min[orden], inicios),
+                          np.maximum.reduceat(self.t_max[orden], inicios),
+                          np.minimum.reduceat(self.primera[orden], inicios))
+
+
+def detectar_desde_votos(votos, archivos_Q, archivos_R, ventana_duracion=5.0, k_min=2, margen_desfase=1.0,
+                         umbral_confianza=1, con_desfase=False):
+    """
+    Recibe una TablaVotos reducida y retorna las detecciones [archivo_Q, inicio, largo, archivo_R, confianza]
+    ordenadas por el primer voto de cada par (Q, R). Con con_desfase se agrega al final
+    el desfase más votado en segundos.
+    """
+    if len(votos) == 0:
+        return []
+    # inicio de cada par (Q, R) dentro de la tabla ordenada por (Q, R, desfase)
+    nuevo_par = np.ones(len(votos), dtype=bool)
+    nuevo_par[1:] = (votos.id_Q[1:] != votos.id_Q[:-1]) | (votos.id_R[1:] != votos.id_R[:-1])
+    inicios_par = np.flatnonzero(nuevo_par)
+    par_de_grupo = np.cumsum(nuevo_par) - 1
+
+    # desfase más votado de cada par; en empate gana el que apareció primero
+    orden = np.lexsort((votos.primera, -votos.cuenta, votos.id_R, votos.id_Q))
+    moda = votos.desfase[orden[inicios_par]]
+
+    # la comparación se hace con los desfases en segundos como float, igual que con round(d, 1)
+    dentro = np.abs(votos.desfase / 10 - moda[par_de_grupo] / 10) <= margen_desfase
+    confianza = np.add.reduceat(np.where(dentro, votos.cuenta, 0), inicios_par)
+    inicio = np.minimum.reduceat(np.where(dentro, votos.t_min, np.inf), inicios_par)
+    fin = np.maximum.reduceat(np.where(dentro, votos.t_max, -np.inf), inicios_par) + ventana_duracion
+    primera_par = np.minimum.reduceat(votos.primera, inicios_par)
+
+    # los tiempos de las ventanas similares son float32: se pasan a float64 y se redondean a
+    # milisegundos, así el archivo de detecciones no muestra el error de float32 (21.394285202026367)
+    inicio = np.asarray(inicio, dtype=np.float64)
+    largo = np.round(np.asarray(fin, dtype=np.float64) - inicio, 3)
+    inicio = np.round(inicio, 3)
+
+    detecciones = []
+    for p in np.argsort(primera_par, kind='stable'):
+        if confianza[p] < k_min or confianza[p] < umbral_confianza:
+            continue
+        deteccion = [
+            archivos_Q[votos.id_Q[inicios_par[p]]],
+            float(inicio[p]),
+            float(largo[p]),
+            archivos_R[votos.id_R[inicios_par[p]]],
+            int(confianza[p])
+        ]
+        if con_desfase:
+            deteccion.append(moda[p] / 10)
+        detecciones.append(deteccion)
+    return detecciones
+
+
+def detectar_ventanas_similares(ventanas, ventana_duracion=5.0, k_min=2, margen_desfase=1.0, umbral_confianza=1):
+    """
+    Detecciones de un conjunto completo de ventanas similares (ver util.VentanasSimilares).
+    El orden de los votos es el de las filas ordenadas por archivo de Q (según su primera
+    aparición) y luego por inicio en Q, que es el orden en que se contaban los desfases.
+    """
+    filas = np.arange(len(ventanas))
+    primera_fila_Q = np.full(len(ventanas.archivos_Q), len(ventanas), dtype=np.int64)
+    np.minimum.at(primera_fila_Q, ventanas.id_Q, filas)
+    orden = np.empty(len(ventanas), dtype=np.int64)
+    orden[np.lexsort((filas, ventanas.inicio_Q, primera_fila_Q[ventanas.id_Q]))] = filas
+    votos = TablaVotos.desde_vecinos(ventanas.id_Q, ventanas.inicio_Q, ventanas.id_R, ventanas.inicio_R, orden)
+    return detectar_desde_votos(votos.reducir(), ventanas.archivos_Q, ventanas.archivos_R, ventana_duracion,
+                                k_min, margen_desfase, umbral_confianza)
+
+
+class VotadorEnLinea:
+    """
+    Acumula los vecinos de un archivo de Q a medida que llegan de la búsqueda.
+    Los votos de cada bloque se agregan de inmediato y la tabla se compacta cuando
+    crece, así la memoria depende de la cantidad de desfases distintos y no de la
+    cantidad de vecinos. Al terminar el archivo de Q se emiten sus detecciones.
+    """
+
+    def __init__(self, ventana_duracion=5.0, k_min=2, margen_desfase=1.0, umbral_confianza=1,
+                 grupos_para_compactar=1 << 20):
+        self.ventana_duracion = ventana_duracion
+        self.k_min = k_min
+        self.margen_desfase = margen_desfase
+        self.umbral_confianza = umbral_confianza
+        self.grupos_para_compactar = grupos_para_compactar
+        self.tablas = []
+        self.grupos_pendientes = 0
+        self.siguiente_orden = 0
+
+    def agregar(self, ids_Q, inicios_Q, ids_R, inicios_R):
+        # los vecinos deben llegar en el orden de Q (inicio en Q y luego rango del vecino)
+        orden = np.arange(self.siguiente_orden, self.siguiente_orden + len(ids_R))
+        self.siguiente_orden += len(ids_R)
+        # los tiempos se usan en float32, igual que en el archivo binario de ventanas similares
+        inicios_Q = np.asarray(inicios_Q, dtype=np.float32)
+        inicios_R = np.asarray(inicios_R, dtype=np.float32)
+        tabla = TablaVotos.desde_vecinos(ids_Q, inicios_Q, ids_R, inicios_R, orden).reducir()
+        self.tablas.append(tabla)
+        self.grupos_pendientes += len(tabla)
+        if self.grupos_pendientes > self.grupos_para_compactar:
+            self.tablas = [TablaVotos.concatenar(self.tablas).reducir()]
+            self.grupos_pendientes = len(self.tablas[0])
+
+    def terminar(self, archivos_Q, archivos_R):
+        # emite las detecciones de lo acumulado y deja el votador vacío
+        if len(self.tablas) == 0:
+            return []
+        votos = TablaVotos.concatenar(self.tablas).reducir()
+        self.tablas = []
+        self.grupos_pendientes = 0
+        return detectar_desde_votos(votos, archivos_Q, archivos_R, self.ventana_duracion, self.k_min,
+                                    self.margen_desfase, self.umbral_confianza)